@@ -8,11 +8,14 @@ Determine the PMT response curve to correct the detected number of MIPs.
 """
 from __future__ import division
 
+from copy import copy
 from datetime import datetime, timedelta
 from itertools import tee, izip, combinations, chain
+from multiprocessing import Pool
 
 from numpy import (arange, histogram, percentile, linspace, std, nan, isnan,
-                   sqrt, abs, sum)
+                   sqrt, abs, sum, floor, ceil, clip, bincount, zeros,
+                   concatenate, interp, array, sort)
 from scipy.optimize import curve_fit
 
 from ..clusters import HiSPARCStations, HiSPARCNetwork
@@ -100,6 +103,9 @@ class DetermineStationTimingOffsets(object):
     MAX_DISTANCE = 1000  # m
     # Minimum number of timedeltas required to attempt a fit
     MIN_LEN_DT = 100
+    # Maximum absolute timedelta in the rolling histograms, larger values
+    # are only counted as under- or overflow
+    MAX_DT = 10000  # ns
 
     def __init__(self, stations=None, data=None, progress=False,
                  force_stale=False):
@@ -114,6 +120,7 @@ class DetermineStationTimingOffsets(object):
         self.data = data
         self.progress = progress
         self.force_stale = force_stale
+        self._time_deltas = {}
         if stations is not None:
             self.cluster = HiSPARCStations(stations, skip_missing=True,
                                            force_stale=self.force_stale)
@@ -121,15 +128,48 @@ class DetermineStationTimingOffsets(object):
             self.cluster = HiSPARCNetwork(force_stale=self.force_stale)
 
     def read_dt(self, station, ref_station, start, end):
-        """Read timedeltas from HDF5 file"""
+        """Read timedeltas from HDF5 file
 
+        The time deltas of a station pair are read from the file only once,
+        subsequent windows are sliced from the cached (sorted) timestamps.
+        The time deltas are returned in the order in which they are stored.
+
+        """
+        timestamps, order, deltas = self._get_time_deltas(station,
+                                                          ref_station)
+        ts0 = datetime_to_gps(start)
+        ts1 = datetime_to_gps(end)
+        left, right = timestamps.searchsorted([ts0, ts1])
+        # sort a copy, sorting the slice in place would change the cache
+        idx = sort(order[left:right])
+        return deltas[idx]
+
+    def _get_time_deltas(self, station, ref_station):
+        """Get the cached time deltas of a station pair
+
+        The cache is refreshed if the number of rows in the table changed.
+        Without datafile, e.g. in a worker process, only the cached time
+        deltas are available.
+
+        :param station: station number.
+        :param ref_station: reference station number.
+        :return: sorted timestamps, the indexes that sort the rows by
+                 timestamp, and the time deltas in stored order.
+
+        """
+        key = (station, ref_station)
+        if self.data is None:
+            return self._time_deltas[key][1:]
         table_path = '/time_deltas/station_%d/station_%d' % (ref_station,
                                                              station)
         table = self.data.get_node(table_path, 'time_deltas')
-        ts0 = datetime_to_gps(start)  # noqa
-        ts1 = datetime_to_gps(end)  # noqa
-        return table.read_where('(timestamp >= ts0) & (timestamp < ts1)',
-                                field='delta')
+        if (key not in self._time_deltas or
+                self._time_deltas[key][0] != table.nrows):
+            timestamps = table.col('timestamp')
+            order = timestamps.argsort(kind='mergesort')
+            self._time_deltas[key] = (table.nrows, timestamps[order], order,
+                                      table.col('delta'))
+        return self._time_deltas[key][1:]
 
     @memoize
     def _get_gps_timestamps(self, station):
@@ -262,6 +302,20 @@ class DetermineStationTimingOffsets(object):
         left, right = self.determine_first_and_last_date(date, station,
                                                          ref_station)
         r, dz = self._get_r_dz(date, station, ref_station)
+        return self._fit_station_timing_offset(station, ref_station, left,
+                                               right, dz)
+
+    def _fit_station_timing_offset(self, station, ref_station, left, right,
+                                   dz):
+        """Fit the timing offset of a station pair between two dates
+
+        :param station: station number.
+        :param ref_station: reference station number.
+        :param left,right: first and last date of the time deltas to fit.
+        :param dz: vertical distance between the stations.
+        :return: station offset and error.
+
+        """
         dt = self.read_dt(station, ref_station, left, right)
         if len(dt) < self.MIN_LEN_DT:
             s_off, error = nan, nan
@@ -271,13 +325,17 @@ class DetermineStationTimingOffsets(object):
         return s_off, error
 
     def determine_station_timing_offsets(self, station, ref_station,
-                                         start=None, end=None):
+                                         start=None, end=None,
+                                         n_workers=None):
         """Determine the timing offsets between a station pair
 
         :param station: station number.
         :param ref_station: reference station number.
         :param start: datetime.date object.
         :param end: datetime.date object.
+        :param n_workers: optionally divide the days over this number of
+            worker processes, see
+            :meth:`determine_station_timing_offsets_parallel`.
         :return: list of station offsets as tuple (timestamp, offset, error).
 
         """
@@ -287,6 +345,13 @@ class DetermineStationTimingOffsets(object):
         if end is None:
             end = self._datetime(datetime.now())
 
+        if n_workers is not None:
+            dates = [date for date, _ in datetime_range(start, end)]
+            results = self.determine_station_timing_offsets_parallel(
+                [(date, station, ref_station) for date in dates], n_workers)
+            return [(datetime_to_gps(date), s_off, error)
+                    for date, (s_off, error) in izip(dates, results)]
+
         offsets = []
         length = (end - start).days
         for date, _ in pbar(datetime_range(start, end), show=self.progress,
@@ -297,15 +362,140 @@ class DetermineStationTimingOffsets(object):
             offsets.append((ts0, s_off, error))
         return offsets
 
-    def determine_station_timing_offsets_for_date(self, date):
+    def determine_station_timing_offsets_rolling(self, station, ref_station,
+                                                 start=None, end=None):
+        """Determine the timing offsets between a station pair
+
+        Instead of reading and histogramming the timedeltas of each
+        (overlapping) interval again, the timedeltas are binned once using
+        1 ns bins. A running histogram is kept for the interval, going
+        from one day to the next only the timedeltas of the days which
+        enter or leave the interval are added or subtracted, so only the
+        fit is done for each day. The percentiles are interpolated from
+        the histogram, so the offsets differ slightly from those of
+        :meth:`determine_station_timing_offsets`.
+
+        :param station: station number.
+        :param ref_station: reference station number.
+        :param start: datetime.date object.
+        :param end: datetime.date object.
+        :return: list of station offsets as tuple (timestamp, offset, error).
+
+        """
+        if start is None:
+            cuts = self._get_cuts(station, ref_station)
+            start = self._datetime(cuts[0])
+        if end is None:
+            end = self._datetime(datetime.now())
+
+        dates = [self._datetime(date)
+                 for date, _ in datetime_range(start, end)]
+        bounds = [self.determine_first_and_last_date(date, station,
+                                                     ref_station)
+                  for date in dates]
+        first = min(left for left, _ in bounds)
+        n_days = (max(right for _, right in bounds) - first).days
+        edges, bins, day_idx, sums, sums2 = self._get_binned_time_deltas(
+            station, ref_station, first, n_days)
+
+        def histogram_days(d0, d1):
+            return bincount(bins[day_idx[d0]:day_idx[d1]],
+                            minlength=len(edges) + 1)
+
+        y = zeros(len(edges) + 1, 'int64')
+        d0 = d1 = 0
+        offsets = []
+        for date, (left, right) in pbar(izip(dates, bounds),
+                                        show=self.progress,
+                                        length=len(dates)):
+            i0 = (left - first).days
+            i1 = (right - first).days
+            # Move the running histogram from days d0:d1 to days i0:i1
+            if i1 > d1:
+                y += histogram_days(d1, i1)
+            elif i1 < d1:
+                y -= histogram_days(i1, d1)
+            if i0 > d0:
+                y -= histogram_days(d0, i0)
+            elif i0 < d0:
+                y += histogram_days(i0, d0)
+            d0, d1 = i0, i1
+
+            n = y.sum()
+            if n < self.MIN_LEN_DT:
+                s_off, error = nan, nan
+            else:
+                mean = (sums[i1] - sums[i0]) / n
+                std_dt = sqrt(max((sums2[i1] - sums2[i0]) / n - mean ** 2, 0))
+                r, dz = self._get_r_dz(date, station, ref_station)
+                s_off, error = determine_station_timing_offset_from_histogram(
+                    y, edges, std_dt, dz)
+            offsets.append((datetime_to_gps(date), s_off, error))
+        return offsets
+
+    def _get_binned_time_deltas(self, station, ref_station, first, n_days):
+        """Bin the timedeltas of a station pair in 1 ns bins
+
+        The bin indexes are sorted by timestamp, the bin indexes of days
+        i up to j are those from index ``day_idx[i]`` to ``day_idx[j]``.
+        The sums and sums of squares of the timedeltas are cumulative over
+        the days, so the values for days i up to j are given by the
+        difference between element j and element i.
+
+        :param station: station number.
+        :param ref_station: reference station number.
+        :param first: datetime of the first day.
+        :param n_days: number of days.
+        :return: bin edges, bin index of each timedelta with the under- and
+                 overflow in the first and last bin, index of the first
+                 timedelta of each day, cumulative sums and cumulative
+                 sums of squares of the timedeltas.
+
+        """
+        timestamps, order, deltas = self._get_time_deltas(station,
+                                                          ref_station)
+        ts0 = datetime_to_gps(first)
+        left, right = timestamps.searchsorted([ts0, ts0 + n_days * 86400])
+        day_idx = timestamps[left:right].searchsorted(
+            ts0 + 86400 * arange(n_days + 1))
+        days = (timestamps[left:right].astype('int64') - ts0) // 86400
+        deltas = deltas[order[left:right]]
+
+        if len(deltas):
+            lo = floor(max(deltas.min(), -self.MAX_DT))
+            hi = floor(min(deltas.max(), self.MAX_DT)) + 1
+        else:
+            lo, hi = 0, 1
+        edges = arange(lo, hi + 1)
+        bins = clip(floor(deltas - lo).astype('int64') + 1, 0, len(edges))
+
+        sums = bincount(days, weights=deltas, minlength=n_days).cumsum()
+        sums2 = bincount(days, weights=deltas ** 2,
+                         minlength=n_days).cumsum()
+
+        return (edges, bins, day_idx, concatenate([[0.], sums]),
+                concatenate([[0.], sums2]))
+
+    def determine_station_timing_offsets_for_date(self, date, n_workers=None):
         """Determine the timing offsets between a station pair
 
         :param date: date for which to determine offsets as datetime.date.
+        :param n_workers: optionally divide the station pairs over this
+            number of worker processes, see
+            :meth:`determine_station_timing_offsets_parallel`.
         :return: list of station offsets as tuple
                  (station, ref_station, offset, error).
 
         """
-        station_pairs = self.get_station_pairs_within_max_distance(date)
+        station_pairs = list(self.get_station_pairs_within_max_distance(date))
+        if n_workers is not None:
+            results = self.determine_station_timing_offsets_parallel(
+                [(date, station, ref_station)
+                 for station, ref_station in station_pairs], n_workers)
+            return [(station, ref_station, s_off, error)
+                    for (station, ref_station), (s_off, error)
+                    in izip(station_pairs, results)]
+
         offsets = []
         for station, ref_station in station_pairs:
             s_off, error = self.determine_station_timing_offset(date, station,
@@ -313,6 +503,62 @@ class DetermineStationTimingOffsets(object):
             offsets.append((station, ref_station, s_off, error))
         return offsets
 
+    def determine_station_timing_offsets_parallel(self, tasks, n_workers=2):
+        """Determine timing offsets for many pairs and dates in parallel
+
+        The tasks are split into chunks, which are divided over a pool of
+        worker processes. The time deltas of the station pairs are read by
+        this process and passed to each worker once, when it is started,
+        because worker processes can not safely read from the open
+        datafile. The date bounds and vertical distances, which may require
+        API lookups, are also determined by this process, so the workers
+        only select and fit the time deltas. The results are the same as
+        those of
+        :meth:`determine_station_timing_offset` for each task.
+
+        :param tasks: list of (date, station, ref_station) tuples.
+        :param n_workers: number of worker processes.
+        :return: list of station offset and error for each task.
+
+        """
+        if not len(tasks):
+            return []
+
+        fit_tasks = []
+        for date, station, ref_station in tasks:
+            date = self._datetime(date)
+            left, right = self.determine_first_and_last_date(date, station,
+                                                             ref_station)
+            _, dz = self._get_r_dz(date, station, ref_station)
+            fit_tasks.append((station, ref_station, left, right, dz))
+
+        n_chunks = min(len(fit_tasks), 4 * n_workers)
+        chunks = [fit_tasks[i * len(fit_tasks) // n_chunks:
+                            (i + 1) * len(fit_tasks) // n_chunks]
+                  for i in range(n_chunks)]
+
+        # The open datafile can not be passed to the workers, instead the
+        # cached time deltas of all pairs are passed along.
+        determine = copy(self)
+        determine.data = None
+        determine.progress = False
+        determine._time_deltas = {}
+        for _, station, ref_station in tasks:
+            self._get_time_deltas(station, ref_station)
+            key = (station, ref_station)
+            determine._time_deltas[key] = self._time_deltas[key]
+
+        pool = Pool(n_workers, _init_station_timing_offsets_worker,
+                    (determine,))
+        try:
+            results = pool.map(_determine_station_timing_offsets, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+        return [result for chunk_results in results
+                for result in chunk_results]
+
     def get_station_pairs_within_max_distance(self, date=None):
         """Iterator that yields stations pairs that are close to each other"""
 
@@ -328,6 +574,40 @@ class DetermineStationTimingOffsets(object):
                     yield s2, s1
 
 
+# Object used for all chunks, set in each worker process
+_station_timing_offsets_worker = None
+
+
+def _init_station_timing_offsets_worker(determine):
+    """Initialize a worker process for determining station timing offsets
+
+    :param determine: :class:`DetermineStationTimingOffsets` object
+        without data, with the cached time deltas of the station pairs.
+
+    """
+    global _station_timing_offsets_worker
+    _station_timing_offsets_worker = determine
+
+
+def _determine_station_timing_offsets(tasks):
+    """Determine the station timing offsets for a chunk of tasks
+
+    Worker function for
+    :meth:`DetermineStationTimingOffsets.determine_station_timing_offsets_parallel`,
+    the worker should be initialized by
+    :func:`_init_station_timing_offsets_worker`.
+
+    :param tasks: list of (station, ref_station, left, right, dz) tuples,
+        with the date bounds and vertical distance of the station pair.
+    :return: list of station offset and error for each task.
+
+    """
+    determine = _station_timing_offsets_worker
+    return [determine._fit_station_timing_offset(station, ref_station, left,
+                                                 right, dz)
+            for station, ref_station, left, right, dz in tasks]
+
+
 def determine_station_timing_offset(dt, dz=0):
     """Determine the timing offset between stations.
 
@@ -350,6 +630,53 @@ def determine_station_timing_offset(dt, dz=0):
     return station_offset, station_offset_error
 
 
+def determine_station_timing_offset_from_histogram(counts, edges, std_dt,
+                                                   dz=0):
+    """Determine the timing offset between stations from a histogram.
+
+    Like :func:`determine_station_timing_offset`, but the time differences
+    are given as a histogram with narrow bins. The percentiles are
+    interpolated from the histogram and the bins used in the fit are
+    combinations of the narrow bins.
+
+    :param counts: histogram of the time differences, with the number of
+                   time differences below and above the edges in the first
+                   and last element.
+    :param edges: equally spaced bin edges of the histogram.
+    :param std_dt: standard deviation of the time differences.
+    :param dz: height difference between the stations (z - z_ref).
+    :return: mean of a gaussian fit to the data corrected for height, and
+             the error of the mean.
+
+    """
+    n = counts.sum()
+    if not n:
+        return nan, nan
+    # Number of time differences below each edge
+    cumulative = counts.cumsum()[:-1]
+    p = interp(array([0.5, 99.5]) / 100 * (n - 1) + 0.5, cumulative, edges)
+    # Same number of bins as determine_station_timing_offset
+    n_edges = min(int(p[1] - p[0]), int(n / 4), 200)
+    if n_edges < 2:
+        return nan, nan
+    width = edges[1] - edges[0]
+    i0 = int(floor((p[0] - edges[0]) / width))
+    i1 = int(ceil((p[1] - edges[0]) / width))
+    step = max(int(round((i1 - i0) / (n_edges - 1))), 1)
+    n_bins = int(ceil((i1 - i0) / step))
+    y = zeros(n_bins * step, 'int64')
+    narrow = counts[1 + i0:min(1 + i0 + n_bins * step, len(counts) - 1)]
+    y[:len(narrow)] = narrow
+    y = y.reshape(n_bins, step).sum(axis=1)
+    bins = edges[0] + width * (i0 + step * arange(n_bins + 1))
+    station_offset, station_offset_error = fit_histogram_timing_offset(
+        y, bins, n, std_dt)
+    station_offset += dz / c
+    if abs(station_offset) > 1000:
+        return nan, nan
+    return station_offset, station_offset_error
+
+
 def fit_timing_offset(dt, bins):
     """Fit the time difference distribution.
 
@@ -359,10 +686,24 @@ def fit_timing_offset(dt, bins):
 
     """
     y, bins = histogram(dt, bins=bins)
+    return fit_histogram_timing_offset(y, bins, len(dt), std(dt))
+
+
+def fit_histogram_timing_offset(y, bins, n, std_dt):
+    """Fit a histogram of the time difference distribution.
+
+    :param y: histogram counts.
+    :param bins: bins edges of the histogram.
+    :param n: total number of time differences, initial amplitude.
+    :param std_dt: standard deviation of the time differences, initial
+                   width.
+    :return: mean of a gaussian fit to the data and the error of the mean.
+
+    """
     x = (bins[:-1] + bins[1:]) / 2
     sigma = sqrt(y + 1)
     try:
-        popt, pcov = curve_fit(gauss, x, y, p0=(len(dt), 0., std(dt)),
+        popt, pcov = curve_fit(gauss, x, y, p0=(n, 0., std_dt),
                                sigma=sigma, absolute_sigma=False)
         offset = popt[1]
         width = popt[2]
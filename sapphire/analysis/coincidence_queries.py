@@ -1,6 +1,7 @@
 import re
 import itertools
 import warnings
+from bisect import bisect_left
 
 import tables
 
@@ -149,15 +150,62 @@ class CoincidenceQuery(object):
     def timerange(self, start, stop, iterator=False):
         """Query based on timestamps
 
+        If the coincidences are sorted by timestamp, which is the case
+        for coincidences stored by
+        :class:`~sapphire.analysis.coincidences.CoincidencesESD`, the
+        matching rows are found using a binary search on the timestamp
+        column.  Only those rows are read.  Otherwise the condition is
+        checked for all rows, using the column index if there is one.
+
         :param start: timestamp from which to look for coincidences.
         :param stop: end timestamp for coincidences.
         :return: coincidences within the specified timerange.
 
         """
-        query = '(%d <= timestamp) & (timestamp < %d)' % (start, stop)
-        filtered_coincidences = self.perform_query(query, iterator)
+        if self._is_sorted('timestamp'):
+            first, last = self._get_row_range('timestamp', start, stop)
+            if iterator:
+                filtered_coincidences = self.coincidences.iterrows(first,
+                                                                   last)
+            else:
+                filtered_coincidences = self.coincidences.read(first, last)
+        else:
+            query = '(%d <= timestamp) & (timestamp < %d)' % (start, stop)
+            filtered_coincidences = self.perform_query(query, iterator)
         return filtered_coincidences
 
+    def _is_sorted(self, column):
+        """Check if the coincidences table is sorted by a column
+
+        Coincidences stored by
+        :class:`~sapphire.analysis.coincidences.CoincidencesESD` are
+        sorted by time, this is marked by the ``sorted_by_timestamp``
+        attribute of the table.
+
+        :param column: name of the column.
+        :return: True if the values in the column are non-decreasing.
+
+        """
+        return (column in ('timestamp', 'ext_timestamp') and
+                'sorted_by_timestamp' in self.coincidences._v_attrs)
+
+    def _get_row_range(self, column, start, stop):
+        """Find the rows with values in a sorted column within a range
+
+        Uses a binary search, which only reads a few values from the
+        column.
+
+        :param column: name of a sorted column.
+        :param start: values from which to look for rows.
+        :param stop: end value for rows.
+        :return: first and last (exclusive) row in the range.
+
+        """
+        values = self.coincidences.cols._f_col(column)
+        first = bisect_left(values, start)
+        last = bisect_left(values, stop, first)
+        return first, last
+
     def _add_timestamp_filter(self, query, start=None, stop=None):
         """Add timestamp filter to the query
 
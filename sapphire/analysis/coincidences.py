@@ -31,6 +31,10 @@
 
 """
 import os.path
+from collections import deque
+from heapq import merge
+from itertools import izip
+from multiprocessing import Pool
 
 import tables
 import numpy as np
@@ -157,7 +161,8 @@ class Coincidences(object):
         self.process_events()
         self.store_coincidences()
 
-    def search_coincidences(self, window=10000, shifts=None, limit=None):
+    def search_coincidences(self, window=10000, shifts=None, limit=None,
+                            chunksize=None, n_workers=None):
         """Search for coincidences.
 
         Search all data in the station_groups for coincidences, and store
@@ -184,10 +189,33 @@ class Coincidences(object):
             Use 'None' for no shift.
         :param limit: optionally limit the search for this number of
             events.
+        :param chunksize: optionally search out-of-core, reading at most
+            this number of events per station at a time.  This puts a
+            ceiling on the memory used while searching long periods.  The
+            event tables must be sorted by ``ext_timestamp``.  In this
+            case _src_timestamps only contains the events which are part
+            of a coincidence.
+        :param n_workers: optionally search in parallel, using this number
+            of worker processes.  The timestamps are split into slices of
+            time which are searched separately.  The result is identical
+            to that of a serial search.  Can not be combined with
+            chunksize.
 
         """
-        c_index, timestamps = \
-            self._search_coincidences(window, shifts, limit)
+        if chunksize is not None and n_workers is not None:
+            raise RuntimeError("The out-of-core search can not be "
+                               "combined with a parallel search.")
+        if chunksize is not None:
+            c_index, timestamps = \
+                self._search_coincidences_chunked(window, shifts, limit,
+                                                  chunksize)
+        elif n_workers is not None:
+            c_index, timestamps = \
+                self._search_coincidences_parallel(window, shifts, limit,
+                                                   n_workers)
+        else:
+            c_index, timestamps = \
+                self._search_coincidences(window, shifts, limit)
         timestamps = np.array(timestamps, dtype=np.uint64)
         self.data.create_array(self.coincidence_group, '_src_timestamps',
                                timestamps)
@@ -241,13 +269,19 @@ class Coincidences(object):
                               progress=self.progress)
             process.process_and_store_results(overwrite=overwrite)
 
-    def store_coincidences(self):
+    def store_coincidences(self, blocksize=None):
         """Store the previously found coincidences.
 
         After you have searched for coincidences, you can store the
         more user-friendly results in the coincidences group using this
         method.
 
+        :param blocksize: optionally store the coincidences in blocks of
+            this number of coincidences, instead of one at a time.  The
+            events of each block are read per station and appended to
+            the observables table at once, which is much faster.  The
+            stored results are identical.
+
         """
         self.c_index = []
         self.coincidences = self.data.create_table(self.coincidence_group,
@@ -257,9 +291,16 @@ class Coincidences(object):
                                                   'observables',
                                                   storage.EventObservables)
 
-        for coincidence in pbar(self.coincidence_group._src_c_index,
-                                show=self.progress):
-            self._store_coincidence(coincidence)
+        src_c_index = self.coincidence_group._src_c_index
+        if blocksize is None:
+            for coincidence in pbar(src_c_index, show=self.progress):
+                self._store_coincidence(coincidence)
+        else:
+            src_timestamps = self.coincidence_group._src_timestamps.read()
+            for start in pbar(xrange(0, len(src_c_index), blocksize),
+                              show=self.progress):
+                block = src_c_index.read(start, start + blocksize)
+                self._store_coincidences_block(block, src_timestamps)
 
         c_index = self.data.create_vlarray(self.coincidence_group, 'c_index',
                                            tables.UInt32Col())
@@ -302,6 +343,61 @@ class Coincidences(object):
         self.c_index.append(observables_idx)
         self.coincidences.flush()
 
+    def _store_coincidences_block(self, coincidences, src_timestamps):
+        """Store a block of coincidences in the coincidence group.
+
+        Block version of :meth:`_store_coincidence`.  The events are read
+        from the event tables per station, and the coincidences and
+        observables are each appended in one go.  Observables are stored
+        in the same order as by :meth:`_store_coincidence`, so the
+        c_index is identical.
+
+        :param coincidences: list of coincidences, each a list of indexes
+            into the src_timestamps.
+        :param src_timestamps: array of (timestamp, station index, event
+            index) rows, the contents of ``_src_timestamps``.
+
+        """
+        lengths = np.array([len(c) for c in coincidences])
+        events = src_timestamps[np.concatenate(coincidences)]
+        station_ids = events[:, 1]
+        event_indexes = events[:, 2]
+
+        observables_id = len(self.observables)
+        observables = np.zeros(len(events), dtype=self.observables.dtype)
+        observables['id'] = np.arange(observables_id,
+                                      observables_id + len(events))
+        observables['station_id'] = station_ids
+        for station_id in np.unique(station_ids):
+            is_station = station_ids == station_id
+            group = self.data.get_node(self.station_groups[int(station_id)])
+            station_events = group.events.read_coordinates(
+                event_indexes[is_station])
+            for key in ('timestamp', 'nanoseconds', 'ext_timestamp',
+                        'n1', 'n2', 'n3', 'n4', 't1', 't2', 't3', 't4'):
+                observables[key][is_station] = station_events[key]
+        signals = [observables[key] for key in 'n1', 'n2', 'n3', 'n4']
+        observables['N'] = (np.array(signals) > self.trig_threshold).sum(0)
+
+        # first event of each coincidence, by ext_timestamp
+        starts = np.cumsum(lengths) - lengths
+        coincidence_number = np.repeat(np.arange(len(lengths)), lengths)
+        order = np.lexsort((observables['ext_timestamp'], coincidence_number))
+        first = observables[order[starts]]
+
+        coincidence_id = len(self.coincidences)
+        rows = np.zeros(len(lengths), dtype=self.coincidences.dtype)
+        rows['id'] = np.arange(coincidence_id, coincidence_id + len(lengths))
+        rows['N'] = lengths
+        for key in ('ext_timestamp', 'timestamp', 'nanoseconds'):
+            rows[key] = first[key]
+
+        self.observables.append(observables)
+        self.observables.flush()
+        self.coincidences.append(rows)
+        self.coincidences.flush()
+        self.c_index.extend(np.split(observables['id'], starts[1:]))
+
     def _store_event_in_observables(self, event, coincidence_id,
                                     station_id):
         """Store a single event in the observables table."""
@@ -349,18 +445,103 @@ class Coincidences(object):
             station's event table.
 
         """
-        # get the 'events' tables from the groups or groupnames
+        event_tables = self._get_event_tables()
+
+        timestamps = self._retrieve_timestamps(event_tables, shifts, limit)
+        coincidences = self._do_search_coincidences(timestamps, window)
+
+        return coincidences, timestamps
+
+    def _search_coincidences_chunked(self, window=10000, shifts=None,
+                                     limit=None, chunksize=100000):
+        """Search for coincidences without loading all timestamps at once
+
+        Out-of-core version of :meth:`_search_coincidences`.  The
+        timestamps of the stations are read in chunks and merged, and
+        coincidences are searched while merging.  Only the events which
+        are part of a coincidence are kept in memory.
+
+        :param window: the time window in nanoseconds which will be searched
+            for coincidences.  Events falling outside this window will not be
+            part of the coincidence.  Default: 10000 (i.e. 10 us).
+        :param shifts: a list of time shifts in seconds, use 'None' for no
+            shift.
+        :param limit: limit the number of events which are processed.
+        :param chunksize: maximum number of events which are read from a
+            station's event table at once.
+
+        :return: coincidences, timestamps. As returned by
+            :meth:`_search_coincidences`, except that the timestamps only
+            contain the events which are part of a coincidence.
+
+        """
+        event_tables = self._get_event_tables()
+
+        timestamps = self._iter_timestamps(event_tables, shifts, limit,
+                                           chunksize)
+
+        coincidences = []
+        coincidence_timestamps = []
+        last_index = -1
+        for c in self._do_search_coincidences_chunked(timestamps, window):
+            # Events shared with the previous coincidence are already
+            # stored, they are at the end of coincidence_timestamps.
+            n_stored = len(coincidence_timestamps)
+            coincidence = []
+            for index, timestamp in c:
+                if index > last_index:
+                    coincidence_timestamps.append(timestamp)
+                    coincidence.append(len(coincidence_timestamps) - 1)
+                else:
+                    coincidence.append(n_stored - 1 - (last_index - index))
+            last_index = c[-1][0]
+            coincidences.append(coincidence)
+
+        return coincidences, coincidence_timestamps
+
+    def _search_coincidences_parallel(self, window=10000, shifts=None,
+                                      limit=None, n_workers=2):
+        """Search for coincidences using multiple processes
+
+        Parallel version of :meth:`_search_coincidences`.  The sorted
+        timestamps are split into slices which are searched by separate
+        worker processes, see :meth:`_do_search_coincidences_parallel`.
+
+        :param window: the time window in nanoseconds which will be searched
+            for coincidences.  Events falling outside this window will not be
+            part of the coincidence.  Default: 10000 (i.e. 10 us).
+        :param shifts: a list of time shifts in seconds, use 'None' for no
+            shift.
+        :param limit: limit the number of events which are processed.
+        :param n_workers: number of worker processes.
+
+        :return: coincidences, timestamps. As returned by
+            :meth:`_search_coincidences`.
+
+        """
+        event_tables = self._get_event_tables()
+
+        timestamps = self._retrieve_timestamps(event_tables, shifts, limit)
+        coincidences = self._do_search_coincidences_parallel(
+            timestamps, window, n_workers)
+
+        return coincidences, timestamps
+
+    def _get_event_tables(self):
+        """Get the 'events' tables from the station groups
+
+        Station groups without an events table are skipped.
+
+        :return: list of event tables.
+
+        """
         event_tables = []
         for station_group in self.station_groups:
             station_group = self.data.get_node(station_group)
             if 'events' in station_group:
                 event_tables.append(self.data.get_node(station_group,
                                                        'events'))
-
-        timestamps = self._retrieve_timestamps(event_tables, shifts, limit)
-        coincidences = self._do_search_coincidences(timestamps, window)
-
-        return coincidences, timestamps
+        return event_tables
 
     def _retrieve_timestamps(self, event_tables, shifts=None, limit=None):
         """Retrieve all timestamps from all stations, optionally shifting them
@@ -409,6 +590,80 @@ class Coincidences(object):
 
         return timestamps
 
+    def _iter_timestamps(self, event_tables, shifts=None, limit=None,
+                         chunksize=100000):
+        """Iterate over timestamps from all stations, optionally shifted
+
+        Chunked counterpart of :meth:`_retrieve_timestamps`.  The
+        timestamps of each station are read in chunks of at most
+        chunksize events, and the stations are merged into a single
+        sorted stream.  The event tables must be sorted by
+        ``ext_timestamp``.
+
+        :param event_tables: a list of HiSPARC event tables, usually from
+            different stations.
+        :param shifts: a list of time shifts in seconds, use 'None' for no
+            shift.
+        :param limit: limit the number of events which are processed.
+        :param chunksize: maximum number of events which are read from an
+            event table at once.
+
+        :return: generator of tuples, in the same order and format as the
+            list returned by :meth:`_retrieve_timestamps`.
+
+        """
+        # calculate the shifts in nanoseconds and cast them to int.
+        # (prevent upcasting timestamps to float64 further on)
+        if shifts is not None:
+            shifts = [int(shift * 1e9) if shift is not None else shift
+                      for shift in shifts]
+
+        streams = []
+        for s_id, event_table in enumerate(event_tables):
+            try:
+                shift = shifts[s_id]
+            except (TypeError, IndexError):
+                # shift is None or doesn't exist
+                shift = None
+            streams.append(self._iter_station_timestamps(
+                event_table, s_id, shift, limit, chunksize))
+
+        return merge(*streams)
+
+    @staticmethod
+    def _iter_station_timestamps(event_table, s_id, shift=None, limit=None,
+                                 chunksize=100000):
+        """Iterate over the timestamps of one station in chunks
+
+        :param event_table: a HiSPARC event table sorted by ext_timestamp.
+        :param s_id: index of the station in the stations list.
+        :param shift: time shift in nanoseconds, or None for no shift.
+        :param limit: limit the number of events which are processed.
+        :param chunksize: maximum number of events read at once.
+
+        :return: generator of (timestamp, station index, event index)
+            tuples.
+
+        """
+        # same number of events as event_table.col('ext_timestamp')[:limit]
+        nrows = slice(limit).indices(len(event_table))[1]
+
+        previous = None
+        for start in xrange(0, nrows, chunksize):
+            stop = min(start + chunksize, nrows)
+            ts = event_table.read(start, stop, field='ext_timestamp')
+            if shift is not None:
+                # shift data. carefully avoid upcasting to float64, which
+                # doesn't hold the precision to store nanoseconds.
+                ts = (ts.astype(np.int64) + shift).astype(np.uint64)
+            if ((ts[1:] < ts[:-1]).any() or
+                    (previous is not None and ts[0] < previous)):
+                raise RuntimeError("Events are not sorted by ext_timestamp, "
+                                   "use the in-memory search instead.")
+            previous = ts[-1]
+            for j, x in enumerate(ts, start):
+                yield x, s_id, j
+
     def _do_search_coincidences(self, timestamps, window):
         """Search for coincidences in a set of timestamps
 
@@ -469,6 +724,108 @@ class Coincidences(object):
 
         return coincidences
 
+    def _do_search_coincidences_chunked(self, timestamps, window):
+        """Search for coincidences in a stream of timestamps
+
+        Streaming counterpart of :meth:`_do_search_coincidences`.  Only
+        the timestamps within one coincidence window of the current
+        timestamp are kept in memory, so the search can continue over
+        chunk boundaries without losing or duplicating coincidences.
+
+        :param timestamps: an iterable of sorted tuples (timestamp,
+            station_idx, event_idx) which will be searched
+        :param window: the time window in nanoseconds which will be searched
+            for coincidences.  Events falling outside this window will not be
+            part of the coincidence.
+
+        :return: generator of coincidences, which each consist of a list
+            of (index, timestamp tuple) pairs, where index is the position
+            of the timestamp in the stream.
+
+        """
+        pending = deque()
+        prev_end = -1
+
+        def complete_coincidence():
+            t0 = pending[0][1][0]
+            c = []
+            for index, timestamp in pending:
+                if timestamp[0] - t0 < window:
+                    c.append((index, timestamp))
+                else:
+                    break
+            pending.popleft()
+            return c
+
+        for index, timestamp in enumerate(timestamps):
+            pending.append((index, timestamp))
+            # the coincidence starting at the oldest timestamp is complete
+            # once a timestamp outside its window has been seen
+            while timestamp[0] - pending[0][1][0] >= window:
+                c = complete_coincidence()
+                # only new if not part of the previous coincidence
+                if len(c) > 1 and c[-1][0] > prev_end:
+                    prev_end = c[-1][0]
+                    yield c
+
+        while pending:
+            c = complete_coincidence()
+            if len(c) > 1 and c[-1][0] > prev_end:
+                prev_end = c[-1][0]
+                yield c
+
+    def _do_search_coincidences_parallel(self, timestamps, window,
+                                         n_workers=2):
+        """Search for coincidences in a set of timestamps in parallel
+
+        Parallel counterpart of :meth:`_do_search_coincidences`.  The
+        sorted timestamps are split into consecutive slices, one for each
+        worker.  Each slice is extended by one timestamp before and by one
+        coincidence window after it, so that a worker can decide for every
+        timestamp in its slice whether it starts a new coincidence.  The
+        results are joined in order of the slices, which gives exactly the
+        same coincidences, in the same order, as the serial search.
+
+        :param timestamps: a sorted list of tuples (timestamp, station_idx,
+            event_idx) which will be searched
+        :param window: the time window in nanoseconds which will be searched
+            for coincidences.  Events falling outside this window will not be
+            part of the coincidence.
+        :param n_workers: number of worker processes.
+
+        :return: a list of coincidences, which each consist of a list with
+            indexes into the timestamps array as a pointer to the events
+            making up the coincidence
+
+        """
+        n_timestamps = len(timestamps)
+        if not n_timestamps:
+            return []
+
+        ts = np.array([t[0] for t in timestamps], dtype=np.uint64)
+        # only integer differences are compared with the window, avoid
+        # upcasting the timestamps to float64.
+        window = np.uint64(np.ceil(window))
+
+        slices = []
+        bounds = np.linspace(0, n_timestamps, n_workers + 1).astype(int)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if start == stop:
+                continue
+            first = max(start - 1, 0)
+            last = np.searchsorted(ts, ts[stop - 1] + window)
+            slices.append((ts[first:last], window, first, start - first,
+                           stop - first))
+
+        pool = Pool(n_workers)
+        try:
+            results = pool.map(_search_coincidences_in_slice, slices)
+        finally:
+            pool.close()
+            pool.join()
+
+        return [c for coincidences in results for c in coincidences]
+
 
 class CoincidencesESD(Coincidences):
     """Store coincidences specifically using the ESD
@@ -537,7 +894,49 @@ class CoincidencesESD(Coincidences):
 
     The ``event`` is one of the events in the coincidence.
 
+    If new events are regularly appended to the event tables, the
+    coincidences can be updated incrementally instead of being searched
+    again from scratch::
+
+        >>> coin = CoincidencesESD(data, '/coincidences', station_groups,
+        ...                        incremental=True)
+        >>> coin.search_and_store_coincidences()
+
+    The first time this searches all events, later only the new events
+    are searched and the new coincidences are appended to the tables.
+
     """
+    def __init__(self, data, coincidence_group, station_groups,
+                 overwrite=False, progress=True, incremental=False):
+        """Initialize the class.
+
+        :param data: the PyTables datafile.
+        :param coincidence_group: the destination group.
+        :param station_groups: a list of groups containing the station
+            data.
+        :param overwrite: if True, overwrite a previous coincidences
+            group.
+        :param progress: if True, show a progressbar while storing
+            coincidences.
+        :param incremental: if True, continue the coincidences in an
+            existing coincidences group which was created by a previous
+            incremental search, instead of raising an error.  The event
+            tables must be sorted by ``ext_timestamp`` and new events may
+            only be appended to them.
+
+        """
+        if (incremental and not overwrite and
+                coincidence_group is not None and coincidence_group in data):
+            super(CoincidencesESD, self).__init__(data, None, station_groups,
+                                                  overwrite, progress)
+            self.coincidence_group = data.get_node(coincidence_group)
+        else:
+            super(CoincidencesESD, self).__init__(data, coincidence_group,
+                                                  station_groups, overwrite,
+                                                  progress)
+        self.incremental = incremental
+        self._shifts = None
+
     def search_and_store_coincidences(self, window=10000,
                                       station_numbers=None):
         """Search and store coincidences.
@@ -549,7 +948,8 @@ class CoincidencesESD(Coincidences):
         self.search_coincidences(window=window)
         self.store_coincidences(station_numbers=station_numbers)
 
-    def search_coincidences(self, window=10000, shifts=None, limit=None):
+    def search_coincidences(self, window=10000, shifts=None, limit=None,
+                            chunksize=None, n_workers=None):
         """Search for coincidences.
 
         Search all data in the station_groups for coincidences, and store
@@ -574,11 +974,48 @@ class CoincidencesESD(Coincidences):
             Expects a list of shifts, one for each station.
         :param limit: optionally limit the search for this number of
             events.
+        :param chunksize: optionally search out-of-core, reading at most
+            this number of events per station at a time.  This puts a
+            ceiling on the memory used while searching long periods.  The
+            event tables must be sorted by ``ext_timestamp``.  In this
+            case ``_src_timestamps`` only contains the events which are
+            part of a coincidence.
+        :param n_workers: optionally search in parallel, using this number
+            of worker processes.  The timestamps are split into slices of
+            time which are searched separately.  The result is identical
+            to that of a serial search.  Can not be combined with
+            chunksize.
+
+        When the class was initialized with ``incremental=True`` only the
+        events which are new since the previous search are searched,
+        together with events within twice the window before them.  The
+        shifts, limit, chunksize and n_workers options are not supported
+        in that case.
 
         """
-        c_index, timestamps = self._search_coincidences(window, shifts, limit)
+        if self.incremental:
+            if (shifts, limit, chunksize, n_workers) != (None,) * 4:
+                raise RuntimeError("The incremental search does not support "
+                                   "shifts, limit, chunksize or n_workers.")
+            (c_index, timestamps, self._n_previous,
+             self._searched_until) = self._search_coincidences_incremental(
+                window)
+            self._window = window
+        elif chunksize is not None and n_workers is not None:
+            raise RuntimeError("The out-of-core search can not be "
+                               "combined with a parallel search.")
+        elif chunksize is not None:
+            c_index, timestamps = self._search_coincidences_chunked(
+                window, shifts, limit, chunksize)
+        elif n_workers is not None:
+            c_index, timestamps = self._search_coincidences_parallel(
+                window, shifts, limit, n_workers)
+        else:
+            c_index, timestamps = self._search_coincidences(window, shifts,
+                                                            limit)
         self._src_timestamps = timestamps
         self._src_c_index = c_index
+        self._shifts = shifts
 
     def store_coincidences(self, station_numbers=None):
         """Store the previously found coincidences.
@@ -608,6 +1045,10 @@ class CoincidencesESD(Coincidences):
             s_columns = {'s%d' % n: tables.BoolCol(pos=(n + 12))
                          for n, _ in enumerate(self.station_groups)}
 
+        if self.incremental and 'coincidences' in self.coincidence_group:
+            self._store_new_coincidences()
+            return
+
         description = storage.Coincidence
         description.columns.update(s_columns)
         self.coincidences = self.data.create_table(
@@ -626,6 +1067,12 @@ class CoincidencesESD(Coincidences):
             c_index.append(observables_idx)
         c_index.flush()
 
+        # Used by CoincidenceQuery.timerange to search the sorted rows.  The
+        # coincidences are ordered by the shifted timestamps, but the
+        # unshifted timestamps are stored.
+        if self._shifts is None or self._is_sorted_by_timestamp():
+            self.coincidences._v_attrs.sorted_by_timestamp = True
+
         s_index = self.data.create_vlarray(
             self.coincidence_group, 's_index', tables.VLStringAtom(),
             expectedrows=len(self.station_groups))
@@ -633,6 +1080,159 @@ class CoincidencesESD(Coincidences):
             s_index.append(station_group)
         s_index.flush()
 
+        if self.incremental:
+            self._store_search_state()
+
+    def _is_sorted_by_timestamp(self):
+        """Check if the stored coincidences are sorted by timestamp
+
+        :return: True if the ext_timestamps are non-decreasing.
+
+        """
+        ext_timestamps = self.coincidences.col('ext_timestamp')
+        return bool((ext_timestamps[1:] >= ext_timestamps[:-1]).all())
+
+    def _store_new_coincidences(self):
+        """Append the coincidences of an incremental search
+
+        Previously stored coincidences which were searched again are
+        compared to the new coincidences.  Those which are unchanged are
+        kept, the others are removed after which the new coincidences are
+        appended to the ``coincidences`` and ``c_index`` tables.  This
+        keeps the ids consecutive.
+
+        A VLArray can not be truncated, so if stored coincidences changed
+        (i.e. new events joined them) the ``c_index`` is rebuilt under a
+        temporary name and then moved into place.
+
+        """
+        group = self.coincidence_group
+        if list(group.s_index) != list(self.station_groups):
+            raise RuntimeError("Station groups differ from those of the "
+                               "previous search.")
+        if self.station_numbers is not None:
+            s_columns = ['s%d' % number for number in self.station_numbers]
+        else:
+            s_columns = ['s%d' % n for n, _ in enumerate(self.station_groups)]
+        if not set(s_columns).issubset(group.coincidences.colnames):
+            raise RuntimeError("Station numbers differ from those of the "
+                               "previous search.")
+
+        # Skip the coincidences which were found again unchanged
+        n_kept = 0
+        stored_c_index = group.c_index.iterrows(self._n_previous)
+        for stored, coincidence in izip(stored_c_index, self._src_c_index):
+            observables_idx = [self._src_timestamps[index][1:]
+                               for index in coincidence]
+            if not np.array_equal(stored, observables_idx):
+                break
+            n_kept += 1
+        n_stored = self._n_previous + n_kept
+
+        self.coincidences = group.coincidences
+        self.coincidences.truncate(n_stored)
+
+        self.c_index = []
+        for coincidence in pbar(self._src_c_index[n_kept:],
+                                show=self.progress):
+            self._store_coincidence(coincidence)
+
+        if n_stored == group.c_index.nrows:
+            c_index = group.c_index
+        else:
+            if 'new_c_index' in group:
+                group.new_c_index.remove()
+            c_index = self.data.create_vlarray(
+                group, 'new_c_index', tables.UInt32Col(shape=2),
+                expectedrows=n_stored + len(self.c_index))
+            for observables_idx in group.c_index.iterrows(stop=n_stored):
+                c_index.append(observables_idx)
+        for observables_idx in self.c_index:
+            c_index.append(observables_idx)
+        c_index.flush()
+        if c_index is not group.c_index:
+            c_index.move(group, 'c_index', overwrite=True)
+
+        self._store_search_state()
+
+    def _store_search_state(self):
+        """Store the window and last searched timestamps of the search
+
+        These are used by the next incremental search.
+
+        """
+        attrs = self.coincidence_group._v_attrs
+        attrs.window = self._window
+        attrs.searched_until = self._searched_until
+
+    def _search_coincidences_incremental(self, window=10000):
+        """Search for coincidences including events new since the last search
+
+        For each station the last searched ``ext_timestamp`` is stored in
+        the attributes of the coincidence group.  New events can only be
+        part of coincidences which start less than one window before the
+        earliest of these.  Previously stored coincidences starting before
+        that are kept, the others are searched again.  To determine which
+        coincidences are new, events up to twice the window before the
+        earliest last searched timestamp are included in the search.  The
+        result is identical to searching all events.
+
+        :param window: the time window in nanoseconds which will be searched
+            for coincidences.  Events falling outside this window will not be
+            part of the coincidence.  Default: 10000 (i.e. 10 us).
+
+        :return: coincidences, timestamps, n_previous, searched_until.
+            The coincidences and timestamps as returned by
+            :meth:`_search_coincidences`, but only with the coincidences
+            which are not yet stored.  The number of previously stored
+            coincidences to keep, and for each station the last searched
+            ext_timestamp.
+
+        """
+        event_tables = self._get_event_tables()
+
+        group = self.coincidence_group
+        if 'coincidences' in group:
+            attrs = group._v_attrs
+            if 'searched_until' not in attrs:
+                raise RuntimeError("Previous coincidences were not stored "
+                                   "by an incremental search.")
+            if attrs.window != window or (len(attrs.searched_until) !=
+                                          len(event_tables)):
+                raise RuntimeError("Window or stations differ from those of "
+                                   "the previous search.")
+            # carefully avoid upcasting the timestamps to float64, which
+            # doesn't hold the precision to store nanoseconds.
+            window_ns = int(np.ceil(window))
+            until = int(min(attrs.searched_until))
+            cutoff = np.uint64(max(until - window_ns, 0))
+            start = max(until - 2 * window_ns, 0)
+            n_previous = np.searchsorted(
+                group.coincidences.col('ext_timestamp'), cutoff, 'right')
+        else:
+            cutoff = None
+            start = 0
+            n_previous = 0
+
+        timestamps = []
+        searched_until = []
+        for s_id, event_table in enumerate(event_tables):
+            ext_timestamps = event_table.col('ext_timestamp')
+            first = np.searchsorted(ext_timestamps, np.uint64(start))
+            timestamps.extend((x, s_id, j) for j, x in
+                              enumerate(ext_timestamps[first:], first))
+            searched_until.append(ext_timestamps[-1]
+                                  if len(ext_timestamps) else 0)
+        timestamps.sort()
+
+        coincidences = self._do_search_coincidences(timestamps, window)
+        if cutoff is not None:
+            coincidences = [c for c in coincidences
+                            if timestamps[c[0]][0] > cutoff]
+
+        return (coincidences, timestamps, int(n_previous),
+                np.array(searched_until, dtype=np.uint64))
+
     def _store_coincidence(self, coincidence):
         """Store a single coincidence in the coincidence group.
 
@@ -707,3 +1307,31 @@ def get_events(data, stations, coincidence, timestamps, get_raw_traces=False):
         events.append((stations[station], event, traces))
 
     return events
+
+
+def _search_coincidences_in_slice(args):
+    """Search one slice of timestamps for coincidences
+
+    Worker function for
+    :meth:`Coincidences._do_search_coincidences_parallel`.  A timestamp
+    starts a new coincidence if at least one other timestamp is within
+    the window after it, and if the window reaches further than the
+    window of the preceding timestamp.  Otherwise it is part of the
+    previous coincidence.
+
+    :param args: tuple of the timestamps in the slice, the window, the
+        index of the first timestamp of the slice in all timestamps and
+        the start and stop indexes of the timestamps for which to search.
+
+    :return: list of coincidences, with indexes into all timestamps.
+
+    """
+    ts, window, offset, start, stop = args
+
+    # index of the last timestamp within the window of each timestamp
+    ends = np.searchsorted(ts, ts[:stop] + window) - 1
+    is_new = ends > np.arange(stop)
+    is_new[1:] &= ends[1:] > ends[:-1]
+
+    return [range(offset + i, offset + int(ends[i]) + 1)
+            for i in np.flatnonzero(is_new[start:]) + start]
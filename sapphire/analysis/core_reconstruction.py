@@ -16,16 +16,23 @@
 
 """
 from __future__ import division
-from itertools import izip_longest, combinations
+from itertools import izip_longest, combinations, product
 import warnings
 
-from numpy import isnan, nan, cos, sqrt, mean, array
+from numpy import (isnan, nan, cos, sqrt, mean, array, arange, meshgrid,
+                   newaxis, where, inf, pad, flatnonzero, asarray, errstate,
+                   broadcast_arrays)
+from scipy.optimize import minimize
 
 from .event_utils import station_density, detector_density
 from ..utils import pbar
 from ..simulations import ldf
 
 
+# Index arrays of the combinations of stations, see combination_indexes
+_COMBINATION_INDEXES = {}
+
+
 class EventCoreReconstruction(object):
 
     """Reconstruct core for station events
@@ -267,6 +274,58 @@ class CenterMassAlgorithm(object):
         core_y = sum(density * yi for density, yi in zip(p, y)) / sum(p)
         return core_x, core_y
 
+    @classmethod
+    def reconstruct_common_arrays(cls, p, x, y, z=None, initial={}):
+        """Reconstruct core positions for many events
+
+        Array version of :meth:`reconstruct_common`.
+
+        :param p: detector particle densities in m^-2, with shape (N, k)
+                  for N events and k detectors. Use nan for missing
+                  detectors.
+        :param x,y: positions of the detectors in m, with shape (k,) if
+                    equal for all events, otherwise (N, k).
+        :param z: height of detectors is ignored.
+        :param initial: dictionary containing values from previous
+                        reconstructions, theta may be an array with a value
+                        for each event.
+        :return: arrays of core_x and core_y.
+
+        """
+        p = asarray(p, dtype=float)
+        theta = asarray(initial.get('theta', nan), dtype=float)
+        p = where(isnan(theta), 1., cos(theta))[..., newaxis] * p
+
+        return cls.reconstruct_arrays(p, x, y)
+
+    @staticmethod
+    def reconstruct_arrays(p, x, y):
+        """Calculate center of mass for many events
+
+        Array version of :meth:`reconstruct`, only including the detectors
+        with a valid (not nan) density.
+
+        :param p: detector particle densities in m^-2, with shape (N, k).
+                  Use nan for missing detectors.
+        :param x,y: positions of the detectors in m, with shape (k,) or
+                    (N, k).
+        :return: arrays of core_x and core_y, nan for events without
+                 particles.
+
+        """
+        p, x, y = broadcast_arrays(*[asarray(u, dtype=float)
+                                     for u in (p, x, y)])
+        detected = ~isnan(p)
+        p = where(detected, p, 0.)
+        x = where(detected, x, 0.)
+        y = where(detected, y, 0.)
+
+        total = p.sum(axis=-1)
+        total = where(total == 0, nan, total)
+        core_x = (p * x).sum(axis=-1) / total
+        core_y = (p * y).sum(axis=-1) / total
+        return core_x, core_y
+
 
 class AverageIntersectionAlgorithm(object):
 
@@ -297,28 +356,19 @@ class AverageIntersectionAlgorithm(object):
         if len(p) < 4 or len(x) < 4 or len(y) < 4:
             raise Exception('This algorithm requires at least 4 detections.')
 
-        phit = []
-        xhit = []
-        yhit = []
-        for i in range(len(p)):
-            if p[i] > .01:
-                phit.append(p[i])
-                xhit.append(x[i])
-                yhit.append(y[i])
-
-        statindex = range(len(phit))
-        subsets = combinations(statindex, 3)
+        hit = array(p) > .01
+        phit = array(p)[hit]
+        xhit = array(x)[hit]
+        yhit = array(y)[hit]
+
         m = 3.0  # average value in powerlaw  r ^(-m)  for density
+        zero, one, two = combination_indexes(len(phit), 3).T
 
-        linelist0 = []
-        linelist1 = []
-        for zero, one, two in subsets:
+        with errstate(all='ignore'):
             pp = (phit[zero] / phit[one]) ** (2. / m)
             qq = (phit[zero] / phit[two]) ** (2. / m)
-            if pp == 1:
-                pp = 1.000001
-            if qq == 1:
-                qq = 1.000001
+            pp = where(pp == 1, 1.000001, pp)
+            qq = where(qq == 1, 1.000001, qq)
 
             x0 = xhit[zero]
             x1 = xhit[one]
@@ -333,33 +383,27 @@ class AverageIntersectionAlgorithm(object):
             rsquare = pp * ((x1 - x0) ** 2 + (y1 - y0) ** 2) / ((1 - pp) ** 2)
             ssquare = qq * ((x2 - x0) ** 2 + (y2 - y0) ** 2) / ((1 - qq) ** 2)
             e = c - a
-            f = d - b
-            if d == b:
-                f = 0.000000001
+            f = where(d == b, 0.000000001, d - b)
             g = sqrt(e * e + f * f)
             k = 0.5 * (g * g + rsquare - ssquare) / g
-            linelist0.append(-e / f)
-            linelist1.append((a * e + b * f + g * k) / f)
+            linelist0 = -e / f
+            linelist1 = (a * e + b * f + g * k) / f
 
         newx, newy = CenterMassAlgorithm.reconstruct_common(p, x, y, z,
                                                             initial)
-        subsets = combinations(statindex, 2)
-
-        xpointlist = []
-        ypointlist = []
-        for zero, one in subsets:
-            a = linelist0[zero]
-            b = linelist1[zero]
-            c = linelist0[one]
-            d = linelist1[one]
-            aminc = a - c
-            if a == c:
-                aminc = 0.000000001
+
+        # The lines are selected using combinations of station indexes
+        zero, one = combination_indexes(len(phit), 2).T
+        a = linelist0[zero]
+        b = linelist1[zero]
+        c = linelist0[one]
+        d = linelist1[one]
+        with errstate(all='ignore'):
+            aminc = where(a == c, 0.000000001, a - c)
             xint = (d - b) / aminc
             yint = (a * d - b * c) / aminc
-            if a != c:
-                xpointlist.append(xint)
-                ypointlist.append(yint)
+        xpointlist = xint[a != c]
+        ypointlist = yint[a != c]
 
         subxplist, subyplist = cls.select_newlist(
             newx, newy, xpointlist, ypointlist, 120.)
@@ -377,15 +421,13 @@ class AverageIntersectionAlgorithm(object):
     @staticmethod
     def select_newlist(newx, newy, xpointlist, ypointlist, distance):
         """Select intersection points in square around the mean of old list."""
-        newxlist = []
-        newylist = []
-        for xpoint, ypoint in zip(xpointlist, ypointlist):
-            dr = sqrt((xpoint - newx) ** 2 + (ypoint - newy) ** 2)
-            if dr < distance:
-                newxlist.append(xpoint)
-                newylist.append(ypoint)
+        xpointlist = asarray(xpointlist)
+        ypointlist = asarray(ypointlist)
+        with errstate(invalid='ignore'):
+            dr = sqrt((xpointlist - newx) ** 2 + (ypointlist - newy) ** 2)
+            selected = dr < distance
 
-        return newxlist, newylist
+        return xpointlist[selected], ypointlist[selected]
 
 
 class EllipsLdfAlgorithm(object):
@@ -498,3 +540,121 @@ class EllipsLdfAlgorithm(object):
                     chi2best = chi2
 
         return xbest, ybest, chi2best, factorbest
+
+
+class EllipsLdfFitAlgorithm(EllipsLdfAlgorithm):
+
+    """Core estimator fitting the elliptic LDF
+
+    Same model as :class:`EllipsLdfAlgorithm`, but the chi-squared is
+    evaluated for the entire grid of core positions around the center of
+    mass at once. The best local minima on the grid are then refined with
+    a bounded gradient based minimizer.
+
+    """
+
+    gridsize = 5.
+    gridpoints = 41
+    max_starts = 3
+
+    @classmethod
+    def reconstruct(cls, p, x, y, theta, phi):
+        """Reconstruct the core position and shower size
+
+        :param p: detector particle density in m^-2.
+        :param x,y: positions of detectors in m.
+        :param theta,phi: zenith and azimuth angle in rad.
+        :return: core_x, core_y, chi-squared and shower size.
+
+        """
+        p = array(p, dtype=float)
+        x = array(x, dtype=float)
+        y = array(y, dtype=float)
+        a = ldf.EllipsLdf(zenith=theta, azimuth=phi)
+
+        xcmass, ycmass = CenterMassAlgorithm.reconstruct_common(p, x, y)
+        steps = cls.gridsize * (arange(cls.gridpoints) - cls.gridpoints // 2)
+        xgrid, ygrid = meshgrid(xcmass + steps, ycmass + steps)
+        chi2, sizefactor = cls.chi2(p, x, y, xgrid, ygrid, a)
+        chi2 = where(isnan(chi2), inf, chi2)
+
+        starts = cls.grid_minima(chi2)[:cls.max_starts]
+        if not len(starts):
+            return nan, nan, nan, nan
+        xbest = xgrid.flat[starts[0]]
+        ybest = ygrid.flat[starts[0]]
+        chi2best = chi2.flat[starts[0]]
+        factorbest = sizefactor.flat[starts[0]]
+
+        bounds = [(xgrid.min(), xgrid.max()), (ygrid.min(), ygrid.max())]
+        for start in starts:
+            fit = minimize(
+                lambda core: cls.chi2(p, x, y, core[0], core[1], a)[0],
+                (xgrid.flat[start], ygrid.flat[start]), method='L-BFGS-B',
+                bounds=bounds)
+            if fit.fun < chi2best:
+                xbest, ybest = fit.x
+                chi2best, factorbest = cls.chi2(p, x, y, xbest, ybest, a)
+
+        return xbest, ybest, chi2best, factorbest * ldf.EllipsLdf._Ne
+
+    @staticmethod
+    def grid_minima(chi2):
+        """Find the local minima of the chi-squared on a grid
+
+        :param chi2: 2D array of chi-squared values, not a number values
+                     should be replaced by inf.
+        :return: flat indexes of the grid points which are not larger than
+                 any of their neighbours, sorted by chi-squared.
+
+        """
+        n, m = chi2.shape
+        padded = pad(chi2, 1, 'constant', constant_values=inf)
+        minima = chi2 < inf
+        for i, j in product((0, 1, 2), repeat=2):
+            minima &= chi2 <= padded[i:i + n, j:j + m]
+        idx = flatnonzero(minima)
+        return idx[chi2.flat[idx].argsort()]
+
+    @staticmethod
+    def chi2(p, x, y, core_x, core_y, a):
+        """Goodness of fit of the LDF for one or more core positions
+
+        :param p: array of detector particle densities in m^-2.
+        :param x,y: arrays with the positions of detectors in m.
+        :param core_x,core_y: core position(s) in m.
+        :param a: :class:`~sapphire.simulations.ldf.EllipsLdf` object.
+        :return: chi-squared and the size factor which scales the LDF to
+                 the densities, for each core position.
+
+        """
+        core_x = array(core_x, dtype=float)[..., newaxis]
+        core_y = array(core_y, dtype=float)[..., newaxis]
+        r, angle = a.calculate_core_distance_and_angle(x, y, core_x, core_y)
+        rho = a.calculate_ldf_value(r, angle)
+
+        with warnings.catch_warnings(record=True):
+            rho_sum = rho.sum(axis=-1)
+            sizefactor = sqrt((p * p / rho).sum(axis=-1) / rho_sum)
+            chi2 = 2. * (sizefactor * rho_sum - p.sum())
+        return chi2, sizefactor
+
+
+def combination_indexes(n, k):
+    """Get the indexes of all combinations of k out of n items
+
+    The index arrays are built once for each n and k.
+
+    :param n: number of items.
+    :param k: number of items in each combination.
+    :return: array with shape (number of combinations, k), in the same
+             order as :func:`itertools.combinations`.
+
+    """
+    try:
+        return _COMBINATION_INDEXES[n, k]
+    except KeyError:
+        indexes = array(list(combinations(range(n), k)), dtype=int)
+        indexes = indexes.reshape(-1, k)
+        _COMBINATION_INDEXES[n, k] = indexes
+        return indexes
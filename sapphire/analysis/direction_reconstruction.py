@@ -15,22 +15,35 @@
     reconstructed theta and phi coordinates.
 
 """
+import time
 import warnings
-from itertools import izip_longest, combinations
+from itertools import izip, izip_longest, combinations, repeat
+from multiprocessing import Pool
 
 from numpy import (nan, isnan, arcsin, arccos, arctan2, sin, cos, tan,
-                   sqrt, where, pi, inf, array, cross, dot)
+                   sqrt, where, pi, inf, array, cross, dot, asarray,
+                   broadcast_arrays, errstate, stack, ones, zeros, arange,
+                   array_split, unique, interp, linspace)
 from scipy.optimize import minimize
 
 from .event_utils import (station_arrival_time, detector_arrival_time,
                           relative_detector_arrival_times)
 from ..simulations.showerfront import CorsikaStationFront
-from ..utils import pbar, norm_angle, c, make_relative, vector_length
+from ..utils import (pbar, norm_angle, c, make_relative, vector_length,
+                     get_active_index)
 from ..api import Station
 
 
 NO_OFFSET = [0., 0., 0., 0.]
 
+# Core distances at which the front delay is tabulated, see
+# _front_delay_arrays
+FRONT_TABLE_R = linspace(0., 5000., 10001)
+
+# Tables with the logic checks for each geometry, see logic_checks_arrays
+MAX_LOGIC_CHECKS_TABLES = 100
+_LOGIC_CHECKS_TABLES = {}
+
 
 class EventDirectionReconstruction(object):
 
@@ -41,6 +54,9 @@ class EventDirectionReconstruction(object):
     :meth:`reconstruct_event`. To use other algorithms overwrite the
     ``direct`` and ``fit`` attributes.
 
+    The detector coordinates are cached for each interval in which the
+    station geometry does not change.
+
     :param station: :class:`~sapphire.clusters.Station` object.
 
     """
@@ -49,6 +65,7 @@ class EventDirectionReconstruction(object):
         self.direct = DirectAlgorithmCartesian3D
         self.fit = RegressionAlgorithm3D
         self.station = station
+        self._coordinates = {}
 
     def reconstruct_event(self, event, detector_ids=None, offsets=NO_OFFSET,
                           initial={}):
@@ -69,13 +86,13 @@ class EventDirectionReconstruction(object):
         t, x, y, z, ids = ([], [], [], [], [])
         if detector_ids is None:
             detector_ids = range(4)
-        self.station.cluster.set_timestamp(event['timestamp'])
         if isinstance(offsets, Station):
             offsets = offsets.detector_timing_offset(event['timestamp'])
         for id in detector_ids:
             t_detector = detector_arrival_time(event, id, offsets)
             if not isnan(t_detector):
-                dx, dy, dz = self.station.detectors[id].get_coordinates()
+                dx, dy, dz = self._get_detector_coordinates(
+                    event['timestamp'], id)
                 t.append(t_detector)
                 x.append(dx)
                 y.append(dy)
@@ -89,6 +106,37 @@ class EventDirectionReconstruction(object):
             theta, phi = (nan, nan)
         return theta, phi, ids
 
+    def _get_detector_coordinates(self, timestamp, id):
+        """Get the coordinates of a detector valid at a timestamp
+
+        The cluster timestamp is only set if the coordinates of the detector
+        are not yet cached for the geometry interval of the timestamp.
+
+        :param timestamp: timestamp in seconds.
+        :param id: detector id.
+        :return: x, y, z coordinates of the detector.
+
+        """
+        key = self._get_geometry_interval(timestamp)
+        coordinates = self._coordinates.setdefault(key, {})
+        if id not in coordinates:
+            self.station.cluster.set_timestamp(timestamp)
+            coordinates[id] = self.station.detectors[id].get_coordinates()
+        return coordinates[id]
+
+    def _get_geometry_interval(self, timestamp):
+        """Identify the station geometry active at a timestamp
+
+        :param timestamp: timestamp in seconds.
+        :return: tuple of the position indexes of the station and its
+                 detectors, and the cluster coordinates.
+
+        """
+        indexes = [get_active_index(self.station.timestamps, timestamp)]
+        indexes.extend(get_active_index(detector.timestamps, timestamp)
+                       for detector in self.station.detectors)
+        return tuple(indexes), tuple(self.station.cluster.get_coordinates())
+
     def reconstruct_events(self, events, detector_ids=None, offsets=NO_OFFSET,
                            progress=True, initials=[]):
         """Reconstruct events
@@ -96,18 +144,23 @@ class EventDirectionReconstruction(object):
         :param events: the events table for the station from an ESD data
                        file.
         :param detector_ids: detectors to use for the reconstructions.
-        :param offsets: time offsets for each detector or a
-            :class:`~sapphire.api.Station` object.
+        :param offsets: time offsets for each detector, a
+            :class:`~sapphire.api.Station` object, or an array with the
+            detector offsets for each event, with shape (N, 4).
         :param progress: if True shows a progress bar.
         :param initials: list of dictionaries with already reconstructed shower
                         parameters.
         :return: list of theta, phi, and detector ids.
 
         """
+        if isinstance(offsets, Station) or asarray(offsets).ndim < 2:
+            offsets = repeat(offsets)
         events = pbar(events, show=progress)
         events_init = izip_longest(events, initials, fillvalue={})
-        angles = [self.reconstruct_event(event, detector_ids, offsets, initial)
-                  for event, initial in events_init]
+        angles = [self.reconstruct_event(event, detector_ids, event_offsets,
+                                         initial)
+                  for (event, initial), event_offsets
+                  in izip(events_init, offsets)]
         if len(angles):
             theta, phi, ids = zip(*angles)
         else:
@@ -124,6 +177,10 @@ class CoincidenceDirectionReconstruction(object):
     using :meth:`reconstruct_coincidence`. To use other algorithms
     overwrite the ``direct``,``fit``, and ``curved`` attributes.
 
+    The station coordinates are memoized for each combination of
+    participating stations and the interval in which their geometry does
+    not change. Use :meth:`cache_info` to see how effective this is.
+
     :param cluster: :class:`~sapphire.clusters.BaseCluster` object.
 
     """
@@ -133,6 +190,9 @@ class CoincidenceDirectionReconstruction(object):
         self.fit = RegressionAlgorithm3D
         self.curved = CurvedRegressionAlgorithm3D()
         self.cluster = cluster
+        self._geometry = {}
+        self._cache_hits = 0
+        self._cache_misses = 0
 
     def reconstruct_coincidence(self, coincidence_events, station_numbers=None,
                                 offsets={}, initial={}):
@@ -155,7 +215,6 @@ class CoincidenceDirectionReconstruction(object):
         # Subtract base timestamp to prevent loss of precision
         ts0 = int(coincidence_events[0][1]['timestamp'])
         ets0 = ts0 * int(1e9)
-        self.cluster.set_timestamp(ts0)
         t, x, y, z, nums = ([], [], [], [], [])
 
         # Get relevant offsets. TODO: station offsets
@@ -163,16 +222,18 @@ class CoincidenceDirectionReconstruction(object):
                    else o.detector_timing_offset(ts0)
                    for s, o in offsets.iteritems()}
 
-        for station_number, event in coincidence_events:
-            if station_numbers is not None:
-                if station_number not in station_numbers:
-                    continue
+        stations = self._get_stations(coincidence_events, station_numbers)
+        coordinates = self._get_coordinates(ts0, stations)
+
+        for (station_number, event), (_, station) in izip(coincidence_events,
+                                                          stations):
+            if station is None:
+                continue
             t_off = offsets.get(station_number, NO_OFFSET)
-            station = self.cluster.get_station(station_number)
             t_first = station_arrival_time(event, ets0, offsets=t_off,
                                            station=station)
             if not isnan(t_first):
-                sx, sy, sz = station.calc_center_of_mass_coordinates()
+                sx, sy, sz = coordinates[station_number]
                 t.append(t_first)
                 x.append(sx)
                 y.append(sy)
@@ -190,6 +251,84 @@ class CoincidenceDirectionReconstruction(object):
 
         return theta, phi, nums
 
+    def _get_stations(self, coincidence_events, station_numbers=None):
+        """Get the station objects for the events in a coincidence
+
+        :param coincidence_events: list of (station_number, event) tuples.
+        :param station_numbers: list of station numbers, to only use
+                                events from those stations.
+        :return: list with the station number and station object for each
+                 event, the station is None if it should not be used.
+
+        """
+        return [(station_number, self.cluster.get_station(station_number))
+                if station_numbers is None or station_number in station_numbers
+                else (station_number, None)
+                for station_number, _ in coincidence_events]
+
+    def _get_coordinates(self, timestamp, stations):
+        """Get the coordinates of the stations valid at a timestamp
+
+        The coordinates are memoized for each combination of stations and
+        geometry interval. The cluster timestamp is only set if that
+        combination is not yet cached.
+
+        :param timestamp: timestamp in seconds.
+        :param stations: list of (station number, station object) tuples,
+                         entries without station object are ignored.
+        :return: dictionary with the coordinates for each station number.
+
+        """
+        stations = [(number, station) for number, station in stations
+                    if station is not None]
+        key = self._get_geometry_interval(timestamp, stations)
+        try:
+            coordinates = self._geometry[key]
+        except KeyError:
+            self._cache_misses += 1
+            self.cluster.set_timestamp(timestamp)
+            coordinates = {number: self._station_coordinates(station)
+                           for number, station in stations}
+            self._geometry[key] = coordinates
+        else:
+            self._cache_hits += 1
+        return coordinates
+
+    def _get_geometry_interval(self, timestamp, stations):
+        """Identify the geometry of a set of stations active at a timestamp
+
+        :param timestamp: timestamp in seconds.
+        :param stations: list of (station number, station object) tuples.
+        :return: set of the station numbers with the position indexes of
+                 the station and its detectors, and the cluster coordinates.
+
+        """
+        indexes = frozenset(
+            (number, get_active_index(station.timestamps, timestamp)) +
+            tuple(get_active_index(detector.timestamps, timestamp)
+                  for detector in station.detectors)
+            for number, station in stations)
+        return indexes, tuple(self.cluster.get_coordinates())
+
+    def _station_coordinates(self, station):
+        """Coordinates used for a station in the reconstruction
+
+        :param station: :class:`~sapphire.clusters.Station` object.
+        :return: x, y, z coordinates of the center of mass of the station.
+
+        """
+        return station.calc_center_of_mass_coordinates()
+
+    def cache_info(self):
+        """Statistics of the memoized station coordinates
+
+        :return: dictionary with the number of cache hits and misses, and
+                 the number of cached geometries.
+
+        """
+        return {'hits': self._cache_hits, 'misses': self._cache_misses,
+                'size': len(self._geometry)}
+
     def reconstruct_coincidences(self, coincidences, station_numbers=None,
                                  offsets={}, progress=True, initials=[]):
         """Reconstruct all coincidences
@@ -250,7 +389,6 @@ class CoincidenceDirectionReconstructionDetectors(
         # Subtract base timestamp to prevent loss of precision
         ts0 = int(coincidence_events[0][1]['timestamp'])
         ets0 = ts0 * int(1e9)
-        self.cluster.set_timestamp(ts0)
         t, x, y, z, nums = ([], [], [], [], [])
 
         # Get relevant offsets. TODO: station offsets
@@ -258,18 +396,20 @@ class CoincidenceDirectionReconstructionDetectors(
                    else o.detector_timing_offset(ts0)
                    for s, o in offsets.iteritems()}
 
-        for station_number, event in coincidence_events:
-            if station_numbers is not None:
-                if station_number not in station_numbers:
-                    continue
+        stations = self._get_stations(coincidence_events, station_numbers)
+        coordinates = self._get_coordinates(ts0, stations)
+
+        for (station_number, event), (_, station) in izip(coincidence_events,
+                                                          stations):
+            if station is None:
+                continue
             t_off = offsets.get(station_number, NO_OFFSET)
-            station = self.cluster.get_station(station_number)
             t_detectors = relative_detector_arrival_times(event, ets0,
                                                           offsets=t_off,
                                                           station=station)
-            for t_detector, detector in zip(t_detectors, station.detectors):
+            for t_detector, (dx, dy, dz) in zip(t_detectors,
+                                                coordinates[station_number]):
                 if not isnan(t_detector):
-                    dx, dy, dz = detector.get_coordinates()
                     t.append(t_detector)
                     x.append(dx)
                     y.append(dy)
@@ -288,6 +428,15 @@ class CoincidenceDirectionReconstructionDetectors(
 
         return theta, phi, nums
 
+    def _station_coordinates(self, station):
+        """Coordinates used for a station in the reconstruction
+
+        :param station: :class:`~sapphire.clusters.Station` object.
+        :return: list of the x, y, z coordinates of each detector.
+
+        """
+        return [detector.get_coordinates() for detector in station.detectors]
+
 
 class DirectAlgorithm(object):
 
@@ -375,6 +524,83 @@ class DirectAlgorithm(object):
 
         return theta, phi
 
+    @classmethod
+    def reconstruct_common_arrays(cls, t, x, y, z=None, initial={}):
+        """Reconstruct angles for many events with 3 detections
+
+        Array version of :meth:`reconstruct_common`.
+
+        :param t: arrival times in detector 0, 1 and 2 in ns, with shape
+                  (N, 3) for N events.
+        :param x,y: positions of detector 0, 1 and 2 in m, with shape
+                    (3,) if equal for all events, otherwise (N, 3).
+        :param z: height of detectors 0, 1 and 2 is ignored.
+        :param initial: dictionary containing values from previous
+                        reconstructions is ignored.
+        :return: arrays of theta and phi.
+
+        """
+        if (asarray(t).shape[-1] > 3 or asarray(x).shape[-1] > 3 or
+                asarray(y).shape[-1] > 3):
+            warning_only_three()
+
+        dt1, dt2 = _relative_to_first(t)
+        dx1, dx2 = _relative_to_first(x)
+        dy1, dy2 = _relative_to_first(y)
+
+        r1 = vector_length(dx1, dy1)
+        r2 = vector_length(dx2, dy2)
+
+        phi1 = arctan2(dy1, dx1)
+        phi2 = arctan2(dy2, dx2)
+
+        return cls.reconstruct_arrays(dt1, dt2, r1, r2, phi1, phi2)
+
+    @classmethod
+    def reconstruct_arrays(cls, dt1, dt2, r1, r2, phi1, phi2):
+        """Reconstruct angles for many events with 3 detections
+
+        Array version of :meth:`reconstruct`, the results for each event
+        are identical to those of :meth:`reconstruct`, including the
+        cases where no solution is found.
+
+        :param dt#: arrays of arrival times in detector 1 and 2 relative
+                    to detector 0 in ns (!).
+        :param r#,phi#: position of detector 1 and 2 relative to
+                        detector 0 in m and radians, as scalars or arrays.
+        :return: arrays of theta and phi.
+
+        """
+        dt1, dt2, r1, r2, phi1, phi2 = broadcast_arrays(
+            *[asarray(u, dtype=float) for u in (dt1, dt2, r1, r2, phi1, phi2)])
+
+        phi = arctan2(-(r1 * dt2 * cos(phi1) - r2 * dt1 * cos(phi2)),
+                      (r1 * dt2 * sin(phi1) - r2 * dt1 * sin(phi2)))
+
+        # Use detector 1 if possible, otherwise detector 2.
+        use1 = (dt1 != 0) & (phi - phi1 != pi / 2)
+        use2 = ~use1 & (dt2 != 0) & (phi - phi2 != pi / 2)
+        with errstate(divide='ignore', invalid='ignore'):
+            sintheta = where(use1, c * -dt1 / (r1 * cos(phi - phi1)),
+                             c * -dt2 / (r2 * cos(phi - phi2)))
+            valid = ((r1 != 0) & (r2 != 0) & (use1 | use2) &
+                     (abs(sintheta) <= 1))
+            theta = where(valid, arcsin(sintheta), nan)
+
+        # We limit theta to positive values.  If theta is negative, we
+        # make it positive, but need to rotate phi by 180 degrees.
+        negative = valid & (theta < 0)
+        theta = where(negative, -theta, theta)
+        phi = where(negative, norm_angle(phi + pi), phi)
+        phi = where(valid, phi, nan)
+
+        # No time difference means shower came from zenith.
+        zenith = (dt1 == 0) & (dt2 == 0)
+        theta = where(zenith, 0., theta)
+        phi = where(zenith, 0., phi)
+
+        return theta, phi
+
     @classmethod
     def rel_theta1_errorsq(cls, theta, phi, phi1, phi2, r1=10, r2=10):
         """Fokkema2012, eq 4.23"""
@@ -547,6 +773,65 @@ class DirectAlgorithmCartesian(object):
 
         return theta, phi
 
+    @classmethod
+    def reconstruct_common_arrays(cls, t, x, y, z=None, initial={}):
+        """Reconstruct angles for many events with 3 detections
+
+        Array version of :meth:`reconstruct_common`.
+
+        :param t: arrival times in detector 0, 1 and 2 in ns, with shape
+                  (N, 3) for N events.
+        :param x,y: positions of detector 0, 1 and 2 in m, with shape
+                    (3,) if equal for all events, otherwise (N, 3).
+        :param z: height of detectors 0, 1 and 2 is ignored.
+        :param initial: dictionary containing values from previous
+                        reconstructions is ignored.
+        :return: arrays of theta and phi.
+
+        """
+        if (asarray(t).shape[-1] > 3 or asarray(x).shape[-1] > 3 or
+                asarray(y).shape[-1] > 3):
+            warning_only_three()
+
+        dt1, dt2 = _relative_to_first(t)
+        dx1, dx2 = _relative_to_first(x)
+        dy1, dy2 = _relative_to_first(y)
+
+        return cls.reconstruct_arrays(dt1, dt2, dx1, dx2, dy1, dy2)
+
+    @staticmethod
+    def reconstruct_arrays(dt1, dt2, dx1, dx2, dy1, dy2):
+        """Reconstruct angles for many events with 3 detections
+
+        Array version of :meth:`reconstruct`, the results for each event
+        are identical to those of :meth:`reconstruct`, including the
+        cases where no solution is found.
+
+        :param dt#: arrays of arrival times in detector 1 and 2 relative
+                    to detector 0 in ns.
+        :param dx#,dy#: position of detector 1 and 2 relative to
+                         detector 0 in m, as scalars or arrays.
+        :return: arrays of theta and phi.
+
+        """
+        dt1, dt2, dx1, dx2, dy1, dy2 = broadcast_arrays(
+            *[asarray(u, dtype=float) for u in (dt1, dt2, dx1, dx2, dy1, dy2)])
+
+        ux = c * (dt2 * dx1 - dt1 * dx2)
+        uy = c * (dt2 * dy1 - dt1 * dy2)
+
+        vz = dx1 * dy2 - dx2 * dy1
+
+        with errstate(divide='ignore', invalid='ignore'):
+            usquared = ux * ux + uy * uy
+            vzsquared = vz * vz
+            uvzsqrt = sqrt(usquared / vzsquared)
+            valid = (vz != 0) & (uvzsqrt <= 1.0)
+            theta = where(valid, arcsin(uvzsqrt), nan)
+        phi = where(valid, arctan2(-ux * vz, uy * vz), nan)
+
+        return theta, phi
+
 
 class DirectAlgorithmCartesian3D(object):
 
@@ -640,6 +925,87 @@ class DirectAlgorithmCartesian3D(object):
 
         return theta, phi
 
+    @classmethod
+    def reconstruct_common_arrays(cls, t, x, y, z=None, initial={}):
+        """Reconstruct angles for many events with 3 detections
+
+        Array version of :meth:`reconstruct_common`.
+
+        :param t: arrival times in detector 0, 1 and 2 in ns, with shape
+                  (N, 3) for N events.
+        :param x,y,z: positions of detector 0, 1 and 2 in m, with shape
+                      (3,) if equal for all events, otherwise (N, 3).
+        :param initial: dictionary containing values from previous
+                        reconstructions is ignored.
+        :return: arrays of theta and phi.
+
+        """
+        if z is None:
+            z = [0] * asarray(x).shape[-1]
+
+        if (asarray(t).shape[-1] > 3 or asarray(x).shape[-1] > 3 or
+                asarray(y).shape[-1] > 3 or asarray(z).shape[-1] > 3):
+            warning_only_three()
+
+        dt1, dt2 = _relative_to_first(t)
+        dx1, dx2 = _relative_to_first(x)
+        dy1, dy2 = _relative_to_first(y)
+        dz1, dz2 = _relative_to_first(z)
+
+        return cls.reconstruct_arrays(dt1, dt2, dx1, dx2, dy1, dy2, dz1, dz2)
+
+    @staticmethod
+    def reconstruct_arrays(dt1, dt2, dx1, dx2, dy1, dy2, dz1=0, dz2=0):
+        """Reconstruct angles for many events with 3 detections
+
+        Array version of :meth:`reconstruct`, the results for each event
+        are identical to those of :meth:`reconstruct`, including the
+        cases where no solution is found.
+
+        :param dt#: arrays of arrival times in detector 1 and 2 relative
+                    to detector 0 in ns.
+        :param dx#,dy#,dz#: position of detector 1 and 2 relative to
+                            detector 0 in m, as scalars or arrays.
+        :return: arrays of theta and phi.
+
+        """
+        dt1, dt2, dx1, dx2, dy1, dy2, dz1, dz2 = broadcast_arrays(
+            *[asarray(u, dtype=float)
+              for u in (dt1, dt2, dx1, dx2, dy1, dy2, dz1, dz2)])
+
+        d1 = stack([dx1, dy1, dz1], axis=-1)
+        d2 = stack([dx2, dy2, dz2], axis=-1)
+        u = c * (dt2[..., None] * d1 - dt1[..., None] * d2)
+        v = cross(d1, d2)
+        uxv = cross(u, v)
+
+        usquared = (u * u).sum(axis=-1)
+        vsquared = (v * v).sum(axis=-1)
+        underroot = vsquared - usquared
+
+        with errstate(divide='ignore', invalid='ignore'):
+            term = v * sqrt(underroot)[..., None]
+            nplus = (uxv + term) / vsquared[..., None]
+            nmin = (uxv - term) / vsquared[..., None]
+
+            phiplus = arctan2(nplus[..., 1], nplus[..., 0])
+            thetaplus = arccos(nplus[..., 2])
+
+            phimin = arctan2(nmin[..., 1], nmin[..., 0])
+            thetamin = arccos(nmin[..., 2])
+
+        thetaplus = where(isnan(thetaplus), pi, thetaplus)
+        thetamin = where(isnan(thetamin), pi, thetamin)
+
+        # Allow solution only if it is the only one above horizon
+        solvable = (underroot > 0) & (vsquared != 0)
+        use_plus = solvable & (thetaplus <= pi / 2.) & (thetamin > pi / 2.)
+        use_min = solvable & (thetaplus > pi / 2.) & (thetamin <= pi / 2.)
+        theta = where(use_plus, thetaplus, where(use_min, thetamin, nan))
+        phi = where(use_plus, phiplus, where(use_min, phimin, nan))
+
+        return theta, phi
+
 
 class SphereAlgorithm(object):
 
@@ -668,13 +1034,43 @@ class SphereAlgorithm(object):
 
         """
         t_int = array([-1000, -10000]) + t[0]
-        x_int, y_int, z_int = cls.interaction_curve(x, y, z, t, t_int)
+        x_int, y_int, z_int, t_int = cls.interaction_curve(x, y, z, t, t_int)
         dec_source = arctan2(z_int[1] - z_int[0],
                              sqrt((x_int[1] - x_int[0]) ** 2. +
                                   (y_int[1] - y_int[0]) ** 2.))
         RA_source = arctan2(x_int[1] - x_int[0], y_int[1] - y_int[0])
         return dec_source, RA_source
 
+    @classmethod
+    def reconstruct_source_ECS_arrays(cls, t, x, y, z, timestamp):
+        """Reconstructs the sources of many events in the ECS
+
+        Array version of :meth:`reconstruct_source_ECS`.  Events for which
+        the interaction curve can not be determined, because the
+        detectors are in a degenerate configuration or the arrival times
+        are unphysical, result in NaN.
+
+        :param t: arrival times in the three detectors in ns, with shape
+                  (N, 3) for N events.
+        :param x,y,z: ECEF locations of the three detectors / stations in
+                      meters, with shape (3,) if equal for all events,
+                      otherwise (N, 3).
+        :param timestamp: The UTC timestamps of the coincidences in s.
+        :return: arrays of the declination and right ascension of the
+                 sources.
+
+        """
+        t = asarray(t, dtype=float)
+        t_int = array([-1000, -10000]) + t[..., :1]
+        x_int, y_int, z_int, t_int = cls.interaction_curve_arrays(x, y, z, t,
+                                                                  t_int)
+        dec_source = arctan2(z_int[..., 1] - z_int[..., 0],
+                             sqrt((x_int[..., 1] - x_int[..., 0]) ** 2. +
+                                  (y_int[..., 1] - y_int[..., 0]) ** 2.))
+        RA_source = arctan2(x_int[..., 1] - x_int[..., 0],
+                            y_int[..., 1] - y_int[..., 0])
+        return dec_source, RA_source
+
     @staticmethod
     def interaction_curve(x, y, z, t, t_int):
         """Calculates the curve of possible primary interactions
@@ -721,15 +1117,15 @@ class SphereAlgorithm(object):
 
         sign = 1
 
-        z = -V * t_int0 - W + sign * sqrt((V ** 2 - R) * t_int0 ** 2 +
-                                          (2 * V * W - Q) * t_int0 +
-                                          W ** 2 - P)
-        y = (B * z + C * t_int0 + D) / A
-        x = (E * z + F * t_int0 + G) / A
+        z_rel = -V * t_int0 - W + sign * sqrt((V ** 2 - R) * t_int0 ** 2 +
+                                              (2 * V * W - Q) * t_int0 +
+                                              W ** 2 - P)
+        y_rel = (B * z_rel + C * t_int0 + D) / A
+        x_rel = (E * z_rel + F * t_int0 + G) / A
 
-        x_int = x[0] + x
-        y_int = y[0] + y
-        z_int = z[0] + z
+        x_int = x[0] + x_rel
+        y_int = y[0] + y_rel
+        z_int = z[0] + z_rel
 
         int_length = x_int[0] ** 2 + y_int[0] ** 2 + z_int[0] ** 2
         det_length = x[0] ** 2 + y[0] ** 2 + z[0] ** 2
@@ -738,15 +1134,95 @@ class SphereAlgorithm(object):
             # Select interaction above the earths surface.
 
             sign = -1
-            z = -V * t_int0 - W + sign * sqrt((V ** 2 - R) * t_int0 ** 2 +
-                                              (2 * V * W - Q) * t_int0 +
-                                              W ** 2 - P)
-            y = (B * z + C * t_int0 + D) / A
-            x = (E * z + F * t_int0 + G) / A
+            z_rel = -V * t_int0 - W + sign * sqrt((V ** 2 - R) * t_int0 ** 2 +
+                                                  (2 * V * W - Q) * t_int0 +
+                                                  W ** 2 - P)
+            y_rel = (B * z_rel + C * t_int0 + D) / A
+            x_rel = (E * z_rel + F * t_int0 + G) / A
 
-            x_int = x[0] + x
-            y_int = y[0] + y
-            z_int = z[0] + z
+            x_int = x[0] + x_rel
+            y_int = y[0] + y_rel
+            z_int = z[0] + z_rel
+
+        return x_int, y_int, z_int, t_int
+
+    @staticmethod
+    def interaction_curve_arrays(x, y, z, t, t_int):
+        """Calculates the curves of possible primary interactions
+
+        Array version of :meth:`interaction_curve` for many events.  The
+        results for events without a solution are NaN.  That is the case
+        if the detectors are on a line, or if the arrival times can not
+        be explained by an interaction at the requested times.
+
+        :param x,y,z: arrays with the orthogonal coordinates of the three
+                      detectors / stations in m, with shape (3,) if equal
+                      for all events, otherwise (N, 3).
+        :param t: arrival times of the showers in the detectors / stations
+                  in ns, with shape (N, 3).
+        :param t_int: interaction times in ns, with shape (N, M) for M
+                      interaction times per event.
+        :return: parameters x_int, y_int, z_int, each with shape (N, M),
+                 and t_int.
+
+        """
+        x, y, z, t = [asarray(u, dtype=float) for u in (x, y, z, t)]
+        t_int = asarray(t_int, dtype=float)
+
+        # Coefficients per event, with an extra axis for the times
+        x01 = (x[..., 0] - x[..., 1])[..., None]
+        x02 = (x[..., 0] - x[..., 2])[..., None]
+        y01 = (y[..., 0] - y[..., 1])[..., None]
+        y02 = (y[..., 0] - y[..., 2])[..., None]
+        z01 = (z[..., 0] - z[..., 1])[..., None]
+        z02 = (z[..., 0] - z[..., 2])[..., None]
+        t01 = (t[..., 0] - t[..., 1])[..., None]
+        t02 = (t[..., 0] - t[..., 2])[..., None]
+
+        A = 2. * (x01 * y02 - x02 * y01)
+        B = 2. * (x02 * z01 - x01 * z02)
+        C = 2. * (x02 * t01 - x01 * t02) * c ** 2
+        D = (x02 * (x01 ** 2 + y01 ** 2 + z01 ** 2 - (t01 * c) ** 2) -
+             x01 * (x02 ** 2 + y02 ** 2 + z02 ** 2 - (t02 * c) ** 2))
+        E = 2. * (y01 * z02 - y02 * z01)
+        F = 2. * (y01 * t02 - y02 * t01) * c ** 2
+        G = (y01 * (x02 ** 2 + y02 ** 2 + z02 ** 2 - (t02 * c) ** 2) -
+             y02 * (x01 ** 2 + y01 ** 2 + z01 ** 2 - (t01 * c) ** 2))
+
+        x0 = x[..., :1]
+        y0 = y[..., :1]
+        z0 = z[..., :1]
+        t_int0 = t_int - t[..., :1]
+
+        with errstate(divide='ignore', invalid='ignore'):
+            T = A ** 2 + B ** 2 + E ** 2
+            V = (B * C + E * F) / T
+            W = (B * D + E * G) / T
+            P = (D ** 2 + G ** 2) / T
+            Q = 2 * (C * D + F * G) / T
+            R = (C ** 2 + F ** 2 - (A * c) ** 2) / T
+
+            discriminant = ((V ** 2 - R) * t_int0 ** 2 +
+                            (2 * V * W - Q) * t_int0 + W ** 2 - P)
+
+            # Select interaction above the earths surface, using the
+            # solution for the first interaction time.
+            z_rel = -V * t_int0 - W + sqrt(discriminant)
+            int_length = ((x0 + (E * z_rel + F * t_int0 + G) / A) ** 2 +
+                          (y0 + (B * z_rel + C * t_int0 + D) / A) ** 2 +
+                          (z0 + z_rel) ** 2)[..., :1]
+            det_length = x0 ** 2 + y0 ** 2 + z0 ** 2
+            sign = where(det_length > int_length, -1, 1)
+
+            z_rel = -V * t_int0 - W + sign * sqrt(discriminant)
+            y_rel = (B * z_rel + C * t_int0 + D) / A
+            x_rel = (E * z_rel + F * t_int0 + G) / A
+
+        valid = (A != 0) & (T != 0) & (discriminant >= 0)
+        valid = valid.all(axis=-1)[..., None]
+        x_int = where(valid, x0 + x_rel, nan)
+        y_int = where(valid, y0 + y_rel, nan)
+        z_int = where(valid, z0 + z_rel, nan)
 
         return x_int, y_int, z_int, t_int
 
@@ -790,13 +1266,43 @@ class FitAlgorithm3D(object):
         dy = make_relative(y)[1:]
         dz = make_relative(z)[1:]
 
+        theta, phi, _ = cls.fit(dt, dx, dy, dz)
+
+        return theta, phi
+
+    @classmethod
+    def fit(cls, dt, dx, dy, dz, theta0=nan, phi0=nan):
+        """Fit the direction to the relative arrival times
+
+        Two fits are performed, one starting from a shower from above and
+        one from a shower from below.
+
+        :param dt: relative arrival times in the detectors in ns.
+        :param dx,dy,dz: relative positions of the detectors in m.
+        :param theta0,phi0: estimate of the direction, used as starting
+                            point for the fits. If not given the default
+                            starting points are used.
+        :return: theta, phi and the total number of iterations of the fits.
+
+        """
+        if isnan(theta0) or isnan(phi0):
+            x0_above = (0.1, 0.1, .989, 0.)
+            x0_below = (-0.1, -0.1, -.989, 0.)
+        else:
+            nx = sin(theta0) * cos(phi0)
+            ny = sin(theta0) * sin(phi0)
+            nz = cos(theta0)
+            x0_above = (nx, ny, nz, 0.)
+            x0_below = (nx, ny, -nz, 0.)
+
         cons = {'type': 'eq', 'fun': cls.constraint_normal_vector}
 
-        fit = minimize(cls.best_fit, x0=(0.1, 0.1, .989, 0.),
+        fit = minimize(cls.best_fit, x0=x0_above,
                        args=(dt, dx, dy, dz), method="SLSQP",
                        bounds=((-1, 1), (-1, 1), (-1, 1), (None, None)),
                        constraints=cons,
                        options={'ftol': 1e-9, 'eps': 1e-7, 'maxiter': 50})
+        iterations = fit.nit
         if fit.success:
             phi1 = arctan2(fit.x[1], fit.x[0])
             theta1 = arccos(fit.x[2])
@@ -804,11 +1310,12 @@ class FitAlgorithm3D(object):
             phi1 = nan
             theta1 = nan
 
-        fit = minimize(cls.best_fit, x0=(-0.1, -0.1, -.989, 0.),
+        fit = minimize(cls.best_fit, x0=x0_below,
                        args=(dt, dx, dy, dz), method="SLSQP",
                        bounds=((-1, 1), (-1, 1), (-1, 1), (None, None)),
                        constraints=cons,
                        options={'ftol': 1e-9, 'eps': 1e-7, 'maxiter': 50})
+        iterations += fit.nit
         if fit.success:
             phi2 = arctan2(fit.x[1], fit.x[0])
             theta2 = arccos(fit.x[2])
@@ -832,7 +1339,112 @@ class FitAlgorithm3D(object):
             theta = nan
             phi = nan
 
-        return theta, phi
+        return theta, phi, iterations
+
+    @classmethod
+    def reconstruct_common_arrays(cls, t, x, y, z=None, initial={},
+                                  warm_start=False, n_workers=None,
+                                  return_stats=False):
+        """Reconstruct angles for many events with 3 or more detections
+
+        Array version of :meth:`reconstruct_common`.
+
+        :param t: arrival times of the detectors in ns, with shape (N, k)
+                  for N events and k detectors. Use nan for detectors
+                  without a detection.
+        :param x,y,z: positions of the detectors in m, with shape (k,) if
+                      equal for all events, otherwise (N, k). The height
+                      for all detectors will be set to 0 if not given.
+        :param initial: dictionary containing values from previous
+                        reconstructions is ignored.
+        :param warm_start,n_workers,return_stats: see
+                                                  :meth:`reconstruct_arrays`.
+
+        """
+        if z is None:
+            z = 0. * asarray(x, dtype=float)
+
+        return cls.reconstruct_arrays(t, x, y, z, warm_start, n_workers,
+                                      return_stats)
+
+    @classmethod
+    def reconstruct_arrays(cls, t, x, y, z, warm_start=False, n_workers=None,
+                           return_stats=False):
+        """Reconstruct angles for many events with 3 or more detections
+
+        Array version of :meth:`reconstruct`. The logic checks and the
+        detector positions relative to the first detection are determined
+        for all events at once, only the fits are performed per event.
+
+        :param t: arrival times in the detectors in ns, with shape (N, k).
+                  Use nan for detectors without a detection.
+        :param x,y,z: positions of the detectors in m, with shape (k,) or
+                      (N, k).
+        :param warm_start: if True, the fits start from the direction
+                           reconstructed by
+                           :meth:`RegressionAlgorithm.reconstruct_arrays`
+                           instead of the default starting points. This
+                           requires fewer iterations, the results agree
+                           with the default within the fit tolerance.
+        :param n_workers: optionally fit the events in parallel, using
+                          this number of worker processes.
+        :param return_stats: if True, also return the number of iterations
+                             and the wall-clock time in s of the fits for
+                             each event. These are 0 for events which fail
+                             the logic checks.
+        :return: arrays of theta and phi, and if requested the arrays of
+                 iterations and durations.
+
+        """
+        passed = logic_checks_arrays(t, x, y, z)
+        t, x, y, z = broadcast_arrays(*[asarray(u, dtype=float)
+                                        for u in (t, x, y, z)])
+        detected = ~isnan(t)
+        n_events = len(t)
+
+        if warm_start:
+            theta0, phi0 = RegressionAlgorithm.reconstruct_arrays(t, x, y)
+        else:
+            theta0 = phi0 = nan * zeros(n_events)
+
+        # positions relative to the first detection of each event
+        first = detected.argmax(axis=-1)
+        events = arange(n_events)
+        dt = t - t[events, first][:, None]
+        dx = x - x[events, first][:, None]
+        dy = y - y[events, first][:, None]
+        dz = z - z[events, first][:, None]
+        detected[events, first] = False
+
+        idx = passed.nonzero()[0]
+        if n_workers is None:
+            chunks = [idx]
+        else:
+            chunks = array_split(idx, n_workers)
+        args = [(dt[i], dx[i], dy[i], dz[i], detected[i], theta0[i], phi0[i])
+                for i in chunks]
+
+        if n_workers is None:
+            results = map(_fit_direction_events, args)
+        else:
+            pool = Pool(n_workers)
+            try:
+                results = pool.map(_fit_direction_events, args)
+            finally:
+                pool.close()
+                pool.join()
+
+        theta = nan * zeros(n_events)
+        phi = nan * zeros(n_events)
+        iterations = zeros(n_events, dtype=int)
+        durations = zeros(n_events)
+        for i, result in zip(chunks, results):
+            theta[i], phi[i], iterations[i], durations[i] = result
+
+        if return_stats:
+            return theta, phi, iterations, durations
+        else:
+            return theta, phi
 
     @staticmethod
     def constraint_normal_vector(n):
@@ -942,6 +1554,82 @@ class RegressionAlgorithm(object):
 
         return theta, phi
 
+    @classmethod
+    def reconstruct_common_arrays(cls, t, x, y, z=None, initial={}):
+        """Reconstruct angles for many events with 3 or more detections
+
+        Array version of :meth:`reconstruct_common`.
+
+        :param t: arrival times of the detectors in ns, with shape (N, k)
+                  for N events and k detectors. Use nan for detectors
+                  without a detection.
+        :param x,y,z: positions of the detectors in m, with shape (k,) if
+                      equal for all events, otherwise (N, k). The height
+                      is ignored.
+        :param initial: dictionary containing values from previous
+                        reconstructions is ignored.
+        :return: arrays of theta and phi.
+
+        """
+        return cls.reconstruct_arrays(t, x, y)
+
+    @staticmethod
+    def reconstruct_arrays(t, x, y):
+        """Reconstruct angles for many events with 3 or more detections
+
+        Array version of :meth:`reconstruct`. The regression sums are
+        evaluated for all events at once, only including the detectors
+        with a valid (not nan) arrival time. The results for each event
+        match those of :meth:`reconstruct` for only the valid detections.
+
+        :param t: arrival times in the detectors in ns, with shape (N, k).
+                  Use nan for detectors without a detection.
+        :param x,y: positions of the detectors in m, with shape (k,) or
+                    (N, k).
+        :return: arrays of theta and phi.
+
+        """
+        checks = logic_checks_arrays(t, x, y, 0. * asarray(x, dtype=float))
+        t, x, y = broadcast_arrays(*[asarray(u, dtype=float)
+                                     for u in (t, x, y)])
+        detected = ~isnan(t)
+
+        t = where(detected, t, 0.)
+        x = where(detected, x, 0.)
+        y = where(detected, y, 0.)
+
+        xx = (x * x).sum(axis=-1)
+        xy = (x * y).sum(axis=-1)
+        tx = (x * t).sum(axis=-1)
+        yy = (y * y).sum(axis=-1)
+        ty = (y * t).sum(axis=-1)
+        xs = x.sum(axis=-1)
+        ys = y.sum(axis=-1)
+        ts = t.sum(axis=-1)
+        k = detected.sum(axis=-1)
+
+        denom = (k * xy * xy + xs * xs * yy + ys * ys * xx - k * xx * yy -
+                 2 * xs * ys * xy)
+        denom = where(denom == 0, nan, denom)
+
+        numer = (tx * (k * yy - ys * ys) + xy * (ts * ys - k * ty) +
+                 xs * ys * ty - ts * xs * yy)
+        nx = c * numer / denom
+
+        numer = (ty * (k * xx - xs * xs) + xy * (ts * xs - k * tx) +
+                 xs * ys * tx - ts * ys * xx)
+        ny = c * numer / denom
+
+        with errstate(invalid='ignore'):
+            horiz = nx * nx + ny * ny
+            valid = checks & (horiz <= 1.)
+            nz = sqrt(where(valid, 1 - horiz, nan))
+        phi = arctan2(ny, nx)
+        phi = where(valid, phi, nan)
+        theta = arccos(nz)
+
+        return theta, phi
+
 
 class RegressionAlgorithm3D(object):
 
@@ -1022,6 +1710,7 @@ class CurvedRegressionAlgorithm(object):
 
     def __init__(self):
         self.front = CorsikaStationFront()
+        self._front_table = (None, None)
 
     def reconstruct_common(self, t, x, y, z=None, initial={}):
         """Reconstruct angles from 3 or more detections
@@ -1073,10 +1762,89 @@ class CurvedRegressionAlgorithm(object):
 
         return theta, phi
 
+    def reconstruct_common_arrays(self, t, x, y, z=None, initial={}):
+        """Reconstruct angles for many events with 3 or more detections
+
+        Array version of :meth:`reconstruct_common`.
+
+        :param t: arrival times of the detectors in ns, with shape (N, k)
+                  for N events and k detectors. Use nan for detectors
+                  without a detection.
+        :param x,y,z: positions of the detectors in m, with shape (k,) if
+                      equal for all events, otherwise (N, k). The height
+                      is ignored.
+        :param initial: dictionary containing values from previous
+                        reconstructions, including arrays of the core
+                        positions.
+        :return: arrays of theta and phi.
+
+        """
+        core_x = initial.get('core_x', nan)
+        core_y = initial.get('core_y', nan)
+
+        return self.reconstruct_arrays(t, x, y, core_x, core_y)
+
+    def reconstruct_arrays(self, t, x, y, core_x, core_y):
+        """Reconstruct angles for many events with 3 or more detections
+
+        Array version of :meth:`reconstruct`. The iterations are performed
+        for all events simultaneously, until theta has converged for each
+        event. The front delays are interpolated in a table, see
+        :meth:`time_delay_arrays`, the results match those of
+        :meth:`reconstruct` within the convergence tolerance.
+
+        :param t: arrival times in the detectors in ns, with shape (N, k).
+                  Use nan for detectors without a detection.
+        :param x,y: positions of the detectors in m, with shape (k,) or
+                    (N, k).
+        :param core_x,core_y: core positions at z = 0 in m, with shape
+                              (N,).
+        :return: arrays of theta and phi.
+
+        """
+        t = asarray(t, dtype=float)
+        x = asarray(x, dtype=float)
+        y = asarray(y, dtype=float)
+        core_x, core_y, _ = broadcast_arrays(asarray(core_x, dtype=float),
+                                             asarray(core_y, dtype=float),
+                                             t[..., 0])
+
+        theta, phi = RegressionAlgorithm.reconstruct_arrays(t, x, y)
+        theta = where(isnan(core_x) | isnan(core_y), nan, theta)
+        phi = where(isnan(theta), nan, phi)
+
+        iterating = ~isnan(theta)
+        for _ in xrange(self.MAX_ITERATIONS):
+            if not iterating.any():
+                break
+            idx = iterating.nonzero()[0]
+            xi, yi = _select_events(idx, x, y)
+            tproj = t[idx] - self.time_delay_arrays(
+                xi, yi, core_x[idx, None], core_y[idx, None],
+                theta[idx, None], phi[idx, None])
+            theta_prev = theta[idx]
+            theta[idx], phi[idx] = RegressionAlgorithm.reconstruct_arrays(
+                tproj, xi, yi)
+            with errstate(invalid='ignore'):
+                iterating[idx] = abs(theta[idx] - theta_prev) > 0.001
+        theta[iterating] = nan
+        phi[iterating] = nan
+
+        return theta, phi
+
     def time_delay(self, x, y, core_x, core_y, theta, phi):
         r = self.radial_core_distance(x, y, core_x, core_y, theta, phi)
         return self.front.delay_at_r(r)
 
+    def time_delay_arrays(self, x, y, core_x, core_y, theta, phi):
+        """Array version of :meth:`time_delay`
+
+        See :func:`_front_delay_arrays`.
+
+        """
+        r = self.radial_core_distance(x, y, core_x, core_y, theta, phi)
+        return _front_delay_arrays(self, r)
+
     @classmethod
     def radial_core_distance(cls, x, y, core_x, core_y, theta, phi):
         dx = core_x - x
@@ -1100,6 +1868,7 @@ class CurvedRegressionAlgorithm3D(object):
 
     def __init__(self):
         self.front = CorsikaStationFront()
+        self._front_table = (None, None)
 
     def reconstruct_common(self, t, x, y, z=None, initial={}):
         """Reconstruct angles from 3 or more detections
@@ -1160,10 +1929,101 @@ class CurvedRegressionAlgorithm3D(object):
 
         return theta, phi
 
+    def reconstruct_common_arrays(self, t, x, y, z=None, initial={}):
+        """Reconstruct angles for many events with 3 or more detections
+
+        Array version of :meth:`reconstruct_common`.
+
+        :param t: arrival times of the detectors in ns, with shape (N, k)
+                  for N events and k detectors. Use nan for detectors
+                  without a detection.
+        :param x,y,z: positions of the detectors in m, with shape (k,) if
+                      equal for all events, otherwise (N, k). The height
+                      for all detectors will be set to 0 if not given.
+        :param initial: dictionary containing values from previous
+                        reconstructions, including arrays of the core
+                        positions.
+        :return: arrays of theta and phi.
+
+        """
+        core_x = initial.get('core_x', nan)
+        core_y = initial.get('core_y', nan)
+
+        if z is None:
+            z = 0. * asarray(x, dtype=float)
+
+        return self.reconstruct_arrays(t, x, y, z, core_x, core_y)
+
+    def reconstruct_arrays(self, t, x, y, z, core_x, core_y):
+        """Reconstruct angles for many events with 3 or more detections
+
+        Array version of :meth:`reconstruct`. The iterations are performed
+        for all events simultaneously, until theta has converged for each
+        event. The front delays are interpolated in a table, see
+        :meth:`time_delay_arrays`, the results match those of
+        :meth:`reconstruct` within the convergence tolerance.
+
+        :param t: arrival times in the detectors in ns, with shape (N, k).
+                  Use nan for detectors without a detection.
+        :param x,y,z: positions of the detectors in m, with shape (k,) or
+                      (N, k).
+        :param core_x,core_y: core positions at z = 0 in m, with shape
+                              (N,).
+        :return: arrays of theta and phi.
+
+        """
+        t = asarray(t, dtype=float)
+        x = asarray(x, dtype=float)
+        y = asarray(y, dtype=float)
+        z = asarray(z, dtype=float)
+        core_x, core_y, _ = broadcast_arrays(asarray(core_x, dtype=float),
+                                             asarray(core_y, dtype=float),
+                                             t[..., 0])
+
+        checks = logic_checks_arrays(t, x, y, z)
+        theta, phi = RegressionAlgorithm.reconstruct_arrays(t, x, y)
+        theta = where(checks & ~isnan(core_x) & ~isnan(core_y), theta, nan)
+        phi = where(isnan(theta), nan, phi)
+
+        iterating = ~isnan(theta)
+        for _ in xrange(self.MAX_ITERATIONS):
+            if not iterating.any():
+                break
+            idx = iterating.nonzero()[0]
+            xi, yi, zi = _select_events(idx, x, y, z)
+            theta_i = theta[idx, None]
+            phi_i = phi[idx, None]
+            nxnz = tan(theta_i) * cos(phi_i)
+            nynz = tan(theta_i) * sin(phi_i)
+            nz = cos(theta_i)
+            xproj = xi - zi * nxnz
+            yproj = yi - zi * nynz
+            tproj = t[idx] + zi / (c * nz) - self.time_delay_arrays(
+                xproj, yproj, core_x[idx, None], core_y[idx, None], theta_i,
+                phi_i)
+            theta_prev = theta[idx]
+            theta[idx], phi[idx] = RegressionAlgorithm.reconstruct_arrays(
+                tproj, xproj, yproj)
+            with errstate(invalid='ignore'):
+                iterating[idx] = abs(theta[idx] - theta_prev) > 0.001
+        theta[iterating] = nan
+        phi[iterating] = nan
+
+        return theta, phi
+
     def time_delay(self, x, y, core_x, core_y, theta, phi):
         r = self.radial_core_distance(x, y, core_x, core_y, theta, phi)
         return self.front.delay_at_r(r)
 
+    def time_delay_arrays(self, x, y, core_x, core_y, theta, phi):
+        """Array version of :meth:`time_delay`
+
+        See :func:`_front_delay_arrays`.
+
+        """
+        r = self.radial_core_distance(x, y, core_x, core_y, theta, phi)
+        return _front_delay_arrays(self, r)
+
     @classmethod
     def radial_core_distance(cls, x, y, core_x, core_y, theta, phi):
         dx = core_x - x
@@ -1252,5 +2112,205 @@ def logic_checks(t, x, y, z):
     return True
 
 
+def logic_checks_arrays(t, x, y, z):
+    """Check for impossible reconstructions for many events
+
+    Array version of :func:`logic_checks`. Only the detectors with a valid
+    (not nan) arrival time are considered, the result for each event is
+    identical to that of :func:`logic_checks` for those detections.
+
+    If the positions are equal for all events, the checks which only
+    depend on the positions are looked up in a table, see
+    :func:`_logic_checks_fixed_geometry`.
+
+    :param t: arrival times in the detectors in ns, with shape (N, k).
+              Use nan for detectors without a detection.
+    :param x,y,z: positions of the detectors in m, with shape (k,) or
+                  (N, k).
+    :return: boolean array, True where the checks pass.
+
+    """
+    t, x, y, z = [asarray(u, dtype=float) for u in (t, x, y, z)]
+    if x.ndim == y.ndim == z.ndim == 1 and t.shape[-1] < 63:
+        return _logic_checks_fixed_geometry(t, x, y, z)
+
+    t, x, y, z = broadcast_arrays(t, x, y, z)
+    detected = ~isnan(t)
+    three = detected.sum(axis=-1) == 3
+    passed = ones(t.shape[:-1], dtype=bool)
+    n_detectors = t.shape[-1]
+
+    with errstate(divide='ignore', invalid='ignore'):
+        # Check for identical positions and if the time difference is
+        # larger than expected by c, only when there are three detections
+        for i, j in combinations(range(n_detectors), 2):
+            pair = three & detected[..., i] & detected[..., j]
+            dt = abs(t[..., i] - t[..., j])
+            dx = x[..., i] - x[..., j]
+            dy = y[..., i] - y[..., j]
+            dz = z[..., i] - z[..., j]
+            same = (dx == 0) & (dy == 0) & (dz == 0)
+            dt_max = vector_length(dx, dy, dz) / c
+            passed &= ~(pair & (same | (dt_max < dt)))
+
+        # Check if all the positions are (almost) on a single line
+        largest_of_smallest_angles = zeros(t.shape[:-1])
+        for i, j, k in combinations(range(n_detectors), 3):
+            triplet = detected[..., i] & detected[..., j] & detected[..., k]
+            dx1 = x[..., i] - x[..., j]
+            dy1 = y[..., i] - y[..., j]
+            dz1 = z[..., i] - z[..., j]
+            dx2 = x[..., i] - x[..., k]
+            dy2 = y[..., i] - y[..., k]
+            dz2 = z[..., i] - z[..., k]
+            lenvec01 = vector_length(dx1, dy1, dz1)
+            lenvec02 = vector_length(dx2, dy2, dz2)
+            lenvec12 = vector_length(dx2 - dx1, dy2 - dy1, dz2 - dz1)
+
+            area = abs(dx1 * dy2 - dx2 * dy1 + dy1 * dz2 - dy2 * dz1 +
+                       dz1 * dx2 - dz2 * dx1)
+
+            sin1 = area / lenvec01 / lenvec02
+            sin2 = area / lenvec01 / lenvec12
+            sin3 = area / lenvec02 / lenvec12
+
+            # Same handling of nan as the builtin min and max
+            smallest_angle = where(sin2 < sin1, sin2, sin1)
+            smallest_angle = where(sin3 < smallest_angle, sin3,
+                                   smallest_angle)
+            larger = triplet & (smallest_angle > largest_of_smallest_angles)
+            largest_of_smallest_angles = where(larger, smallest_angle,
+                                               largest_of_smallest_angles)
+
+    return passed & (largest_of_smallest_angles >= 0.1)
+
+
+def _logic_checks_fixed_geometry(t, x, y, z):
+    """Check for impossible reconstructions for events with equal positions
+
+    The result of :func:`logic_checks` without the time differences is
+    stored in a table for each subset of detectors, and is computed once
+    for each geometry and subset. The events are looked up in this table,
+    only the time differences are checked per event.
+
+    :param t: arrival times in the detectors in ns, with shape (N, k).
+              Use nan for detectors without a detection.
+    :param x,y,z: positions of the detectors in m, with shape (k,).
+    :return: boolean array, True where the checks pass.
+
+    """
+    key = (tuple(x), tuple(y), tuple(z))
+    try:
+        dt_max, subset_checks = _LOGIC_CHECKS_TABLES[key]
+    except KeyError:
+        if len(_LOGIC_CHECKS_TABLES) >= MAX_LOGIC_CHECKS_TABLES:
+            _LOGIC_CHECKS_TABLES.clear()
+        dt_max = {(i, j): vector_length(x[i] - x[j], y[i] - y[j],
+                                        z[i] - z[j]) / c
+                  for i, j in combinations(range(len(x)), 2)}
+        subset_checks = {}
+        _LOGIC_CHECKS_TABLES[key] = dt_max, subset_checks
+
+    detected = ~isnan(t)
+    subsets, inverse = unique(dot(detected, 1 << arange(len(x))),
+                              return_inverse=True)
+    for subset in subsets:
+        if subset not in subset_checks:
+            ids = [i for i in range(len(x)) if subset >> i & 1]
+            # Arrival times of 0 always pass the time difference check
+            subset_checks[subset] = logic_checks(
+                [0.] * len(ids), x[ids].tolist(), y[ids].tolist(),
+                z[ids].tolist())
+    passed = array([subset_checks[subset] for subset in subsets],
+                   dtype=bool)[inverse].reshape(t.shape[:-1])
+
+    # Check if the time difference is larger than expected by c, only
+    # when there are three detections
+    three = detected.sum(axis=-1) == 3
+    with errstate(invalid='ignore'):
+        for (i, j), dt_max_pair in dt_max.items():
+            pair = three & detected[..., i] & detected[..., j]
+            dt = abs(t[..., i] - t[..., j])
+            passed &= ~(pair & (dt_max_pair < dt))
+
+    return passed
+
+
+def _fit_direction_events(args):
+    """Fit the direction of a number of events
+
+    Worker function for :meth:`FitAlgorithm3D.reconstruct_arrays`.
+
+    :param args: tuple of the relative arrival times and positions, the
+                 mask of detections to use and the estimated theta and
+                 phi of the events.
+    :return: arrays of theta, phi, iterations and durations.
+
+    """
+    dt, dx, dy, dz, detected, theta0, phi0 = args
+    n_events = len(dt)
+    theta = nan * zeros(n_events)
+    phi = nan * zeros(n_events)
+    iterations = zeros(n_events, dtype=int)
+    durations = zeros(n_events)
+    for i in xrange(n_events):
+        use = detected[i]
+        t0 = time.time()
+        theta[i], phi[i], iterations[i] = FitAlgorithm3D.fit(
+            dt[i][use].tolist(), dx[i][use].tolist(), dy[i][use].tolist(),
+            dz[i][use].tolist(), theta0[i], phi0[i])
+        durations[i] = time.time() - t0
+    return theta, phi, iterations, durations
+
+
+def _front_delay_arrays(algorithm, r):
+    """Front delay of a curved regression algorithm at core distances
+
+    The delay is linearly interpolated in a table of the front delay
+    at the core distances in ``FRONT_TABLE_R``. The table is computed
+    once for the front of the algorithm. The exact front delay is used
+    beyond the table.
+
+    :param algorithm: :class:`CurvedRegressionAlgorithm` or
+                      :class:`CurvedRegressionAlgorithm3D` instance.
+    :param r: array of radial core distances in m.
+    :return: array of front delays in ns.
+
+    """
+    if algorithm._front_table[0] is not algorithm.front:
+        algorithm._front_table = (algorithm.front,
+                                  algorithm.front.delay_at_r(FRONT_TABLE_R))
+    delay = interp(r, FRONT_TABLE_R, algorithm._front_table[1])
+    with errstate(invalid='ignore'):
+        outside = r > FRONT_TABLE_R[-1]
+    if outside.any():
+        delay[outside] = algorithm.front.delay_at_r(r[outside])
+    return delay
+
+
+def _select_events(idx, *values):
+    """Select events from arrays which may be equal for all events
+
+    :param idx: indexes of the events to select.
+    :param values: arrays with shape (k,) if equal for all events,
+                   otherwise (N, k).
+    :return: list of the arrays, with only the selected events.
+
+    """
+    return [v[idx] if v.ndim > 1 else v for v in values]
+
+
+def _relative_to_first(values):
+    """Make the second and third values relative to the first
+
+    :param values: array with the values for detector 0, 1 and 2 in the
+                   last dimension.
+    :return: values of detector 1 and 2 relative to detector 0.
+
+    """
+    values = asarray(values, dtype=float)
+    return values[..., 1] - values[..., 0], values[..., 2] - values[..., 0]
+
+
 def warning_only_three():
     warnings.warn('Only the first three detections will be used')
@@ -9,7 +9,9 @@ times and trigger time) and stations.
 """
 from ..utils import ERR
 
-from numpy import nan, nanmin, nanmean
+from numpy import (nan, nanmin, nanmean, array, asarray, isin, where,
+                   column_stack, ones, errstate, int64)
+import warnings
 
 
 NO_OFFSET = [0., 0., 0., 0.]
@@ -189,3 +191,169 @@ def get_detector_ids(station=None, event=None):
     else:
         detector_ids = range(4)
     return detector_ids
+
+
+def station_density_arrays(events, detector_ids=None, station=None):
+    """Get particle density in a station for many events
+
+    Array version of :func:`station_density`.
+
+    :param events: block of processed event rows, e.g. read from an events
+        table.
+    :param detector_ids: list of detectors ids to consider. If None, the
+        detectors in the station object will be used.
+    :param station: :class:`~sapphire.clusters.Station` object.
+    :return: array with the average density over the chosen detectors.
+
+    """
+    p = detector_densities_arrays(events, detector_ids, station)
+    with warnings.catch_warnings(record=True):
+        return nanmean(p, axis=1)
+
+
+def detector_densities_arrays(events, detector_ids=None, station=None):
+    """Get particle density in station detectors for many events
+
+    Array version of :func:`detector_densities`. Detectors that are not
+    present in an event get a nan density.
+
+    :param events: block of processed event rows.
+    :param detector_ids: list of detectors ids for which to get particle
+        densities.
+    :param station: :class:`~sapphire.clusters.Station` object, used to
+        determine the detector sizes.
+    :return: array of densities with shape (N, number of detectors).
+
+    """
+    detector_ids, present = _get_detector_columns(events, detector_ids,
+                                                  station)
+    areas = []
+    for id in detector_ids:
+        try:
+            areas.append(station.detectors[id].get_area())
+        except (AttributeError, IndexError):
+            areas.append(.5)
+    n = column_stack([events['n%d' % (id + 1)] for id in detector_ids])
+    p = where(isin(n, ERR) | ~present, nan, n / array(areas))
+    return p
+
+
+def station_arrival_time_arrays(events, reference_ext_timestamp,
+                                detector_ids=None, offsets=NO_OFFSET,
+                                station=None):
+    """Get station arrival times, i.e. first detector hit, for many events
+
+    Array version of :func:`station_arrival_time`.
+
+    :param events: block of processed event rows.
+    :param reference_ext_timestamp: reference extended timestamp (in ns),
+        either one value or one for each event.
+    :param detector_ids: list of detectors ids for which to consider.
+    :param offsets: detector time offsets, either one list for all events
+        or an array with shape (N, 4) with offsets for each event.
+    :param station: :class:`~sapphire.clusters.Station` object, used to
+        determine the number of detectors.
+    :return: array of shower arrival times of the station relative to the
+             reference timestamp.
+
+    """
+    t = detector_arrival_times_arrays(events, detector_ids, offsets, station)
+    with warnings.catch_warnings(record=True):
+        t_first = nanmin(t, axis=1)
+    return _relative_to_reference(events, reference_ext_timestamp, t_first)
+
+
+def relative_detector_arrival_times_arrays(events, reference_ext_timestamp,
+                                           detector_ids=None,
+                                           offsets=NO_OFFSET, station=None):
+    """Get relative arrival times for all detectors for many events
+
+    Array version of :func:`relative_detector_arrival_times`.
+
+    :param events: block of processed event rows.
+    :param reference_ext_timestamp: reference extended timestamp (in ns),
+        either one value or one for each event.
+    :param detector_ids: list of detectors ids for which to get arrival times.
+    :param offsets: detector time offsets, either one list for all events
+        or an array with shape (N, 4) with offsets for each event.
+    :param station: :class:`~sapphire.clusters.Station` object, used to
+        determine the number of detectors.
+    :return: array of shower arrival times relative to the given reference,
+             with shape (N, number of detectors).
+
+    """
+    t = detector_arrival_times_arrays(events, detector_ids, offsets, station)
+    return _relative_to_reference(events, reference_ext_timestamp,
+                                  t.T).T
+
+
+def detector_arrival_times_arrays(events, detector_ids=None,
+                                  offsets=NO_OFFSET, station=None):
+    """Get corrected arrival times for all detectors for many events
+
+    Array version of :func:`detector_arrival_times`. Detectors that are
+    not present in an event get a nan arrival time.
+
+    :param events: block of processed event rows.
+    :param detector_ids: list of detectors ids for which to get arrival times.
+    :param offsets: detector time offsets, either one list for all events
+        or an array with shape (N, 4) with offsets for each event.
+    :param station: :class:`~sapphire.clusters.Station` object, used to
+        determine the number of detectors.
+    :return: array of shower arrival times relative to the start of the
+             trace, with shape (N, number of detectors).
+
+    """
+    detector_ids, present = _get_detector_columns(events, detector_ids,
+                                                  station)
+    t = column_stack([events['t%d' % (id + 1)] for id in detector_ids])
+    offsets = asarray(offsets, dtype=float)[..., detector_ids]
+    t = where(isin(t, ERR) | ~present, nan, t - offsets)
+    return t
+
+
+def get_detector_ids_arrays(events, station=None):
+    """Determine the detectors present in many events
+
+    Array version of :func:`get_detector_ids`. If the station is not given
+    the pulseheights are used to determine which of the four detectors
+    are present in each event.
+
+    :param events: block of event rows.
+    :param station: :class:`~sapphire.clusters.Station` object.
+    :return: list of detector_ids and a boolean array with shape
+             (N, number of detectors) which is True for the detectors
+             present in each event.
+
+    """
+    n = len(events['t_trigger'])
+    if station is not None:
+        detector_ids = range(len(station.detectors))
+        present = ones((n, len(detector_ids)), dtype=bool)
+    else:
+        detector_ids = range(4)
+        present = asarray(events['pulseheights'])[:, :4] != -1
+    return detector_ids, present
+
+
+def _get_detector_columns(events, detector_ids=None, station=None):
+    """Get the detector ids and the present detectors for many events"""
+
+    if detector_ids is None:
+        return get_detector_ids_arrays(events, station)
+    n = len(events['t_trigger'])
+    return detector_ids, ones((n, len(detector_ids)), dtype=bool)
+
+
+def _relative_to_reference(events, reference_ext_timestamp, t):
+    """Make trace times relative to a reference extended timestamp
+
+    Events with a bad trigger time get nan.
+
+    """
+    t_trigger = asarray(events['t_trigger'], dtype=float)
+    reference = asarray(reference_ext_timestamp, dtype=int64)
+    dt = asarray(events['ext_timestamp']).astype(int64) - reference
+    with errstate(invalid='ignore'):
+        t = dt - t_trigger + t
+    return where(isin(t_trigger, ERR), nan, t)
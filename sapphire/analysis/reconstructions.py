@@ -1,7 +1,10 @@
+from collections import deque
 from itertools import izip, izip_longest
+from multiprocessing import Pool
 import os
 
-from numpy import isnan, histogram, linspace, percentile, std
+from numpy import (isnan, histogram, linspace, percentile, std, zeros, where,
+                   inf, array, asarray, column_stack, searchsorted)
 from scipy.optimize import curve_fit
 import tables
 
@@ -87,9 +90,18 @@ class ReconstructESDEvents(object):
         self.core_x = []
         self.core_y = []
 
-    def reconstruct_and_store(self, detector_ids=None):
-        """Shorthand function to reconstruct event and store the results"""
+    def reconstruct_and_store(self, detector_ids=None, n_workers=None,
+                              chunksize=10000):
+        """Shorthand function to reconstruct event and store the results
 
+        :param detector_ids: list of detector ids to use for reconstructions.
+        :param n_workers: optionally reconstruct chunks of events in
+            parallel, using this number of worker processes. See
+            :meth:`reconstruct_and_store_parallel`.
+        :param chunksize: number of events in each chunk, only used if
+            n_workers is given.
+
+        """
         self.prepare_output()
         if self.api_station is None:
             self.offsets = determine_detector_timing_offsets(self.events,
@@ -97,9 +109,72 @@ class ReconstructESDEvents(object):
             self.store_offsets()
         else:
             self.offsets = self.api_station
-        self.reconstruct_directions(detector_ids=detector_ids)
-        self.reconstruct_cores(detector_ids=detector_ids)
-        self.store_reconstructions()
+        if n_workers is None:
+            self.reconstruct_directions(detector_ids=detector_ids)
+            self.reconstruct_cores(detector_ids=detector_ids)
+            self.store_reconstructions()
+        else:
+            self.reconstruct_and_store_parallel(detector_ids, n_workers,
+                                                chunksize)
+
+    def reconstruct_and_store_parallel(self, detector_ids=None, n_workers=2,
+                                       chunksize=10000):
+        """Reconstruct directions and cores in parallel and store the results
+
+        The events are split into chunks, and the directions and cores of
+        each chunk are reconstructed in a worker process. The results are
+        stored in the original order, one block append per chunk, giving
+        the same output as :meth:`reconstruct_directions`,
+        :meth:`reconstruct_cores` and :meth:`store_reconstructions`.
+
+        The reconstruction objects, detector ids and offsets are passed
+        to each worker once, when it is started. The next chunks are read
+        while the workers reconstruct, at most one chunk more than there
+        are workers is kept in memory.
+
+        The output table should already be prepared and the offsets set,
+        see :meth:`reconstruct_and_store`.
+
+        :param detector_ids: list of detector ids to use for reconstructions.
+        :param n_workers: number of worker processes.
+        :param chunksize: number of events in each chunk.
+
+        """
+        nrows = self.events.nrows
+        results = ([], [], [], [], [])
+        pending = deque()
+
+        def store_next_chunk():
+            events, result = pending.popleft()
+            result = result.get()
+            self._store_reconstructions_block(events, *result)
+            for values, result_values in zip(results, result):
+                values.extend(result_values)
+
+        pool = Pool(n_workers, _init_reconstruct_worker,
+                    (self.direction, self.core, detector_ids, self.offsets))
+        try:
+            # Read the chunks in this thread rather than lazily by imap,
+            # whose task handler thread would use HDF5 concurrently with
+            # storing the results.
+            for start in pbar(xrange(0, nrows, chunksize),
+                              show=self.progress):
+                events = self.events.read(start, start + chunksize)
+                pending.append((events, pool.apply_async(
+                    _reconstruct_events_chunk, (events,))))
+                if len(pending) > n_workers:
+                    store_next_chunk()
+            while pending:
+                store_next_chunk()
+        finally:
+            pool.close()
+            pool.join()
+        self.reconstructions.flush()
+
+        theta, phi, ids, core_x, core_y = results
+        self.theta, self.phi = tuple(theta), tuple(phi)
+        self.detector_ids = tuple(ids)
+        self.core_x, self.core_y = tuple(core_x), tuple(core_y)
 
     def reconstruct_directions(self, detector_ids=None):
         """Reconstruct direction for all events
@@ -112,8 +187,9 @@ class ReconstructESDEvents(object):
                         for x, y in izip(self.core_x, self.core_y))
         else:
             initials = []
+        offsets = _event_timing_offsets(self.offsets, self.events)
         angles = self.direction.reconstruct_events(self.events, detector_ids,
-                                                   self.offsets, self.progress,
+                                                   offsets, self.progress,
                                                    initials)
         self.theta, self.phi, self.detector_ids = angles
 
@@ -199,6 +275,35 @@ class ReconstructESDEvents(object):
             row['d%d' % (id + 1)] = True
         row.append()
 
+    def _store_reconstructions_block(self, events, theta, phi, detector_ids,
+                                     core_x, core_y):
+        """Store the reconstructions of a block of events
+
+        Block version of :meth:`_store_reconstruction`.
+
+        :param events: array of the reconstructed events.
+        :param theta,phi,detector_ids,core_x,core_y: reconstruction results
+            for the events.
+
+        """
+        used = zeros((len(events), 4), dtype=bool)
+        for i, ids in enumerate(detector_ids):
+            used[i, ids] = True
+        n = array([events['n%d' % (id + 1)] for id in range(4)]).T
+
+        rows = zeros(len(events), dtype=self.reconstructions.dtype)
+        rows['id'] = events['event_id']
+        rows['ext_timestamp'] = events['ext_timestamp']
+        rows['min_n'] = where(used.any(axis=1),
+                              where(used, n, inf).min(axis=1), -999.)
+        rows['x'] = core_x
+        rows['y'] = core_y
+        rows['zenith'] = theta
+        rows['azimuth'] = phi
+        for id in range(4):
+            rows['d%d' % (id + 1)] = used[:, id]
+        self.reconstructions.append(rows)
+
 
 class ReconstructESDEventsFromSource(ReconstructESDEvents):
 
@@ -298,14 +403,20 @@ class ReconstructESDCoincidences(object):
         self.core_x = []
         self.core_y = []
 
-    def reconstruct_and_store(self, station_numbers=None):
-        """Shorthand function to reconstruct coincidences and store results"""
+    def reconstruct_and_store(self, station_numbers=None, blocksize=None):
+        """Shorthand function to reconstruct coincidences and store results
 
+        :param station_numbers: list of station numbers to use for the
+            reconstructions.
+        :param blocksize: optionally store the results in blocks of this
+            number of coincidences, see :meth:`store_reconstructions`.
+
+        """
         self.prepare_output()
         self.get_station_timing_offsets()
         self.reconstruct_directions(station_numbers=station_numbers)
         self.reconstruct_cores(station_numbers=station_numbers)
-        self.store_reconstructions()
+        self.store_reconstructions(blocksize=blocksize)
 
     def reconstruct_directions(self, station_numbers=None):
         """Reconstruct direction for all events
@@ -467,18 +578,35 @@ class ReconstructESDCoincidences(object):
                                             for detector_offset in
                                             self.offsets[station.number]]
 
-    def store_reconstructions(self):
+    def store_reconstructions(self, blocksize=None):
         """Loop over list of reconstructed data and store results
 
         Unsuccessful reconstructions are also stored but with the NumPy
         NaN as reconstructed value.
 
+        :param blocksize: optionally store the results in blocks of this
+            number of coincidences, instead of one at a time. The results
+            of each block are collected in an array which is appended to
+            the table at once, and the table is flushed after each block.
+            If interrupted the table contains the complete results of the
+            blocks stored so far. The stored results are identical.
+
         """
-        for coincidence, x, y, theta, phi, station_numbers in izip_longest(
-                self.coincidences, self.core_x, self.core_y,
-                self.theta, self.phi, self.station_numbers):
-            self._store_reconstruction(coincidence, x, y, theta, phi,
-                                       station_numbers)
+        if blocksize is None:
+            for coincidence, x, y, theta, phi, station_numbers in izip_longest(
+                    self.coincidences, self.core_x, self.core_y,
+                    self.theta, self.phi, self.station_numbers):
+                self._store_reconstruction(coincidence, x, y, theta, phi,
+                                           station_numbers)
+        else:
+            for start in xrange(0, self.coincidences.nrows, blocksize):
+                stop = start + blocksize
+                self._store_reconstructions_block(
+                    self.coincidences.read(start, stop),
+                    self.core_x[start:stop], self.core_y[start:stop],
+                    self.theta[start:stop], self.phi[start:stop],
+                    self.station_numbers[start:stop])
+                self.reconstructions.flush()
         self.reconstructions.flush()
 
     def _store_reconstruction(self, coincidence, core_x, core_y, theta, phi,
@@ -506,6 +634,39 @@ class ReconstructESDCoincidences(object):
 
         row.append()
 
+    def _store_reconstructions_block(self, coincidences, core_x, core_y,
+                                     theta, phi, station_numbers):
+        """Store the reconstructions of a block of coincidences
+
+        Block version of :meth:`_store_reconstruction`.
+
+        :param coincidences: array of the reconstructed coincidences.
+        :param core_x,core_y,theta,phi,station_numbers: reconstruction
+            results for the coincidences.
+
+        """
+        rows = zeros(len(coincidences), dtype=self.reconstructions.dtype)
+
+        rows['id'] = coincidences['id']
+        rows['ext_timestamp'] = coincidences['ext_timestamp']
+        rows['x'] = core_x
+        rows['y'] = core_y
+        rows['zenith'] = theta
+        rows['azimuth'] = phi
+
+        rows['reference_x'] = coincidences['x']
+        rows['reference_y'] = coincidences['y']
+        rows['reference_zenith'] = coincidences['zenith']
+        rows['reference_azimuth'] = coincidences['azimuth']
+        rows['reference_size'] = coincidences['size']
+        rows['reference_energy'] = coincidences['energy']
+
+        for i, numbers in enumerate(station_numbers):
+            for number in numbers:
+                rows['s%d' % number][i] = True
+
+        self.reconstructions.append(rows)
+
     def _get_active_stations(self):
         """Return station numbers with non-empty event table in datafile"""
 
@@ -569,3 +730,141 @@ class ReconstructESDCoincidencesFromSource(ReconstructESDCoincidences):
             self.dest_group, self.destination, description,
             expectedrows=self.coincidences.nrows, createparents=True)
         self.reconstructions._v_attrs.cluster = self.cluster
+
+
+class TimingOffsetTables(object):
+
+    """Piecewise constant detector timing offsets for stations
+
+    For each station a table is built once, with the timestamps from
+    which offsets are valid and the detector offsets in each interval.
+    The offsets for a block of events are then looked up with a single
+    search, so the events may span several offset intervals. The result
+    can be used as offsets for the array functions in
+    :mod:`~sapphire.analysis.event_utils`.
+
+    Example usage::
+
+        >>> rec = ReconstructESDCoincidences(data)
+        >>> rec.get_station_timing_offsets()
+        >>> tables = TimingOffsetTables(rec.offsets)
+        >>> offsets = tables.detector_timing_offsets(501, events['timestamp'])
+
+    """
+
+    def __init__(self, offsets):
+        """Build the offset tables
+
+        :param offsets: dictionary with for each station number either a
+            list of detector offsets which are always valid, or a
+            :class:`~sapphire.api.Station` object.
+
+        """
+        self.tables = {number: self._build_table(station_offsets)
+                       for number, station_offsets in offsets.iteritems()}
+
+    @staticmethod
+    def _build_table(offsets):
+        """Build the offset table for a station
+
+        :param offsets: list of detector offsets or a
+            :class:`~sapphire.api.Station` object.
+        :return: array of timestamps from which the offsets are valid and
+                 array with the four detector offsets for each interval.
+
+        """
+        if isinstance(offsets, api.Station):
+            data = offsets.detector_timing_offsets
+            timestamps = array(data['timestamp'])
+            values = column_stack([data['offset%d' % i]
+                                   for i in range(1, 5)])
+        else:
+            timestamps = array([0])
+            values = array([offsets], dtype=float)
+        return timestamps, values
+
+    def detector_timing_offsets(self, station_number, timestamps):
+        """Get the detector offsets of a station for many timestamps
+
+        Like :meth:`~sapphire.api.Station.detector_timing_offset`, the
+        first offsets are also used for timestamps before the first
+        interval. Stations without offsets get zero offsets.
+
+        :param station_number: number of the station.
+        :param timestamps: array of timestamps, e.g. of events.
+        :return: array of detector offsets with shape (N, 4).
+
+        """
+        timestamps = asarray(timestamps)
+        try:
+            table_timestamps, values = self.tables[station_number]
+        except KeyError:
+            return zeros((len(timestamps), 4))
+        idx = searchsorted(table_timestamps, timestamps, side='right') - 1
+        return values[where(idx < 0, 0, idx)]
+
+
+def _event_timing_offsets(offsets, events):
+    """Get the detector offsets for a batch of events
+
+    Offsets from an api.Station are looked up for all events at once with
+    :class:`TimingOffsetTables`, instead of for each event separately.
+
+    :param offsets: the detector offsets or an api.Station.
+    :param events: the events table or an array of events.
+    :return: the offsets if these are always valid, otherwise an array
+             with the detector offsets for each event.
+
+    """
+    if not isinstance(offsets, api.Station):
+        return offsets
+    if isinstance(events, tables.Table):
+        timestamps = events.col('timestamp')
+    else:
+        timestamps = events['timestamp']
+    offset_tables = TimingOffsetTables({offsets.station: offsets})
+    return offset_tables.detector_timing_offsets(offsets.station, timestamps)
+
+
+# Arguments shared by all chunks, set in each worker process
+_reconstruct_worker_args = None
+
+
+def _init_reconstruct_worker(direction, core, detector_ids, offsets):
+    """Initialize a worker process for reconstructing chunks of events
+
+    Stores the arguments which are equal for all chunks, so that these
+    are only passed to each worker once.
+
+    :param direction,core: the direction and core reconstruction objects.
+    :param detector_ids: the detector ids to use for reconstructions.
+    :param offsets: the detector offsets or an api.Station.
+
+    """
+    global _reconstruct_worker_args
+    _reconstruct_worker_args = (direction, core, detector_ids, offsets)
+
+
+def _reconstruct_events_chunk(events):
+    """Reconstruct the directions and cores of a chunk of events
+
+    Worker function for
+    :meth:`ReconstructESDEvents.reconstruct_and_store_parallel`, the
+    worker should be initialized by :func:`_init_reconstruct_worker`.
+
+    :param events: the events.
+    :return: theta, phi, detector ids, core_x and core_y of the events.
+
+    """
+    direction, core, detector_ids, offsets = _reconstruct_worker_args
+    offsets = _event_timing_offsets(offsets, events)
+    theta, phi, ids = direction.reconstruct_events(events, detector_ids,
+                                                   offsets, progress=False)
+    if len(theta) and len(phi):
+        initials = ({'theta': t, 'phi': p} for t, p in izip(theta, phi))
+    else:
+        initials = []
+    core_x, core_y = core.reconstruct_events(events, detector_ids,
+                                             progress=False,
+                                             initials=initials)
+    return theta, phi, ids, core_x, core_y
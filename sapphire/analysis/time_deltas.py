@@ -21,17 +21,21 @@
                 td.determine_and_store_time_deltas()
 
 """
+import os
 import re
 from itertools import combinations
+from multiprocessing import Pool
 
 import tables
-from numpy import isnan
+from numpy import (isnan, array, arange, bincount, concatenate, isin,
+                   repeat, searchsorted, empty, unique)
 
 from ..utils import pbar
 from ..api import Station
 from ..storage import TimeDelta
 from .coincidence_queries import CoincidenceQuery
-from .event_utils import station_arrival_time
+from .event_utils import station_arrival_time, station_arrival_time_arrays
+from .reconstructions import TimingOffsetTables
 
 
 class ProcessTimeDeltas(object):
@@ -52,24 +56,89 @@ class ProcessTimeDeltas(object):
 
         """
         self.data = data
+        self.coincidence_group = coincidence_group
         self.cq = CoincidenceQuery(self.data, coincidence_group)
         self.progress = progress
 
-    def determine_and_store_time_deltas(self):
-        """Find station pairs, determine time deltas, and store the results."""
+    def determine_and_store_time_deltas(self, n_workers=None):
+        """Find station pairs, determine time deltas, and store the results.
 
+        :param n_workers: optionally divide the station pairs over this
+            number of worker processes, see
+            :meth:`determine_and_store_time_deltas_parallel`.
+
+        """
         self.find_station_pairs()
         self.get_detector_offsets()
-        self.determine_and_store_time_deltas_for_pairs()
+        self.determine_and_store_time_deltas_for_pairs(n_workers)
+
+    def determine_and_store_time_deltas_for_pairs(self, n_workers=None):
+        """Determine time deltas for all pairs and store the results.
 
-    def determine_and_store_time_deltas_for_pairs(self):
-        """Determine time deltas for all pairs and store the results."""
+        :param n_workers: optionally divide the station pairs over this
+            number of worker processes, see
+            :meth:`determine_and_store_time_deltas_parallel`.
+
+        """
+        if n_workers is not None:
+            self.determine_and_store_time_deltas_parallel(n_workers)
+            return
 
         for pair in pbar(self.pairs, show=self.progress):
             ets, dt = self.determine_time_deltas_for_pair(*pair)
             if len(ets):
                 self.store_time_deltas(ets, dt, pair)
 
+    def determine_and_store_time_deltas_parallel(self, n_workers=2):
+        """Determine time deltas for all pairs in parallel and store them
+
+        The station pairs are divided over a pool of worker processes.
+        Each worker opens the datafile read-only and reads the events of
+        its pairs, the time deltas are determined in the same way as
+        :meth:`determine_time_deltas_for_pair_arrays`. The detector offset
+        tables are built once and passed to each worker when it is
+        started. Only this process writes to the datafile, the time deltas
+        of each pair are stored as soon as they are returned.
+
+        The datafile has to be a file on disk, opened with the default
+        driver.
+
+        :param n_workers: number of worker processes.
+
+        """
+        pairs = list(self.pairs)
+        if not len(pairs):
+            return
+        if self.data.params['DRIVER'] not in (None, 'H5FD_SEC2'):
+            raise RuntimeError("The parallel mode requires a datafile "
+                               "opened with the default driver.")
+
+        offsets = TimingOffsetTables(self.stations)
+
+        # Create the group for the time deltas beforehand, so that while
+        # the workers read the datafile only nodes in this group change.
+        # Everything has to be written before the workers open the file.
+        created_group = '/time_deltas' not in self.data
+        if created_group:
+            self.data.create_group('/', 'time_deltas')
+        self.data.flush()
+
+        pool = Pool(n_workers, _init_time_deltas_worker,
+                    (self.data.filename, self.coincidence_group, offsets))
+        try:
+            for pair, ets, dt in pbar(
+                    pool.imap_unordered(_determine_time_deltas_for_pair,
+                                        pairs),
+                    show=self.progress, length=len(pairs)):
+                if len(ets):
+                    self.store_time_deltas(ets, dt, pair)
+        finally:
+            pool.close()
+            pool.join()
+
+        if created_group and not self.data.root.time_deltas._v_nchildren:
+            self.data.remove_node('/time_deltas')
+
     def find_station_pairs(self):
         """Find all unique station pairs which are in a coincidence together
 
@@ -94,8 +163,10 @@ class ProcessTimeDeltas(object):
 
         """
         station_numbers = {station for pair in self.pairs for station in pair}
-        self.detector_timing_offsets = {sn: Station(sn).detector_timing_offset
-                                        for sn in station_numbers}
+        self.stations = {sn: Station(sn) for sn in station_numbers}
+        self.detector_timing_offsets = {sn: station.detector_timing_offset
+                                        for sn, station
+                                        in self.stations.iteritems()}
 
     def determine_time_deltas_for_pair(self, ref_station, station):
         """Determine the arrival time differences between two stations.
@@ -148,6 +219,115 @@ class ProcessTimeDeltas(object):
             ets.append(ref_ets)
         return ets, dt
 
+    def determine_time_deltas_for_pair_arrays(self, ref_station, station,
+                                              offsets=None):
+        """Determine the arrival time differences between two stations.
+
+        Batched version of :meth:`determine_time_deltas_for_pair`. The
+        events of both stations are read for all coincidences at once and
+        the piecewise detector offsets are looked up using
+        :class:`~sapphire.analysis.reconstructions.TimingOffsetTables`.
+
+        :param ref_station,station: station numbers.
+        :param offsets: :class:`TimingOffsetTables` with the detector
+            offsets of both stations. If None, they are built from the
+            stations retrieved by :meth:`get_detector_offsets`.
+        :return: arrays of the extended timestamp of the first event and
+                 time difference, t - t_ref. Not corrected for altitude
+                 differences.
+
+        """
+        ets, ref_events, events = self._read_pair_events(ref_station,
+                                                         station)
+        if not len(ets):
+            return ets, array([])
+        if offsets is None:
+            offsets = TimingOffsetTables({sn: self.stations[sn]
+                                          for sn in (ref_station, station)})
+        ref_t = station_arrival_time_arrays(
+            ref_events, ets, [0, 1, 2, 3],
+            offsets.detector_timing_offsets(ref_station,
+                                            ref_events['timestamp']))
+        t = station_arrival_time_arrays(
+            events, ets, [0, 1, 2, 3],
+            offsets.detector_timing_offsets(station, events['timestamp']))
+        valid = ~(isnan(t) | isnan(ref_t))
+        return ets[valid], (t - ref_t)[valid]
+
+    def _read_pair_events(self, ref_station, station):
+        """Read the events of a station pair for all coincidences
+
+        Coincidences which are a subset of the previous coincidence, or
+        which contain the same station twice, are filtered in the same way
+        as in :meth:`determine_time_deltas_for_pair`.
+
+        :param ref_station,station: station numbers.
+        :return: extended timestamp of the first event in each coincidence,
+                 and the events of the reference station and the station.
+
+        """
+        coincidences = self.cq.all([ref_station, station])
+        if not len(coincidences):
+            return array([], dtype='uint64'), None, None
+
+        # Events of the pair in each coincidence, in c_index order
+        ids = coincidences['id']
+        first_id = ids.min()
+        c_index = self.cq.c_index.read(first_id, ids.max() + 1)
+        c_idx = [c_index[id - first_id] for id in ids]
+        entries = concatenate(c_idx)
+        coincidence = repeat(arange(len(ids)), [len(idx) for idx in c_idx])
+        s_numbers = array(self.cq.s_numbers)
+        has_node = array([node is not None for node in self.cq.s_nodes])
+        in_pair = (isin(s_numbers[entries[:, 0]], [ref_station, station]) &
+                   has_node[entries[:, 0]])
+        entries = entries[in_pair]
+        coincidence = coincidence[in_pair]
+
+        # Coincidences with at least two events, see events_from_stations
+        n_events = bincount(coincidence, minlength=len(ids))
+        first = searchsorted(coincidence, arange(len(ids)))
+        with_events = n_events >= 2
+        n_events = n_events[with_events]
+        first = first[with_events]
+        if not len(first):
+            return array([], dtype='uint64'), None, None
+
+        ets = self._read_events(entries[first])['ext_timestamp']
+        # Filter coincidences which are a subset of the previous coincidence
+        # and those with the same station twice
+        previous_ets = concatenate([[0], ets[:-1]])
+        selected = (ets != previous_ets) & (n_events == 2)
+        ets = ets[selected]
+        first = first[selected]
+
+        events = (self._read_events(entries[first]),
+                  self._read_events(entries[first + 1]))
+        first_is_ref = s_numbers[entries[first, 0]] == ref_station
+        ref_events = events[0].copy()
+        ref_events[~first_is_ref] = events[1][~first_is_ref]
+        station_events = events[1].copy()
+        station_events[~first_is_ref] = events[0][~first_is_ref]
+        return ets, ref_events, station_events
+
+    def _read_events(self, entries):
+        """Read the events of station index and event index pairs
+
+        :param entries: array of (s_idx, e_idx) rows from the c_index.
+        :return: array of event rows.
+
+        """
+        s_idx = entries[:, 0]
+        events = None
+        for idx in unique(s_idx):
+            selection = s_idx == idx
+            rows = self.cq.s_nodes[idx].events.read_coordinates(
+                entries[selection, 1])
+            if events is None:
+                events = empty(len(entries), dtype=rows.dtype)
+            events[selection] = rows
+        return events
+
     def store_time_deltas(self, ext_timestamps, time_deltas, pair):
         """Store determined dt values"""
 
@@ -165,3 +345,50 @@ class ProcessTimeDeltas(object):
                                        expectedrows=len(delta_data))
         table.append(delta_data)
         table.flush()
+
+
+# ProcessTimeDeltas with its own read-only datafile and the detector offset
+# tables, set in each worker process
+_time_deltas_worker = None
+
+
+def _init_time_deltas_worker(path, coincidence_group, offsets):
+    """Initialize a worker process for determining time deltas
+
+    The worker opens the datafile itself. The datafile handles inherited
+    from the parent process are only forgotten, not closed. A different
+    driver than that of the parent is used, so that HDF5 does not share
+    the file descriptor inherited from the parent but opens the file
+    anew. The parent holds a lock on the file while it writes the time
+    deltas, so file locking is disabled.
+
+    :param path: path of the datafile.
+    :param coincidence_group: path to the coincidences group.
+    :param offsets: :class:`TimingOffsetTables` with the detector offsets
+        of all stations.
+
+    """
+    global _time_deltas_worker
+    for handle in list(tables.file._open_files.get_handlers_by_name(path)):
+        tables.file._open_files.remove(handle)
+    os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+    data = tables.open_file(path, 'r', driver='H5FD_STDIO')
+    _time_deltas_worker = (ProcessTimeDeltas(data, coincidence_group,
+                                             progress=False), offsets)
+
+
+def _determine_time_deltas_for_pair(pair):
+    """Determine the time deltas of a station pair
+
+    Worker function for
+    :meth:`ProcessTimeDeltas.determine_and_store_time_deltas_parallel`,
+    the worker should be initialized by :func:`_init_time_deltas_worker`.
+
+    :param pair: station pair (ref_station, station).
+    :return: the station pair, extended timestamps and time differences,
+             t - t_ref.
+
+    """
+    td, offsets = _time_deltas_worker
+    ets, dt = td.determine_time_deltas_for_pair_arrays(*pair, offsets=offsets)
+    return pair, ets, dt
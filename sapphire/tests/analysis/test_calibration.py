@@ -1,11 +1,17 @@
+import os
+import tempfile
 import unittest
+
 from mock import patch, sentinel, MagicMock, Mock, call
 from datetime import datetime, date
 
-from numpy import isnan, nan, array, all, std
-from numpy.random import uniform, normal
+from numpy import (isnan, nan, array, all, std, zeros, arange, histogram,
+                   concatenate, sum, abs, mean)
+from numpy.random import uniform, normal, RandomState
+from numpy.testing import assert_array_equal
+import tables
 
-from sapphire import HiSPARCNetwork, HiSPARCStations
+from sapphire import HiSPARCNetwork, HiSPARCStations, storage
 from sapphire.analysis import calibration
 from sapphire.transformations.clock import datetime_to_gps
 from sapphire.utils import c
@@ -88,6 +94,29 @@ class StationTimingTests(unittest.TestCase):
         offset, _ = calibration.determine_station_timing_offset([sentinel.dt])
         self.assertTrue(isnan(offset))
 
+    def test_determine_station_timing_offset_from_histogram(self):
+        # Empty histogram
+        offset = calibration.determine_station_timing_offset_from_histogram(
+            zeros(12), arange(-5., 6.), 0.)
+        self.assertTrue(all(isnan(offset)))
+
+        random = RandomState(1)
+        for _ in xrange(10):
+            dt = random.normal(random.uniform(-40, 40), random.uniform(10, 30),
+                               5000)
+            edges = arange(-200., 201.)
+            counts = histogram(dt, edges)[0]
+            counts = concatenate([[sum(dt < -200)], counts, [sum(dt >= 200)]])
+            dz = random.uniform(-5, 5)
+            offset, error = calibration.determine_station_timing_offset(dt,
+                                                                        dz)
+            h_offset, h_error = \
+                calibration.determine_station_timing_offset_from_histogram(
+                    counts, edges, std(dt), dz)
+            # Small differences due to the binning are expected
+            self.assertLess(abs(offset - h_offset), 2 * error)
+            self.assertAlmostEqual(h_error / error, 1, 1)
+
 
 class BestReferenceTests(unittest.TestCase):
 
@@ -210,16 +239,45 @@ class DetermineStationTimingOffsetsTests(unittest.TestCase):
         self.off.data = MagicMock()
         table_mock = MagicMock()
         self.off.data.get_node.return_value = table_mock
+        ts = [datetime_to_gps(datetime(2014, 1, day)) for day in [3, 1, 2, 5]]
+        columns = {'timestamp': array(ts), 'delta': array([3., 1., 2., 5.])}
+        table_mock.col.side_effect = lambda name: columns[name]
+        table_mock.nrows = 4
         station = 502
         ref_station = 501
-        start = datetime(2014, 1, 1)
-        end = datetime(2016, 12, 31)
-        self.off.read_dt(station, ref_station, start, end)
+        start = datetime(2014, 1, 2)
+        end = datetime(2014, 1, 5)
+        dt = self.off.read_dt(station, ref_station, start, end)
         table_path = '/time_deltas/station_%d/station_%d' % (ref_station,
                                                              station)
         table_name = 'time_deltas'
         self.off.data.get_node.assert_called_once_with(table_path, table_name)
-        self.assertTrue(table_mock.read_where.called)
+        # Rows in the window are returned in stored order
+        assert_array_equal(dt, [3., 2.])
+        self.assertEqual(table_mock.col.call_count, 2)
+
+        # Windows are sliced from the cached columns
+        dt = self.off.read_dt(station, ref_station, datetime(2014, 1, 1), end)
+        assert_array_equal(dt, [3., 1., 2.])
+        self.assertEqual(table_mock.col.call_count, 2)
+
+        # Columns are read again if the table changed
+        ts = [datetime_to_gps(datetime(2014, 1, day))
+              for day in [3, 1, 2, 5, 4]]
+        columns = {'timestamp': array(ts),
+                   'delta': array([3., 1., 2., 5., 4.])}
+        table_mock.nrows = 5
+        self.off.read_dt(station, ref_station, start, end)
+        self.assertEqual(table_mock.col.call_count, 4)
+
+        # Partly overlapping windows on unsorted timestamps
+        for start, end, expected in [(1, 4, [3., 1., 2.]),
+                                     (3, 6, [3., 5., 4.]),
+                                     (1, 3, [1., 2.])]:
+            dt = self.off.read_dt(station, ref_station,
+                                  datetime(2014, 1, start),
+                                  datetime(2014, 1, end))
+            assert_array_equal(dt, expected)
 
     def test_station_pairs_within_max_distance(self):
         results = list(self.off.get_station_pairs_within_max_distance())
@@ -361,5 +419,101 @@ class DetermineStationTimingOffsetsTests(unittest.TestCase):
         self.assertEqual(offsets, (nan, nan))
 
 
+class DetermineStationTimingOffsetsDataTests(unittest.TestCase):
+
+    def setUp(self):
+        self.data_path = self.create_tempfile_with_time_deltas()
+        self.data = tables.open_file(self.data_path, 'r')
+        self.off = calibration.DetermineStationTimingOffsets(
+            stations=[501, 102, 105, 8001], data=self.data, progress=False,
+            force_stale=True)
+
+    def tearDown(self):
+        self.data.close()
+        os.remove(self.data_path)
+
+    def create_tempfile_with_time_deltas(self):
+        """Store random time deltas for station 102 relative to 105"""
+
+        fd, path = tempfile.mkstemp(suffix='.h5')
+        os.close(fd)
+        ts0 = datetime_to_gps(datetime(2014, 1, 1))
+        ts1 = datetime_to_gps(datetime(2014, 2, 1))
+        random = RandomState(1)
+        timestamps = sorted(random.randint(ts0, ts1, 20000))
+        with tables.open_file(path, 'w') as data:
+            table = data.create_table('/time_deltas/station_105/station_102',
+                                      'time_deltas', storage.TimeDelta,
+                                      createparents=True)
+            row = table.row
+            for timestamp, delta in zip(timestamps,
+                                        random.normal(15, 20,
+                                                      len(timestamps))):
+                row['ext_timestamp'] = timestamp * int(1e9)
+                row['timestamp'] = timestamp
+                row['delta'] = delta
+                row.append()
+            table.flush()
+        return path
+
+    def test_read_dt(self):
+        table = self.data.get_node('/time_deltas/station_105/station_102',
+                                   'time_deltas')
+        for day in range(1, 28):
+            start = datetime(2014, 1, day)
+            end = datetime(2014, 1, day + 3)
+            ts0 = datetime_to_gps(start)  # noqa
+            ts1 = datetime_to_gps(end)  # noqa
+            expected = table.read_where(
+                '(timestamp >= ts0) & (timestamp < ts1)', field='delta')
+            assert_array_equal(self.off.read_dt(102, 105, start, end),
+                               expected)
+
+    def test_determine_station_timing_offsets_parallel(self):
+        start = date(2014, 1, 1)
+        end = date(2014, 1, 20)
+        offsets = self.off.determine_station_timing_offsets(102, 105, start,
+                                                            end)
+        self.assertEqual(len(offsets), 19)
+        self.assertFalse(isnan(offsets).any())
+        parallel = self.off.determine_station_timing_offsets(
+            102, 105, start, end, n_workers=2)
+        self.assertEqual(parallel, offsets)
+
+    def test_determine_station_timing_offsets_worker(self):
+        left = datetime(2014, 1, 5)
+        right = datetime(2014, 1, 15)
+        expected = self.off._fit_station_timing_offset(102, 105, left, right, 0.)
+        self.assertFalse(isnan(expected).any())
+        calibration._init_station_timing_offsets_worker(self.off)
+        with patch.object(calibration.DetermineStationTimingOffsets, '_get_cuts') as mock_cuts, \
+                patch.object(calibration.DetermineStationTimingOffsets, '_get_r_dz') as mock_r_dz:
+            result = calibration._determine_station_timing_offsets([(102, 105, left, right, 0.)] * 2)
+        self.assertEqual(result, [expected] * 2)
+        self.assertFalse(mock_cuts.called)
+        self.assertFalse(mock_r_dz.called)
+
+    def test_determine_station_timing_offsets_for_date_parallel(self):
+        offsets = self.off.determine_station_timing_offsets_for_date(
+            date(2014, 1, 10))
+        self.assertEqual(len(offsets), 1)
+        parallel = self.off.determine_station_timing_offsets_for_date(
+            date(2014, 1, 10), n_workers=2)
+        self.assertEqual(parallel, offsets)
+
+    def test_determine_station_timing_offsets_rolling(self):
+        start = date(2014, 1, 1)
+        end = date(2014, 1, 20)
+        offsets = array(self.off.determine_station_timing_offsets(
+            102, 105, start, end))
+        rolling = array(self.off.determine_station_timing_offsets_rolling(
+            102, 105, start, end))
+        assert_array_equal(rolling[:, 0], offsets[:, 0])
+        deviations = abs(rolling[:, 1] - offsets[:, 1]) / offsets[:, 2]
+        self.assertLess(deviations.max(), 2)
+        self.assertLess(mean(deviations), 0.5)
+        self.assertLess(abs(rolling[:, 2] / offsets[:, 2] - 1).max(), 0.05)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,15 @@
 import unittest
+import os
 
 from mock import sentinel, patch, call
+from numpy.testing import assert_array_equal
 
 from sapphire.analysis import coincidence_queries
 
 
+TEST_DATA = 'test_data/esd_coincidences.h5'
+
+
 class BaseCoincidenceQueryTest(unittest.TestCase):
 
     @patch.object(coincidence_queries.tables, 'open_file')
@@ -80,6 +85,30 @@ class BaseCoincidenceQueryTest(unittest.TestCase):
         mock_query.assert_called_once_with('(1 <= timestamp) & (timestamp < 2)', False)
         self.assertEqual(result, sentinel.coincidences)
 
+    @patch.object(coincidence_queries.CoincidenceQuery, '_get_row_range')
+    @patch.object(coincidence_queries.CoincidenceQuery, '_is_sorted')
+    def test_timerange_sorted(self, mock_sorted, mock_range):
+        mock_sorted.return_value = True
+        mock_range.return_value = (3, 7)
+        result = self.cq.timerange(1, 2)
+        mock_sorted.assert_called_once_with('timestamp')
+        mock_range.assert_called_once_with('timestamp', 1, 2)
+        self.cq.coincidences.read.assert_called_once_with(3, 7)
+        self.assertEqual(result, self.cq.coincidences.read.return_value)
+        result = self.cq.timerange(1, 2, iterator=True)
+        self.cq.coincidences.iterrows.assert_called_once_with(3, 7)
+        self.assertEqual(result, self.cq.coincidences.iterrows.return_value)
+
+    def test__is_sorted(self):
+        self.cq.coincidences._v_attrs = {}
+        self.assertFalse(self.cq._is_sorted('timestamp'))
+        self.cq.coincidences._v_attrs = {'sorted_by_timestamp': True}
+        self.assertTrue(self.cq._is_sorted('timestamp'))
+        self.assertTrue(self.cq._is_sorted('ext_timestamp'))
+        self.assertFalse(self.cq._is_sorted('N'))
+        # The column is not read
+        self.assertFalse(self.cq.coincidences.read.called)
+
     def test__add_timestamp_filter(self):
         result = self.cq._add_timestamp_filter(sentinel.query)
         self.assertEqual(result, sentinel.query)
@@ -182,5 +211,37 @@ class BaseCoincidenceQueryTest(unittest.TestCase):
         self.assertEqual(result, sentinel.coincidence_events)
 
 
+class CoincidenceQueryDataTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cq = coincidence_queries.CoincidenceQuery(self.get_testdata_path())
+
+    def tearDown(self):
+        self.cq.finish()
+
+    def test_timerange(self):
+        self.assertTrue(self.cq._is_sorted('timestamp'))
+        timestamps = self.cq.coincidences.col('timestamp')
+        for start, stop in [(0, 2000000000), (timestamps[0], timestamps[1]),
+                            (timestamps[0] + 1, timestamps[1] + 1),
+                            (timestamps[1] + 1, timestamps[1] + 10),
+                            (timestamps[1], timestamps[0])]:
+            query = '(%d <= timestamp) & (timestamp < %d)' % (start, stop)
+            expected = self.cq.perform_query(query)
+            assert_array_equal(self.cq.timerange(start, stop), expected)
+            self.assertEqual([row['id'] for row in self.cq.timerange(start, stop, iterator=True)],
+                             list(expected['id']))
+
+    def test__get_row_range(self):
+        timestamps = self.cq.coincidences.col('timestamp')
+        self.assertEqual(self.cq._get_row_range('timestamp', 0, timestamps[0]), (0, 0))
+        self.assertEqual(self.cq._get_row_range('timestamp', timestamps[0], timestamps[1]), (0, 1))
+        self.assertEqual(self.cq._get_row_range('timestamp', timestamps[0], timestamps[1] + 1), (0, 2))
+
+    def get_testdata_path(self):
+        dir_path = os.path.dirname(__file__)
+        return os.path.join(dir_path, TEST_DATA)
+
+
 if __name__ == '__main__':
     unittest.main()
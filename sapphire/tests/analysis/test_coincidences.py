@@ -3,11 +3,12 @@ import tempfile
 import os
 import shutil
 
-from mock import sentinel, patch, Mock
+from mock import sentinel, patch, Mock, MagicMock
 import tables
-from numpy import uint64
+from numpy import uint64, array
+from numpy.testing import assert_array_equal
 
-from sapphire.analysis import coincidences
+from sapphire.analysis import coincidences, coincidence_queries
 from sapphire.tests.validate_results import validate_results
 
 
@@ -100,6 +101,59 @@ class CoincidencesTests(unittest.TestCase):
         expected_coincidences = [[0, 1, 2, 3, 4, 5, 6, 7]]
         self.assertEqual(c, expected_coincidences)
 
+    def test__do_search_coincidences_chunked(self):
+        # [(timestamp, station_idx, event_idx), ..]
+        timestamps = [(uint64(0), 0, 0), (uint64(0), 1, 0), (uint64(10), 1, 1),
+                      (uint64(15), 2, 0), (uint64(100), 1, 2), (uint64(200), 2, 1),
+                      (uint64(250), 0, 1), (uint64(251), 0, 2)]
+
+        for window in [6, 150, 300]:
+            expected = self.c._do_search_coincidences(timestamps, window)
+            c = self.c._do_search_coincidences_chunked(iter(timestamps), window)
+            c = [[index for index, timestamp in coincidence] for coincidence in c]
+            self.assertEqual(c, expected)
+
+    def test__do_search_coincidences_parallel(self):
+        # [(timestamp, station_idx, event_idx), ..]
+        timestamps = [(uint64(0), 0, 0), (uint64(0), 1, 0), (uint64(10), 1, 1),
+                      (uint64(15), 2, 0), (uint64(100), 1, 2), (uint64(200), 2, 1),
+                      (uint64(250), 0, 1), (uint64(251), 0, 2)]
+
+        for window in [6, 150, 300]:
+            expected = self.c._do_search_coincidences(timestamps, window)
+            for n_workers in [1, 3, 10]:
+                c = self.c._do_search_coincidences_parallel(timestamps, window, n_workers)
+                self.assertEqual(c, expected)
+        self.assertEqual(self.c._do_search_coincidences_parallel([], 6), [])
+
+    def test__search_coincidences_in_slice(self):
+        ts = array([0, 0, 10, 15, 100, 200, 250, 251], dtype=uint64)
+        # Search all
+        c = coincidences._search_coincidences_in_slice((ts, uint64(150), 0, 0, 8))
+        self.assertEqual(c, [[0, 1, 2, 3, 4], [4, 5], [5, 6, 7]])
+        # Slice starting after the first timestamp, preceded by one
+        c = coincidences._search_coincidences_in_slice((ts[3:], uint64(150), 3, 1, 3))
+        self.assertEqual(c, [[4, 5], [5, 6, 7]])
+        c = coincidences._search_coincidences_in_slice((ts[3:], uint64(150), 3, 1, 2))
+        self.assertEqual(c, [[4, 5]])
+
+    def test__iter_station_timestamps(self):
+        event_table = MagicMock()
+        ts = array([1, 5, 8, 20, 21], dtype=uint64)
+        event_table.__len__.return_value = len(ts)
+        event_table.read.side_effect = lambda start, stop, field: ts[start:stop]
+
+        timestamps = list(self.c._iter_station_timestamps(event_table, 3, chunksize=2))
+        self.assertEqual(timestamps, [(1, 3, 0), (5, 3, 1), (8, 3, 2), (20, 3, 3), (21, 3, 4)])
+        event_table.read.assert_called_with(4, 5, field='ext_timestamp')
+        # Shift and limit
+        timestamps = list(self.c._iter_station_timestamps(event_table, 0, shift=-1, limit=2, chunksize=2))
+        self.assertEqual(timestamps, [(0, 0, 0), (4, 0, 1)])
+        # Unsorted events, also over chunk boundaries
+        ts = array([1, 5, 4, 20, 21], dtype=uint64)
+        self.assertRaises(RuntimeError, list, self.c._iter_station_timestamps(event_table, 0, chunksize=2))
+        self.assertRaises(RuntimeError, list, self.c._iter_station_timestamps(event_table, 0, chunksize=3))
+
 
 class CoincidencesESDTests(CoincidencesTests):
 
@@ -151,6 +205,53 @@ class CoincidencesDataTests(unittest.TestCase):
 
         validate_results(self, self.get_testdata_path(), self.data_path)
 
+    def test_store_coincidences_blocks(self):
+        with tables.open_file(self.data_path, 'a') as data:
+            stations = ['/station_501', '/station_502']
+            c = coincidences.Coincidences(data, '/c_rows', stations,
+                                          progress=False)
+            c.search_coincidences()
+            c.store_coincidences()
+            for blocksize in [1, 3, 1000]:
+                group = '/c_blocks_%d' % blocksize
+                c = coincidences.Coincidences(data, group, stations,
+                                              progress=False)
+                c.search_coincidences()
+                c.store_coincidences(blocksize=blocksize)
+                for table in ['coincidences', 'observables']:
+                    assert_array_equal(data.get_node(group, table).read(),
+                                       data.get_node('/c_rows', table).read())
+                self.assertEqual([list(u) for u in data.get_node(group, 'c_index')],
+                                 [list(u) for u in data.root.c_rows.c_index])
+
+    def test_search_coincidences_chunked(self):
+        with tables.open_file(self.data_path, 'r') as data:
+            c = coincidences.Coincidences(data, None,
+                                          ['/station_501', '/station_502'],
+                                          progress=False)
+            for window in [10000, int(1e8), int(1e9)]:
+                c_index, timestamps = c._search_coincidences(window)
+                expected = [[timestamps[i] for i in coincidence]
+                            for coincidence in c_index]
+                for chunksize in [1, 7, 1000]:
+                    c_index, timestamps = c._search_coincidences_chunked(
+                        window, chunksize=chunksize)
+                    result = [[timestamps[i] for i in coincidence]
+                              for coincidence in c_index]
+                    self.assertEqual(result, expected)
+
+    def test_search_coincidences_parallel(self):
+        with tables.open_file(self.data_path, 'r') as data:
+            c = coincidences.Coincidences(data, None,
+                                          ['/station_501', '/station_502'],
+                                          progress=False)
+            for window in [10000, int(1e8), int(1e9)]:
+                expected = c._search_coincidences(window)
+                for n_workers in [2, 5]:
+                    result = c._search_coincidences_parallel(
+                        window, n_workers=n_workers)
+                    self.assertEqual(result, expected)
+
     def create_tempfile_from_testdata(self):
         tmp_path = self.create_tempfile_path()
         data_path = self.get_testdata_path()
@@ -184,6 +285,91 @@ class CoincidencesESDDataTests(CoincidencesDataTests):
             c.search_and_store_coincidences(station_numbers=[501, 502])
         validate_results(self, self.get_testdata_path(), self.data_path)
 
+    def test_coincidencesesd_chunked_output(self):
+        with tables.open_file(self.data_path, 'a') as data:
+            c = coincidences.CoincidencesESD(data, '/coincidences',
+                                             ['/station_501', '/station_502'],
+                                             progress=False)
+            c.search_coincidences(chunksize=10)
+            c.store_coincidences(station_numbers=[501, 502])
+        validate_results(self, self.get_testdata_path(), self.data_path)
+
+    def test_coincidencesesd_parallel_output(self):
+        with tables.open_file(self.data_path, 'a') as data:
+            c = coincidences.CoincidencesESD(data, '/coincidences',
+                                             ['/station_501', '/station_502'],
+                                             progress=False)
+            self.assertRaises(RuntimeError, c.search_coincidences,
+                              chunksize=10, n_workers=2)
+            c.search_coincidences(n_workers=3)
+            c.store_coincidences(station_numbers=[501, 502])
+        validate_results(self, self.get_testdata_path(), self.data_path)
+
+    def test_coincidencesesd_shifts_unsorted(self):
+        with tables.open_file(self.data_path, 'a') as data:
+            c = coincidences.CoincidencesESD(data, '/coincidences',
+                                             ['/station_501', '/station_502'],
+                                             overwrite=True, progress=False)
+            # The stored (unshifted) timestamps are not sorted
+            c.search_coincidences(window=int(1e9), shifts=[None, 10])
+            c.store_coincidences(station_numbers=[501, 502])
+            timestamps = data.root.coincidences.coincidences.col('timestamp')
+            self.assertFalse((timestamps[1:] >= timestamps[:-1]).all())
+            self.assertNotIn('sorted_by_timestamp',
+                             data.root.coincidences.coincidences._v_attrs)
+
+            cq = coincidence_queries.CoincidenceQuery(data)
+            start, stop = timestamps[1], timestamps[0] + 1
+            with patch.object(cq, 'perform_query',
+                              wraps=cq.perform_query) as mock_query:
+                result = cq.timerange(start, stop)
+            mock_query.assert_called_once_with(
+                '(%d <= timestamp) & (timestamp < %d)' % (start, stop), False)
+            assert_array_equal(result['timestamp'],
+                               timestamps[(timestamps >= start) &
+                                          (timestamps < stop)])
+
+    def test_search_coincidences_incremental(self):
+        stations = ['/station_501', '/station_502']
+        with tables.open_file(self.data_path, 'a') as data:
+            events = [data.get_node(station, 'events').read()
+                      for station in stations]
+            for window in [10000, int(1e9), int(3e9)]:
+                expected = '/expected_%d' % window
+                c = coincidences.CoincidencesESD(data, expected, stations,
+                                                 progress=False)
+                c.search_and_store_coincidences(window=window)
+
+                # Append events to new tables in three steps
+                group = '/incremental_%d' % window
+                new_stations = [group + station for station in stations]
+                for station, station_events in zip(new_stations, events):
+                    data.create_table(station, 'events', station_events[:0],
+                                      createparents=True)
+                for split in [.3, .8, 1.]:
+                    for station, station_events in zip(new_stations, events):
+                        n = int(len(station_events) * split)
+                        table = data.get_node(station, 'events')
+                        table.append(station_events[len(table):n])
+                    c = coincidences.CoincidencesESD(data, group + '/coincidences',
+                                                     new_stations, progress=False,
+                                                     incremental=True)
+                    c.search_and_store_coincidences(window=window)
+
+                result = data.get_node(group, 'coincidences')
+                assert_array_equal(result.coincidences.read(),
+                                   data.get_node(expected, 'coincidences').read())
+                self.assertEqual([u.tolist() for u in result.c_index],
+                                 [u.tolist() for u in data.get_node(expected, 'c_index')])
+                self.assertNotIn('new_c_index', result)
+
+            # The window can not change between searches
+            c = coincidences.CoincidencesESD(data, group + '/coincidences',
+                                             new_stations, progress=False,
+                                             incremental=True)
+            self.assertRaises(RuntimeError, c.search_coincidences, window=5)
+            self.assertRaises(RuntimeError, c.search_coincidences, window=window, limit=5)
+
     def get_testdata_path(self):
         dir_path = os.path.dirname(__file__)
         return os.path.join(dir_path, TEST_DATA_ESD)
@@ -1,6 +1,12 @@
 import unittest
+from itertools import combinations
+
+from numpy import array, nan, isnan, pi, cos
+from numpy.random import RandomState
+from numpy.testing import assert_allclose, assert_array_equal
 
 from sapphire.analysis import core_reconstruction
+from sapphire.simulations.ldf import EllipsLdf
 
 
 class BaseAlgorithm(object):
@@ -33,17 +39,100 @@ class CenterMassAlgorithmTest(unittest.TestCase, BaseAlgorithm):
         self.algorithm = core_reconstruction.CenterMassAlgorithm()
 
 
+class CenterMassAlgorithmArraysTest(unittest.TestCase, BaseAlgorithm):
+
+    def setUp(self):
+        self.algorithm = core_reconstruction.CenterMassAlgorithm()
+
+    def call_reconstruct(self, p, x, y, z):
+        core_x, core_y = self.algorithm.reconstruct_common_arrays([p], x, y, z)
+        return core_x[0], core_y[0]
+
+    def test_reconstruct_arrays_per_event(self):
+        random = RandomState(0)
+        n = 1000
+        p = random.exponential(2, size=(n, 6))
+        x = random.uniform(-100, 100, size=(n, 6))
+        y = random.uniform(-100, 100, size=(n, 6))
+        theta = random.uniform(0, pi / 2, size=n)
+        # Zero to six detectors per event
+        p[random.uniform(size=(n, 6)) < 0.3] = nan
+        x[isnan(p)] = nan
+
+        core_x, core_y = self.algorithm.reconstruct_common_arrays(
+            p, x, y, initial={'theta': theta})
+        for i in range(n):
+            detected = ~isnan(p[i])
+            if not detected.any():
+                self.assertTrue(isnan(core_x[i]))
+                self.assertTrue(isnan(core_y[i]))
+                continue
+            expected = self.algorithm.reconstruct_common(
+                p[i][detected], x[i][detected], y[i][detected],
+                initial={'theta': theta[i]})
+            assert_allclose((core_x[i], core_y[i]), expected, rtol=1e-12)
+
+    def test_initial_theta(self):
+        p = [[1., 2., 3.], [1., nan, 1.]]
+        x = [0., 10., 20.]
+        y = [0., 0., 10.]
+        expected = ([40. / 3, 10.], [5., 5.])
+        assert_allclose(self.algorithm.reconstruct_arrays(p, x, y), expected)
+        assert_allclose(self.algorithm.reconstruct_common_arrays(
+            p, x, y, initial={'theta': 0.3}), expected)
+        assert_allclose(self.algorithm.reconstruct_common_arrays(
+            cos(0.3) * array(p), x, y, initial={'theta': [nan, 0.3]}), expected)
+
+    def test_no_particles(self):
+        core_x, core_y = self.algorithm.reconstruct_arrays([[0., 0.], [nan, nan]], [0., 1.], [0., 1.])
+        self.assertTrue(isnan(core_x).all())
+        self.assertTrue(isnan(core_y).all())
+
+
 class AverageIntersectionAlgorithmTest(unittest.TestCase, BaseAlgorithm):
 
     def setUp(self):
         self.algorithm = core_reconstruction.AverageIntersectionAlgorithm()
 
 
+class CombinationIndexesTest(unittest.TestCase):
+
+    def test_combination_indexes(self):
+        for n in range(6):
+            for k in (2, 3):
+                indexes = core_reconstruction.combination_indexes(n, k)
+                self.assertEqual(indexes.shape[1], k)
+                assert_array_equal(indexes.tolist(), list(combinations(range(n), k)))
+        self.assertIs(core_reconstruction.combination_indexes(5, 3),
+                      core_reconstruction.combination_indexes(5, 3))
+
+
 class EllipsLdfAlgorithmTest(unittest.TestCase, BaseAlgorithm):
 
     def setUp(self):
         self.algorithm = core_reconstruction.EllipsLdfAlgorithm()
 
 
+class EllipsLdfFitAlgorithmTest(unittest.TestCase, BaseAlgorithm):
+
+    def setUp(self):
+        self.algorithm = core_reconstruction.EllipsLdfFitAlgorithm()
+
+    def test_simulated_densities(self):
+        """Densities from the LDF give back the core position and size"""
+
+        x = array([0., 100., 0., 100., 50., 150.])
+        y = array([0., 0., 100., 100., 180., 60.])
+        for core_x, core_y, theta, phi in [(43.6, 2.6, 0.2, 1.), (30., 26.7, 0.5, -2.)]:
+            ldf = EllipsLdf(Ne=10 ** 5.2, zenith=theta, azimuth=phi)
+            r, angle = ldf.calculate_core_distance_and_angle(x, y, core_x, core_y)
+            p = ldf.calculate_ldf_value(r, angle)
+            result = self.algorithm.reconstruct(p, x, y, theta, phi)
+            self.assertAlmostEqual(result[0], core_x, places=1)
+            self.assertAlmostEqual(result[1], core_y, places=1)
+            self.assertAlmostEqual(result[2], 0., places=6)
+            self.assertAlmostEqual(result[3] / 10 ** 5.2, 1., places=3)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,10 +2,15 @@ import unittest
 import warnings
 
 from mock import sentinel, patch, Mock, MagicMock
-from numpy import isnan, nan, pi, sqrt, arcsin, arctan
+from numpy import (isnan, nan, pi, sqrt, arcsin, arctan, array, errstate, sin,
+                   cos)
+from numpy.random import RandomState
+from numpy.testing import assert_allclose, assert_array_equal
 
+from sapphire import clusters
 from sapphire.analysis import direction_reconstruction
-from sapphire.simulations.showerfront import ConeFront
+from sapphire.simulations.showerfront import ConeFront, CorsikaStationFront
+from sapphire.utils import c, norm_angle
 
 
 class EventDirectionReconstructionTest(unittest.TestCase):
@@ -16,14 +21,45 @@ class EventDirectionReconstructionTest(unittest.TestCase):
         self.assertEqual(dirrec.fit, direction_reconstruction.RegressionAlgorithm3D)
         self.assertEqual(dirrec.station, sentinel.station)
 
-    def test_set_cluster_timestamp(self):
-        station = Mock()
+    @patch.object(direction_reconstruction, 'detector_arrival_time')
+    def test_set_cluster_timestamp(self, mock_detector_arrival_time):
+        mock_detector_arrival_time.return_value = 0.
+        station = MagicMock()
+        station.timestamps = [0, 10]
+        station.detectors.__getitem__.return_value.get_coordinates.return_value = (0., 0., 0.)
         dirrec = direction_reconstruction.EventDirectionReconstruction(station)
-        theta, phi, ids = dirrec.reconstruct_event({'timestamp': sentinel.timestamp}, detector_ids=[])
-        station.cluster.set_timestamp.assert_called_with(sentinel.timestamp)
+        theta, phi, ids = dirrec.reconstruct_event({'timestamp': 1}, detector_ids=[0])
+        station.cluster.set_timestamp.assert_called_once_with(1)
         self.assertTrue(isnan(theta))
         self.assertTrue(isnan(phi))
 
+        # Same geometry, use cached coordinates
+        dirrec.reconstruct_event({'timestamp': 5}, detector_ids=[0])
+        self.assertEqual(station.cluster.set_timestamp.call_count, 1)
+
+        # Other geometry
+        dirrec.reconstruct_event({'timestamp': 10}, detector_ids=[0])
+        station.cluster.set_timestamp.assert_called_with(10)
+        self.assertEqual(station.cluster.set_timestamp.call_count, 2)
+
+    def test_reconstruct_events_geometry_cache(self):
+        cluster = clusters.BaseCluster()
+        cluster._add_station(([0., 3.], [0., 4.], [0., 0.]), angle=[0., pi / 3],
+                             station_timestamps=[0, 100])
+        station = cluster.get_station(0)
+        events = [{'timestamp': ts, 't1': 0., 't2': 10., 't3': 4., 't4': -3.}
+                  for ts in (50, 150, 60, 160)]
+
+        dirrec = direction_reconstruction.EventDirectionReconstruction(station)
+        theta, phi, ids = dirrec.reconstruct_events(events, progress=False)
+
+        for event, theta_event, phi_event in zip(events, theta, phi):
+            # New instance, without cached coordinates
+            dirrec = direction_reconstruction.EventDirectionReconstruction(station)
+            self.assertEqual(dirrec.reconstruct_event(event)[:2], (theta_event, phi_event))
+        self.assertNotEqual(phi[0], phi[1])
+        self.assertEqual(phi[0], phi[2])
+
     @patch.object(direction_reconstruction, 'detector_arrival_time')
     def test_bad_times(self, mock_detector_arrival_time):
         mock_detector_arrival_time.return_value = nan
@@ -100,14 +136,48 @@ class CoincidenceDirectionReconstructionTest(unittest.TestCase):
 
     def test_set_cluster_timestamp(self):
         dirrec = self.dirrec
-        cluster = Mock()
+        cluster = MagicMock()
         dirrec.cluster = cluster
         coincidence = [[sentinel.station_number, {'timestamp': 1}], [0, 0], [0, 0]]
         theta, phi, nums = dirrec.reconstruct_coincidence(coincidence, station_numbers=[])
-        cluster.set_timestamp.assert_called_with(1)
+        cluster.set_timestamp.assert_called_once_with(1)
         self.assertTrue(isnan(theta))
         self.assertTrue(isnan(phi))
 
+        # Same stations and geometry, use cached coordinates
+        dirrec.reconstruct_coincidence(coincidence, station_numbers=[])
+        self.assertEqual(cluster.set_timestamp.call_count, 1)
+        self.assertEqual(dirrec.cache_info(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_reconstruct_coincidences_geometry_cache(self):
+        cluster = clusters.BaseCluster()
+        for i, number in enumerate([501, 502, 503, 504]):
+            x, y = (i % 2 * 100., i // 2 * 100.)
+            cluster._add_station(([x, x + i * 10.], [y, y], [0., 0.]),
+                                 station_timestamps=[0, 100], number=number)
+        event = {'t1': 0., 't2': 10., 't3': 4., 't4': -3., 't_trigger': 0.}
+        coincidences = []
+        for ts in (50, 150, 60, 160, 70):
+            coincidence = []
+            for i, number in enumerate([501, 502, 503, 504]):
+                station_event = dict(event, timestamp=ts, ext_timestamp=ts * int(1e9) + 20 * i)
+                coincidence.append((number, station_event))
+            coincidences.append(coincidence)
+        coincidences[4] = coincidences[4][1:]
+
+        dirrec = self.dirrec.__class__(cluster)
+        theta, phi, nums = dirrec.reconstruct_coincidences(coincidences, progress=False)
+        self.assertEqual(dirrec.cache_info(), {'hits': 2, 'misses': 3, 'size': 3})
+
+        for coincidence, theta_coincidence, phi_coincidence in zip(coincidences, theta, phi):
+            # New instance, without cached coordinates
+            dirrec = self.dirrec.__class__(cluster)
+            self.assertEqual(dirrec.reconstruct_coincidence(coincidence)[:2],
+                             (theta_coincidence, phi_coincidence))
+        self.assertNotEqual(theta[0], theta[1])
+        self.assertEqual(theta[0], theta[2])
+        self.assertEqual(nums[4], [502, 503, 504])
+
     @patch.object(direction_reconstruction, 'station_arrival_time')
     def test_reconstruct_coincidence(self, mock_station_arrival_time):
         dirrec = self.dirrec
@@ -428,6 +498,60 @@ class DirectAlgorithm(FlatAlgorithm):
             self.assertTrue(-pi <= phi < pi)
 
 
+class DirectArraysAlgorithm(DirectAlgorithm):
+
+    """Use this class to check the array versions of direct algorithms
+
+    All tests for the direct algorithms are performed with a single event
+    array, and the results for many events are compared to those of the
+    per event reconstruction.
+
+    """
+
+    def call_reconstruct(self, t, x, y, z, initial={}):
+        theta, phi = self.algorithm.reconstruct_common_arrays([t], x, y, z,
+                                                              initial)
+        return theta[0], phi[0]
+
+    def test_reconstruct_arrays_per_event(self):
+        random = RandomState(0)
+        n = 500
+        t = random.normal(0, 20, size=(n, 3))
+        x = random.uniform(-10, 10, size=(n, 3))
+        y = random.uniform(-10, 10, size=(n, 3))
+        z = random.uniform(-1, 1, size=(n, 3))
+        # Shower from zenith, invalid arrival times, same positions
+        t[:10] = 0.
+        t[10:20, 0] = nan
+        t[20:30, 1:] = 0.
+        t[30:40, 2] = t[30:40, 0]
+        x[40:50, 1] = x[40:50, 0]
+        y[40:50, 1] = y[40:50, 0]
+        x[50:60] = 0.
+        y[60:70] = y[60:70, :1]
+        z[70:80] = nan
+
+        with errstate(all='ignore'):
+            theta, phi = self.algorithm.reconstruct_common_arrays(t, x, y, z)
+            expected = array([self.algorithm.reconstruct_common(t[i], x[i], y[i], z[i])
+                              for i in range(n)])
+
+        assert_array_equal(isnan(theta), isnan(expected[:, 0]))
+        assert_array_equal(isnan(phi), isnan(expected[:, 1]))
+        assert_allclose(theta, expected[:, 0], rtol=1e-10, atol=1e-12)
+        assert_allclose(phi, expected[:, 1], rtol=1e-10, atol=1e-12)
+        # Some events are reconstructed, some are not
+        self.assertTrue(0 < isnan(theta).sum() < n)
+
+        # Same positions for all events
+        with errstate(all='ignore'):
+            theta, phi = self.algorithm.reconstruct_common_arrays(t, x[100], y[100], z[100])
+            expected = array([self.algorithm.reconstruct_common(t[i], x[100], y[100], z[100])
+                              for i in range(n)])
+        assert_allclose(theta, expected[:, 0], rtol=1e-10, atol=1e-12)
+        assert_allclose(phi, expected[:, 1], rtol=1e-10, atol=1e-12)
+
+
 class AltitudeAlgorithm(FlatAlgorithm):
 
     """Use this class to check the altitude support
@@ -544,6 +668,60 @@ class MultiAltitudeAlgorithm(MultiAlgorithm, AltitudeAlgorithm):
         self.assertAlmostEqual(theta, zenith, 4)
 
 
+class MultiArraysAlgorithm(MultiAlgorithm):
+
+    """Use this class to check the array versions of multi algorithms
+
+    All tests for the multi algorithms are performed with a single event
+    array, and the results for many events with varying numbers of
+    detections are compared to those of the per event reconstruction.
+
+    """
+
+    n_events = 1000
+
+    def call_reconstruct(self, t, x, y, z, initial={}):
+        theta, phi = self.algorithm.reconstruct_common_arrays([t], x, y, z,
+                                                              initial)
+        return theta[0], phi[0]
+
+    def test_reconstruct_arrays_per_event(self):
+        random = RandomState(0)
+        n = self.n_events
+        t = random.normal(0, 20, size=(n, 6))
+        x = random.uniform(-10, 10, size=(n, 6))
+        y = random.uniform(-10, 10, size=(n, 6))
+        z = random.uniform(-1, 1, size=(n, 6))
+        # Zero to six detections per event
+        t[random.uniform(size=(n, 6)) < 0.3] = nan
+        # Shower from zenith, same positions, detectors on a line
+        t[:10] = 0.
+        x[10:20, 1] = x[10:20, 0]
+        y[10:20, 1] = y[10:20, 0]
+        x[20:30] = 0.
+        y[30:40] = y[30:40, :1]
+
+        with errstate(all='ignore'):
+            theta, phi = self.algorithm.reconstruct_common_arrays(t, x, y, z)
+            checks = direction_reconstruction.logic_checks_arrays(t, x, y, z)
+            expected = []
+            expected_checks = []
+            for i in range(n):
+                detected = ~isnan(t[i])
+                ti, xi, yi, zi = t[i][detected], x[i][detected], y[i][detected], z[i][detected]
+                expected.append(self.algorithm.reconstruct_common(ti, xi, yi, zi))
+                expected_checks.append(direction_reconstruction.logic_checks(ti, xi, yi, zi))
+        expected = array(expected)
+
+        assert_array_equal(checks, expected_checks)
+        assert_array_equal(isnan(theta), isnan(expected[:, 0]))
+        assert_array_equal(isnan(phi), isnan(expected[:, 1]))
+        assert_allclose(theta, expected[:, 0], rtol=1e-8, atol=1e-10)
+        assert_allclose(phi, expected[:, 1], rtol=1e-8, atol=1e-10)
+        # Some events are reconstructed, some are not
+        self.assertTrue(0 < isnan(theta).sum() < n)
+
+
 class CurvedAlgorithm(BaseAlgorithm):
 
     """Check some algorithms supporting a curved shower front.
@@ -592,6 +770,62 @@ class CurvedAltitudeAlgorithm(CurvedAlgorithm):
         self.assertTrue(-pi <= phi < pi)
 
 
+class CurvedArraysAlgorithm(CurvedAlgorithm):
+
+    """Use this class to check the array versions of curved algorithms
+
+    All tests for the curved algorithms are performed with a single event
+    array, and the results for many events are compared to those of the
+    per event reconstruction.
+
+    """
+
+    def call_reconstruct(self, t, x, y, z, initial={}):
+        initial = {key: [value] for key, value in initial.items()}
+        theta, phi = self.algorithm.reconstruct_common_arrays([t], x, y, z,
+                                                              initial)
+        return theta[0], phi[0]
+
+    def test_reconstruct_arrays_per_event(self):
+        self.algorithm.front = CorsikaStationFront()
+        random = RandomState(0)
+        n = 300
+        x = array([0., 60., 120., 0., 60., 120.])
+        y = array([0., 0., 0., 80., 80., 80.])
+        z = array([0., 2., -1., 1., 0., 3.])
+        theta = random.uniform(0, 0.8, size=n)
+        phi = random.uniform(-pi, pi, size=n)
+        core_x = random.uniform(-100, 200, size=n)
+        core_y = random.uniform(-100, 200, size=n)
+        r = self.algorithm.radial_core_distance(x, y, core_x[:, None], core_y[:, None],
+                                                theta[:, None], phi[:, None])
+        t = -(sin(theta) * cos(phi))[:, None] * x
+        t -= (sin(theta) * sin(phi))[:, None] * y
+        t -= cos(theta)[:, None] * z
+        t = t / c + self.algorithm.front.delay_at_r(r) + random.normal(0, 2, size=(n, 6))
+        t[random.uniform(size=(n, 6)) < 0.3] = nan
+        core_x[:5] = nan
+
+        with errstate(all='ignore'):
+            theta, phi = self.algorithm.reconstruct_common_arrays(
+                t, x, y, z, {'core_x': core_x, 'core_y': core_y})
+            expected = []
+            for i in range(n):
+                detected = ~isnan(t[i])
+                expected.append(self.algorithm.reconstruct_common(
+                    t[i][detected], x[detected], y[detected], z[detected],
+                    {'core_x': core_x[i], 'core_y': core_y[i]}))
+        expected = array(expected)
+
+        assert_array_equal(isnan(theta), isnan(expected[:, 0]))
+        assert_array_equal(isnan(phi), isnan(expected[:, 1]))
+        assert_allclose(theta, expected[:, 0], atol=1e-5)
+        valid = ~isnan(phi)
+        assert_allclose(norm_angle(phi[valid] - expected[valid, 1]), 0, atol=1e-3)
+        # Some events are reconstructed, some are not
+        self.assertTrue(0 < isnan(theta).sum() < n)
+
+
 class DirectAlgorithmTest(unittest.TestCase, DirectAlgorithm):
 
     def setUp(self):
@@ -611,18 +845,149 @@ class DirectAlgorithmCartesian3DTest(unittest.TestCase,
         self.algorithm = direction_reconstruction.DirectAlgorithmCartesian3D()
 
 
+class DirectAlgorithmArraysTest(unittest.TestCase, DirectArraysAlgorithm):
+
+    def setUp(self):
+        self.algorithm = direction_reconstruction.DirectAlgorithm()
+
+
+class DirectAlgorithmCartesianArraysTest(unittest.TestCase,
+                                         DirectArraysAlgorithm):
+
+    def setUp(self):
+        self.algorithm = direction_reconstruction.DirectAlgorithmCartesian()
+
+
+class DirectAlgorithmCartesian3DArraysTest(unittest.TestCase,
+                                           DirectArraysAlgorithm,
+                                           AltitudeAlgorithm):
+
+    def setUp(self):
+        self.algorithm = direction_reconstruction.DirectAlgorithmCartesian3D()
+
+
+class SphereAlgorithmTest(unittest.TestCase):
+
+    def setUp(self):
+        self.algorithm = direction_reconstruction.SphereAlgorithm()
+        # ECEF coordinates of three stations near Amsterdam
+        self.x = (3889100., 3889137., 3888995.)
+        self.y = (336850., 336967., 336984.)
+        self.z = (5027200., 5027174., 5027283.)
+
+    def test_reconstruct_source_ECS_arrays(self):
+        random = RandomState(0)
+        n = 200
+        # Mostly physical, some unphysical arrival times
+        t = random.normal(0, 200, size=(n, 3))
+        # Stations near Amsterdam and near Sydney, for the latter the
+        # other solution is above the earths surface.
+        for x, y, z in [(self.x, self.y, self.z),
+                        ((-4683129., -4683188., -4683202.),
+                         (2595901., 2595819., 2595907.),
+                         (-3453959., -3453942., -3453859.))]:
+            with errstate(all='ignore'):
+                dec, ra = self.algorithm.reconstruct_source_ECS_arrays(t, x, y, z, 0)
+                expected = array([self.algorithm.reconstruct_source_ECS(t[i], x, y, z, 0)
+                                  for i in range(n)])
+            assert_array_equal(isnan(dec), isnan(expected[:, 0]))
+            assert_array_equal(isnan(ra), isnan(expected[:, 1]))
+            self.assertTrue(0 < isnan(dec).sum() < n)
+            assert_allclose(dec, expected[:, 0], rtol=1e-10, atol=1e-12)
+            assert_allclose(ra, expected[:, 1], rtol=1e-10, atol=1e-12)
+
+    def test_interaction_curve_arrays(self):
+        t = array([[0., 100., 200.], [0., 10., -20.]])
+        t_int = array([[-1000., -10000.], [-1000., -10000.]])
+        with errstate(all='ignore'):
+            result = self.algorithm.interaction_curve_arrays(self.x, self.y, self.z, t, t_int)
+            for i in range(2):
+                expected = self.algorithm.interaction_curve(self.x, self.y, self.z, t[i], t_int[i])
+                for values, expected_values in zip(result, expected):
+                    assert_allclose(values[i], expected_values)
+
+        # Detectors on the same location give no solution
+        x = (self.x[0], self.x[0], self.x[2])
+        y = (self.y[0], self.y[0], self.y[2])
+        z = (self.z[0], self.z[0], self.z[2])
+        with errstate(all='ignore'):
+            x_int, y_int, z_int, _ = self.algorithm.interaction_curve_arrays(x, y, z, t, t_int)
+        self.assertTrue(isnan(x_int).all())
+        self.assertTrue(isnan(y_int).all())
+        self.assertTrue(isnan(z_int).all())
+
+
 class FitAlgorithm3DTest(unittest.TestCase, MultiAltitudeAlgorithm):
 
     def setUp(self):
         self.algorithm = direction_reconstruction.FitAlgorithm3D()
 
 
+class FitAlgorithm3DArraysTest(unittest.TestCase, MultiArraysAlgorithm,
+                               MultiAltitudeAlgorithm):
+
+    n_events = 200
+
+    def setUp(self):
+        self.algorithm = direction_reconstruction.FitAlgorithm3D()
+
+    def simulate_events(self, n):
+        random = RandomState(1)
+        x = array([0., 10., 10., 0., 5.])
+        y = array([0., 0., 10., 10., 5.])
+        z = array([0., 1., -1., 0.5, 0.])
+        theta = random.uniform(0, 1, size=n)
+        phi = random.uniform(-pi, pi, size=n)
+        t = -(sin(theta) * cos(phi))[:, None] * x
+        t -= (sin(theta) * sin(phi))[:, None] * y
+        t -= cos(theta)[:, None] * z
+        t = t / c + random.normal(0, 1, size=(n, 5))
+        t[random.uniform(size=(n, 5)) < 0.2] = nan
+        return t, x, y, z
+
+    def test_reconstruct_arrays_warm_start(self):
+        t, x, y, z = self.simulate_events(self.n_events)
+
+        with errstate(all='ignore'):
+            theta, phi, iterations, durations = self.algorithm.reconstruct_common_arrays(
+                t, x, y, z, return_stats=True)
+            theta_warm, phi_warm, iterations_warm, durations_warm = self.algorithm.reconstruct_common_arrays(
+                t, x, y, z, warm_start=True, return_stats=True)
+
+        both = ~isnan(theta) & ~isnan(theta_warm)
+        self.assertTrue(both.sum() > 0.9 * (~isnan(theta)).sum())
+        assert_allclose(theta_warm[both], theta[both], atol=1e-3)
+        assert_allclose(phi_warm[both], phi[both], atol=1e-3)
+        # Fewer iterations needed with warm start
+        self.assertTrue(iterations_warm.sum() < iterations.sum())
+        # No fits for events failing the logic checks
+        self.assertEqual(iterations[isnan(theta)].min(), 0)
+        self.assertTrue((durations[iterations > 0] > 0).all())
+
+    def test_reconstruct_arrays_parallel(self):
+        t, x, y, z = self.simulate_events(20)
+
+        with errstate(all='ignore'):
+            theta, phi = self.algorithm.reconstruct_common_arrays(t, x, y, z)
+            theta_par, phi_par = self.algorithm.reconstruct_common_arrays(
+                t, x, y, z, n_workers=2)
+
+        assert_array_equal(theta_par, theta)
+        assert_array_equal(phi_par, phi)
+
+
 class RegressionAlgorithmTest(unittest.TestCase, MultiAlgorithm):
 
     def setUp(self):
         self.algorithm = direction_reconstruction.RegressionAlgorithm()
 
 
+class RegressionAlgorithmArraysTest(unittest.TestCase, MultiArraysAlgorithm):
+
+    def setUp(self):
+        self.algorithm = direction_reconstruction.RegressionAlgorithm()
+
+
 class RegressionAlgorithm3DTest(unittest.TestCase, MultiAltitudeAlgorithm):
 
     def setUp(self):
@@ -636,6 +1001,14 @@ class CurvedRegressionAlgorithmTest(unittest.TestCase, CurvedAlgorithm):
         self.algorithm.front = ConeFront()
 
 
+class CurvedRegressionAlgorithmArraysTest(unittest.TestCase,
+                                          CurvedArraysAlgorithm):
+
+    def setUp(self):
+        self.algorithm = direction_reconstruction.CurvedRegressionAlgorithm()
+        self.algorithm.front = ConeFront()
+
+
 class CurvedRegressionAlgorithm3DTest(unittest.TestCase,
                                       CurvedAltitudeAlgorithm):
 
@@ -644,5 +1017,47 @@ class CurvedRegressionAlgorithm3DTest(unittest.TestCase,
         self.algorithm.front = ConeFront()
 
 
+class CurvedRegressionAlgorithm3DArraysTest(unittest.TestCase,
+                                            CurvedArraysAlgorithm,
+                                            CurvedAltitudeAlgorithm):
+
+    def setUp(self):
+        self.algorithm = direction_reconstruction.CurvedRegressionAlgorithm3D()
+        self.algorithm.front = ConeFront()
+
+
+class LogicChecksArraysTest(unittest.TestCase):
+
+    def test_fixed_geometry(self):
+        random = RandomState(0)
+        n = 2000
+        # Detectors 0, 1, 2 on a line, 5 at the same position as 4
+        x = array([0., 10., 20., 0., 15., 15.])
+        y = array([0., 0., 0., 10., 10., 10.])
+        z = array([0., 0., 0., 1., 0., 0.])
+        t = random.normal(0, 30, size=(n, 6))
+        t[random.uniform(size=(n, 6)) < 0.4] = nan
+
+        direction_reconstruction._LOGIC_CHECKS_TABLES.clear()
+        checks = direction_reconstruction.logic_checks_arrays(t, x, y, z)
+        expected = []
+        for ti in t:
+            detected = ~isnan(ti)
+            expected.append(direction_reconstruction.logic_checks(
+                ti[detected], x[detected], y[detected], z[detected]))
+        assert_array_equal(checks, expected)
+        self.assertTrue(0 < checks.sum() < n)
+        self.assertEqual(len(direction_reconstruction._LOGIC_CHECKS_TABLES), 1)
+
+        # Equal to the result for positions given per event
+        assert_array_equal(direction_reconstruction.logic_checks_arrays(
+            t, array([x] * n), array([y] * n), array([z] * n)), checks)
+
+        # The table is reused
+        with patch.object(direction_reconstruction, 'logic_checks') as mock_checks:
+            assert_array_equal(direction_reconstruction.logic_checks_arrays(t, x, y, z), checks)
+            self.assertFalse(mock_checks.called)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,12 @@
+import os
 import unittest
 import warnings
 
 from mock import MagicMock, patch, sentinel
-from numpy import isnan, nan
+from numpy import isnan, nan, array
+from numpy.random import RandomState
+from numpy.testing import assert_array_equal
+import tables
 
 from sapphire.analysis import event_utils
 
@@ -211,5 +215,93 @@ class GetDetectorIdsTests(unittest.TestCase):
         self.assertEqual(event_utils.get_detector_ids(station=station, event=event), range(2))
 
 
+class ArraysTests(unittest.TestCase):
+
+    """Compare the array versions to the functions for a single event"""
+
+    def setUp(self):
+        path = os.path.join(os.path.dirname(__file__),
+                            'test_data/esd_coincidences.h5')
+        with tables.open_file(path, 'r') as data:
+            self.events = data.root.station_501.events.read()
+        # Add bad values
+        self.events['t_trigger'][:3] = -999
+        self.events['n2'][3:6] = -1
+        self.events['t3'][5:8] = -999
+        self.events['pulseheights'][8:10, 3] = -1
+        self.station = MagicMock()
+        self.station.detectors = [MagicMock() for _ in range(4)]
+        for detector, area in zip(self.station.detectors, [.5, .5, .25, 1.]):
+            detector.get_area.return_value = area
+        random = RandomState(0)
+        self.offsets = random.normal(0, 5, size=4)
+        self.event_offsets = random.normal(0, 5, size=(len(self.events), 4))
+        self.reference = int(self.events['ext_timestamp'][0])
+
+    def assert_equal_per_event(self, result, func, *args, **kwargs):
+        expected = []
+        for i, event in enumerate(self.events):
+            kwargs_event = {key: value[i] if key == 'offsets' and value.ndim == 2 else value
+                            for key, value in kwargs.items()}
+            expected.append(func(event, *args, **kwargs_event))
+        assert_array_equal(result, array(expected))
+
+    def test_detector_densities_arrays(self):
+        for kwargs in [{'station': self.station}, {'detector_ids': [0, 2]}]:
+            result = event_utils.detector_densities_arrays(self.events, **kwargs)
+            self.assert_equal_per_event(result, event_utils.detector_densities, **kwargs)
+        # Detectors without pulseheight are not present
+        result = event_utils.detector_densities_arrays(self.events)
+        expected = event_utils.detector_densities_arrays(self.events, range(4))
+        expected[8:10, 3] = nan
+        assert_array_equal(result, expected)
+
+    def test_station_density_arrays(self):
+        with warnings.catch_warnings(record=True):
+            for kwargs in [{}, {'station': self.station}, {'detector_ids': [0, 2]}]:
+                result = event_utils.station_density_arrays(self.events, **kwargs)
+                self.assert_equal_per_event(result, event_utils.station_density, **kwargs)
+
+    def test_detector_arrival_times_arrays(self):
+        for offsets in [self.offsets, self.event_offsets]:
+            result = event_utils.detector_arrival_times_arrays(
+                self.events, [0, 1, 2, 3], offsets)
+            self.assert_equal_per_event(result, event_utils.detector_arrival_times,
+                                        [0, 1, 2, 3], offsets=offsets)
+        result = event_utils.detector_arrival_times_arrays(self.events, [1, 2], self.offsets)
+        self.assert_equal_per_event(result, event_utils.detector_arrival_times,
+                                    [1, 2], offsets=self.offsets)
+
+    def test_station_arrival_time_arrays(self):
+        with warnings.catch_warnings(record=True):
+            for offsets in [self.offsets, self.event_offsets]:
+                result = event_utils.station_arrival_time_arrays(
+                    self.events, self.reference, offsets=offsets, station=self.station)
+                self.assert_equal_per_event(result, event_utils.station_arrival_time,
+                                            self.reference, offsets=offsets,
+                                            station=self.station)
+        self.assertTrue(isnan(result[:3]).all())
+
+    def test_relative_detector_arrival_times_arrays(self):
+        result = event_utils.relative_detector_arrival_times_arrays(
+            self.events, self.reference, range(4), offsets=self.event_offsets)
+        expected = [event_utils.relative_detector_arrival_times(
+            event, self.reference, range(4), offsets=offsets)
+            for event, offsets in zip(self.events, self.event_offsets)]
+        assert_array_equal(result, expected)
+
+    def test_get_detector_ids_arrays(self):
+        ids, present = event_utils.get_detector_ids_arrays(self.events)
+        self.assertEqual(ids, range(4))
+        self.assertEqual(present.shape, (len(self.events), 4))
+        self.assertFalse(present[8:10, 3].any())
+        for event, event_present in zip(self.events, present):
+            self.assertEqual(list(event_present.nonzero()[0]),
+                             event_utils.get_detector_ids(event=event))
+        ids, present = event_utils.get_detector_ids_arrays(self.events, self.station)
+        self.assertEqual(ids, range(4))
+        self.assertTrue(present.all())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,21 @@
+import os
+import shutil
+import tempfile
 import unittest
 
 from mock import sentinel, MagicMock, patch
+from numpy import nan, pi, zeros, array, arange
+from numpy.random import RandomState
+from numpy.testing import assert_array_equal
+import tables
 
+from sapphire import api, clusters, storage
 from sapphire.analysis import reconstructions
 
 
+TEST_DATA = 'test_data/esd_coincidences.h5'
+
+
 class ReconstructESDEventsTest(unittest.TestCase):
 
     def setUp(self):
@@ -124,6 +135,47 @@ class ReconstructESDEventsFromSourceTest(ReconstructESDEventsTest):
         pass
 
 
+class ReconstructESDEventsDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_path = self.create_tempfile_from_testdata()
+        cluster = clusters.HiSPARCStations([501], force_stale=True)
+        self.station = cluster.get_station(501)
+
+    def tearDown(self):
+        os.remove(self.data_path)
+
+    def test_reconstruct_and_store_parallel(self):
+        with tables.open_file(self.data_path, 'a') as data:
+            rec = reconstructions.ReconstructESDEvents(
+                data, '/station_501', self.station, progress=False)
+            rec.reconstruct_and_store()
+            expected = rec.reconstructions.read()
+
+            for n_workers, chunksize in [(2, 20), (3, 1000)]:
+                rec_parallel = reconstructions.ReconstructESDEvents(
+                    data, '/station_501', self.station, overwrite=True,
+                    progress=False, destination='reconstructions_parallel')
+                rec_parallel.reconstruct_and_store(n_workers=n_workers,
+                                                   chunksize=chunksize)
+                result = rec_parallel.reconstructions.read()
+                for name in expected.dtype.names:
+                    assert_array_equal(result[name], expected[name])
+                self.assertEqual(rec_parallel.detector_ids, rec.detector_ids)
+                assert_array_equal(rec_parallel.theta, rec.theta)
+                assert_array_equal(rec_parallel.core_x, rec.core_x)
+
+    def create_tempfile_from_testdata(self):
+        fd, tmp_path = tempfile.mkstemp('.h5')
+        os.close(fd)
+        shutil.copyfile(self.get_testdata_path(), tmp_path)
+        return tmp_path
+
+    def get_testdata_path(self):
+        dir_path = os.path.dirname(__file__)
+        return os.path.join(dir_path, TEST_DATA)
+
+
 class ReconstructESDCoincidencesTest(unittest.TestCase):
 
     @patch.object(reconstructions, 'CoincidenceQuery')
@@ -249,6 +301,81 @@ class ReconstructESDCoincidencesTest(unittest.TestCase):
         self.rec.reconstructions.row.append.assert_called_once_with()
 
 
+class ReconstructESDCoincidencesDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = tables.open_file('coincidences.h5', 'w', driver='H5FD_CORE',
+                                     driver_core_backing_store=0)
+        self.n = 25
+        self.create_coincidences()
+        cluster = clusters.BaseCluster()
+        cluster._add_station((0, 0, 0), number=501)
+        cluster._add_station((50, 0, 0), number=502)
+        self.rec = reconstructions.ReconstructESDCoincidences(
+            self.data, progress=False, cluster=cluster)
+
+        random = RandomState(0)
+        self.rec.theta = random.uniform(0, pi / 2, self.n)
+        self.rec.theta[::3] = nan
+        self.rec.phi = random.uniform(-pi, pi, self.n)
+        self.rec.core_x = random.uniform(-100, 100, self.n)
+        self.rec.core_y = random.uniform(-100, 100, self.n)
+        self.rec.station_numbers = [[], [501], [502], [501, 502], [502, 501]] * 5
+
+    def tearDown(self):
+        self.data.close()
+
+    def test_store_reconstructions_blocks(self):
+        self.rec.prepare_output()
+        self.rec.store_reconstructions()
+        expected = self.rec.reconstructions.read()
+
+        for blocksize in [1, 7, 25, 100]:
+            self.rec.destination = 'reconstructions_%d' % blocksize
+            self.rec.prepare_output()
+            self.rec.store_reconstructions(blocksize=blocksize)
+            result = self.rec.reconstructions.read()
+            self.assertEqual(result.dtype, expected.dtype)
+            for name in expected.dtype.names:
+                assert_array_equal(result[name], expected[name])
+
+    def test_store_reconstructions_interrupted(self):
+        self.rec.prepare_output()
+        store_block = self.rec._store_reconstructions_block
+        calls = []
+
+        def store_two_blocks(*args):
+            calls.append(args)
+            if len(calls) > 2:
+                raise KeyboardInterrupt
+            store_block(*args)
+
+        with patch.object(self.rec, '_store_reconstructions_block') as mock_store:
+            mock_store.side_effect = store_two_blocks
+            self.assertRaises(KeyboardInterrupt, self.rec.store_reconstructions, blocksize=10)
+        # Only complete blocks are stored
+        self.assertEqual(self.rec.reconstructions.nrows, 20)
+        assert_array_equal(self.rec.reconstructions.col('id'), range(20))
+
+    def create_coincidences(self):
+        group = self.data.create_group('/', 'coincidences')
+        description = storage.Coincidence.columns.copy()
+        description.update({'s501': tables.BoolCol(pos=12),
+                            's502': tables.BoolCol(pos=13)})
+        coincidences = self.data.create_table(group, 'coincidences', description)
+        rows = zeros(self.n, dtype=coincidences.dtype)
+        rows['id'] = range(self.n)
+        rows['ext_timestamp'] = range(self.n)
+        rows['x'] = 1.
+        rows['zenith'] = 0.5
+        coincidences.append(rows)
+        self.data.create_vlarray(group, 'c_index', tables.UInt32Col(shape=2))
+        s_index = self.data.create_vlarray(group, 's_index', tables.VLStringAtom())
+        for station in ['station_501', 'station_502']:
+            self.data.create_group('/', station)
+            s_index.append('/' + station)
+
+
 class ReconstructESDCoincidencesFromSourceTest(ReconstructESDCoincidencesTest):
 
     @patch.object(reconstructions, 'CoincidenceQuery')
@@ -276,5 +403,51 @@ class ReconstructESDCoincidencesFromSourceTest(ReconstructESDCoincidencesTest):
         pass
 
 
+class TimingOffsetTablesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.station = api.Station(501, force_stale=True)
+        offsets = zeros(3, dtype=[('timestamp', int), ('offset1', float), ('offset2', float),
+                                  ('offset3', float), ('offset4', float)])
+        offsets['timestamp'] = [100, 200, 300]
+        for i in range(1, 5):
+            offsets['offset%d' % i] = arange(3) + 10 * i
+        self.station.__dict__['detector_timing_offsets'] = offsets
+        self.offsets = {501: self.station, 502: [1., 2., 3., 4.]}
+        self.tables = reconstructions.TimingOffsetTables(self.offsets)
+
+    def test_station_offsets(self):
+        timestamps = [50, 100, 150, 199, 200, 250, 300, 1000]
+        result = self.tables.detector_timing_offsets(501, timestamps)
+        expected = [self.station.detector_timing_offset(ts) for ts in timestamps]
+        assert_array_equal(result, expected)
+
+    def test_fixed_offsets(self):
+        result = self.tables.detector_timing_offsets(502, array([0, 200, 2000000000]))
+        assert_array_equal(result, [[1., 2., 3., 4.]] * 3)
+
+    def test_missing_station(self):
+        result = self.tables.detector_timing_offsets(503, [1, 2])
+        assert_array_equal(result, zeros((2, 4)))
+
+    @patch.object(reconstructions.EventDirectionReconstruction, 'reconstruct_event')
+    def test_reconstruct_events_several_intervals(self, mock_reconstruct_event):
+        mock_reconstruct_event.return_value = [sentinel.theta, sentinel.phi, sentinel.ids]
+        events = zeros(4, dtype=[('timestamp', int)])
+        events['timestamp'] = [50, 150, 250, 350]
+        offsets = reconstructions._event_timing_offsets(self.station, events)
+        dirrec = reconstructions.EventDirectionReconstruction(sentinel.station)
+        dirrec.reconstruct_events(events, sentinel.detector_ids, offsets, progress=False)
+        self.assertEqual(mock_reconstruct_event.call_count, 4)
+        for event, call_args in zip(events, mock_reconstruct_event.call_args_list):
+            args = call_args[0]
+            self.assertEqual(args[0], event)
+            assert_array_equal(args[2], self.station.detector_timing_offset(event['timestamp']))
+
+    def test_event_timing_offsets_fixed(self):
+        offsets = reconstructions._event_timing_offsets(sentinel.offsets, sentinel.events)
+        self.assertEqual(offsets, sentinel.offsets)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -5,7 +5,10 @@ import shutil
 
 import tables
 from mock import patch, sentinel, Mock
+from numpy import zeros, arange, median
+from numpy.testing import assert_array_equal
 
+from sapphire import api
 from sapphire.analysis import time_deltas
 
 
@@ -44,6 +47,83 @@ class ProcessTimeDeltasTests(unittest.TestCase):
                           sentinel.station2: mock_offsets.detector_timing_offset,
                           sentinel.station3: mock_offsets.detector_timing_offset})
 
+    def test_determine_time_deltas_for_pair_arrays(self):
+        self.add_coincidences()
+        self.set_detector_offsets()
+        ets, dt = self.td.determine_time_deltas_for_pair(501, 502)
+        # The subset and duplicate station coincidences are skipped
+        self.assertEqual(len(ets), 2 + 60 + 1)
+        ets_arrays, dt_arrays = \
+            self.td.determine_time_deltas_for_pair_arrays(501, 502)
+        assert_array_equal(ets_arrays, ets)
+        assert_array_equal(dt_arrays, dt)
+
+        ets, dt = self.td.determine_time_deltas_for_pair_arrays(501, 503)
+        self.assertEqual(len(ets), 0)
+        self.assertEqual(len(dt), 0)
+
+    def test_determine_and_store_time_deltas_parallel(self):
+        self.add_coincidences()
+        self.set_detector_offsets()
+        self.td.find_station_pairs()
+        node_path = '/time_deltas/station_501/station_502'
+        self.td.determine_and_store_time_deltas_for_pairs()
+        expected = self.data.get_node(node_path, 'time_deltas').read()
+        self.td.determine_and_store_time_deltas_for_pairs(n_workers=2)
+        result = self.data.get_node(node_path, 'time_deltas').read()
+        self.assertEqual(len(result), 2 + 60 + 1)
+        assert_array_equal(result, expected)
+
+        # No time deltas group is left behind if there are no time deltas
+        self.data.remove_node('/time_deltas', recursive=True)
+        self.td.pairs = {(501, 503)}
+        self.td.stations[503] = self.td.stations[502]
+        self.td.determine_and_store_time_deltas_parallel(n_workers=2)
+        self.assertNotIn('/time_deltas', self.data)
+
+    def add_coincidences(self):
+        """Add coincidences of the events of 501 and 502 to the test data
+
+        Also adds a coincidence which is a subset of the previous one and
+        one with the same station twice.
+
+        """
+        coincidences = self.data.root.coincidences.coincidences
+        c_index = self.data.root.coincidences.c_index
+        c_idx = [[[0, i], [1, i]] if i % 2 else [[1, i], [0, i]]
+                 for i in range(60)]
+        c_idx.append([[0, 60], [1, 60], [1, 61]])
+        c_idx.extend([[[0, 62], [1, 62]], [[0, 62], [1, 63]]])
+        rows = zeros(len(c_idx), dtype=coincidences.dtype)
+        rows['id'] = len(coincidences) + arange(len(c_idx))
+        rows['N'] = 2
+        rows['s501'] = True
+        rows['s502'] = True
+        coincidences.append(rows)
+        for idx in c_idx:
+            c_index.append(idx)
+        self.data.flush()
+        self.td = time_deltas.ProcessTimeDeltas(self.data, progress=False)
+
+    def set_detector_offsets(self):
+        """Set piecewise detector offsets without using the API"""
+
+        self.td.stations = {}
+        self.td.detector_timing_offsets = {}
+        for number, path in [(501, '/station_501'), (502, '/station_502')]:
+            timestamps = self.data.get_node(path, 'events').col('timestamp')
+            offsets = zeros(2, dtype=[('timestamp', int), ('offset1', float),
+                                      ('offset2', float), ('offset3', float),
+                                      ('offset4', float)])
+            offsets['timestamp'] = [0, median(timestamps)]
+            for i in range(1, 5):
+                offsets['offset%d' % i] = [i * 1.25, -i * 2.5]
+            station = api.Station(number, force_stale=True)
+            station.__dict__['detector_timing_offsets'] = offsets
+            self.td.stations[number] = station
+            self.td.detector_timing_offsets[number] = \
+                station.detector_timing_offset
+
     def test_store_time_deltas(self):
         pair = (501, 502)
         node_path = '/time_deltas/station_%d/station_%d' % pair
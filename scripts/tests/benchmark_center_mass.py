@@ -0,0 +1,53 @@
+"""Benchmark the batched CenterMassAlgorithm
+
+This script generates random particle densities for the four detectors
+of a station and compares the throughput of the per event
+:meth:`CenterMassAlgorithm.reconstruct_common` to the batched
+:meth:`CenterMassAlgorithm.reconstruct_common_arrays`.
+
+"""
+import time
+
+import numpy as np
+
+from sapphire.analysis.core_reconstruction import CenterMassAlgorithm
+
+
+N = 100000
+
+
+def main():
+    random = np.random.RandomState(1)
+    p = random.exponential(2, size=(N, 4))
+    # Some events with missing detectors
+    p[random.uniform(size=(N, 4)) < 0.1] = np.nan
+    x = np.array([0., -5., 5., 0.])
+    y = np.array([10., 0., 0., -5.])
+    theta = random.uniform(0, np.pi / 3, N)
+
+    t0 = time.time()
+    expected = []
+    for pi, thetai in zip(p, theta):
+        detected = ~np.isnan(pi)
+        if not detected.any():
+            expected.append((np.nan, np.nan))
+            continue
+        expected.append(CenterMassAlgorithm.reconstruct_common(
+            pi[detected], x[detected], y[detected],
+            initial={'theta': thetai}))
+    t_events = time.time() - t0
+
+    t0 = time.time()
+    core_x, core_y = CenterMassAlgorithm.reconstruct_common_arrays(
+        p, x, y, initial={'theta': theta})
+    t_batched = time.time() - t0
+
+    expected = np.array(expected)
+    print 'Per event: %.2f s, %.0f events/s' % (t_events, N / t_events)
+    print 'Batched: %.4f s, %.0f events/s' % (t_batched, N / t_batched)
+    print 'Max difference: %g m' % np.nanmax(
+        abs(np.array([core_x, core_y]).T - expected))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark the EllipsLdfFitAlgorithm against the EllipsLdfAlgorithm
+
+This script simulates particle densities in the stations of a cluster
+using the :class:`~sapphire.simulations.ldf.EllipsLdf`, with Poisson
+fluctuations in the number of detected particles.  The core positions
+reconstructed by the grid search of
+:class:`~sapphire.analysis.core_reconstruction.EllipsLdfAlgorithm` and by
+the vectorized grid and local fit of
+:class:`~sapphire.analysis.core_reconstruction.EllipsLdfFitAlgorithm` are
+compared to the simulated core positions.
+
+"""
+import time
+
+import numpy as np
+
+from sapphire.analysis.core_reconstruction import (EllipsLdfAlgorithm,
+                                                   EllipsLdfFitAlgorithm)
+from sapphire.clusters import ScienceParkCluster
+from sapphire.simulations.ldf import EllipsLdf
+
+
+N = 500
+AREA = 2.
+MAX_CORE_DISTANCE = 100.
+
+
+def simulate(cluster):
+    """Simulate N showers with cores close to the center of the cluster
+
+    Only showers with particles in each station are kept, because the
+    AverageIntersectionAlgorithm used by the grid search requires at least
+    four stations with particles.
+
+    :return: station positions and a list of simulated showers.
+
+    """
+    random = np.random.RandomState(1)
+    x, y = np.array([station.calc_xy_center_of_mass_coordinates()
+                     for station in cluster.stations]).T
+    x0, y0 = x.mean(), y.mean()
+    showers = []
+    while len(showers) < N:
+        theta = random.uniform(0, np.pi / 4)
+        phi = random.uniform(-np.pi, np.pi)
+        size = 10 ** random.uniform(4.5, 6)
+        r = MAX_CORE_DISTANCE * np.sqrt(random.uniform())
+        alpha = random.uniform(-np.pi, np.pi)
+        core_x = x0 + r * np.cos(alpha)
+        core_y = y0 + r * np.sin(alpha)
+        ldf = EllipsLdf(Ne=size, zenith=theta, azimuth=phi)
+        distance, angle = ldf.calculate_core_distance_and_angle(
+            x, y, core_x, core_y)
+        rho = ldf.calculate_ldf_value(distance, angle)
+        p = random.poisson(rho * AREA) / AREA
+        if (p > .01).all():
+            showers.append((p, theta, phi, core_x, core_y))
+    return x, y, showers
+
+
+def reconstruct(algorithm, x, y, showers):
+    """Reconstruct all showers, return the cores and time per event"""
+
+    t0 = time.time()
+    cores = np.array([algorithm.reconstruct(p, x, y, theta, phi)[:2]
+                      for p, theta, phi, _, _ in showers])
+    return cores, (time.time() - t0) / len(showers)
+
+
+def main():
+    cluster = ScienceParkCluster(force_stale=True)
+    x, y, showers = simulate(cluster)
+    true_cores = np.array([shower[3:] for shower in showers])
+
+    grid_cores, t_grid = reconstruct(EllipsLdfAlgorithm, x, y, showers)
+    fit_cores, t_fit = reconstruct(EllipsLdfFitAlgorithm, x, y, showers)
+
+    def distance(a, b):
+        return np.median(np.sqrt(((a - b) ** 2).sum(axis=1)))
+
+    print 'Simulated %d showers on %d stations' % (N, len(x))
+    print 'Median distance to simulated core:'
+    print '  grid search: %.1f m' % distance(grid_cores, true_cores)
+    print '  grid and fit: %.1f m' % distance(fit_cores, true_cores)
+    print 'Median distance between methods: %.1f m' % distance(grid_cores,
+                                                               fit_cores)
+    print 'Time per event: grid search %.1f ms, grid and fit %.1f ms' % (
+        t_grid * 1e3, t_fit * 1e3)
+    print 'Speedup: %.1f' % (t_grid / t_fit)
+
+
+if __name__ == '__main__':
+    main()
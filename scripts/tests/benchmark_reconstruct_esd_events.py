@@ -0,0 +1,83 @@
+"""Benchmark the parallel mode of ReconstructESDEvents
+
+This script simulates flat shower fronts on a single station using
+:class:`~sapphire.simulations.showerfront.FlatFrontSimulation`, and
+reconstructs the directions and cores of the events with
+:class:`~sapphire.analysis.reconstructions.ReconstructESDEvents`, first
+serially and then with an increasing number of worker processes, to show
+how the run time scales with the number of workers.  The output of each
+parallel run is checked against the serial output.
+
+"""
+import multiprocessing
+import time
+
+import numpy as np
+import tables
+
+from sapphire.analysis.reconstructions import ReconstructESDEvents
+from sapphire.clusters import SingleDiamondStation
+from sapphire.simulations.showerfront import FlatFrontSimulation
+
+
+N = 20000
+CHUNKSIZE = 2000
+STATION_GROUP = '/cluster_simulations/station_0'
+
+
+def simulate(data):
+    """Simulate N flat front showers on a single station
+
+    The simulation does not simulate particles, so random particle
+    densities are added to be able to reconstruct the cores.
+
+    """
+    cluster = SingleDiamondStation()
+    sim = FlatFrontSimulation(cluster, data, '/', N, seed=1, progress=False)
+    sim.run()
+    events = data.get_node(STATION_GROUP, 'events')
+    random = np.random.RandomState(1)
+    for id in range(1, 5):
+        events.modify_column(colname='n%d' % id,
+                             column=random.uniform(0.5, 5, N))
+    return cluster.get_station(0)
+
+
+def main():
+    with tables.open_file('benchmark_reconstruct.h5', 'w',
+                          driver='H5FD_CORE',
+                          driver_core_backing_store=0) as data:
+        print 'Simulating %d showers' % N
+        station = simulate(data)
+
+        rec = ReconstructESDEvents(data, STATION_GROUP, station,
+                                   progress=False)
+        t0 = time.time()
+        rec.reconstruct_and_store()
+        t_serial = time.time() - t0
+        expected = rec.reconstructions.read()
+        print 'Serial: %.2f s' % t_serial
+
+        for n_workers in [1, 2, 3, 4, 6, 8]:
+            rec = ReconstructESDEvents(data, STATION_GROUP, station,
+                                       overwrite=True, progress=False,
+                                       destination='parallel')
+            t0 = time.time()
+            rec.reconstruct_and_store(n_workers=n_workers,
+                                      chunksize=CHUNKSIZE)
+            t_parallel = time.time() - t0
+            result = rec.reconstructions.read()
+            identical = all(np.array_equal(result[name], expected[name]) or
+                            np.allclose(result[name], expected[name],
+                                        rtol=0, atol=0, equal_nan=True)
+                            for name in expected.dtype.names)
+            speedup = t_serial / t_parallel
+            print ('%d workers: %.2f s, speedup %.2f, efficiency %.2f, '
+                   'identical: %s' % (n_workers, t_parallel, speedup,
+                                      speedup / n_workers, identical))
+
+    print '(%d CPUs available)' % multiprocessing.cpu_count()
+
+
+if __name__ == '__main__':
+    main()
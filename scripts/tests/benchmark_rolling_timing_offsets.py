@@ -0,0 +1,85 @@
+"""Benchmark the rolling determination of station timing offsets
+
+This script stores random time deltas for a single station pair in a
+temporary file and determines the daily station timing offsets for a
+year with
+:meth:`~sapphire.analysis.calibration.DetermineStationTimingOffsets.determine_station_timing_offsets`
+and with the rolling histograms of
+:meth:`~sapphire.analysis.calibration.DetermineStationTimingOffsets.determine_station_timing_offsets_rolling`.
+The differences between the offsets are given relative to the errors.
+
+"""
+import os
+import tempfile
+import time
+from datetime import date, datetime
+
+import numpy as np
+import tables
+
+from sapphire import storage
+from sapphire.analysis.calibration import DetermineStationTimingOffsets
+from sapphire.transformations.clock import datetime_to_gps
+
+
+N = 300000
+START = date(2016, 1, 1)
+END = date(2016, 12, 31)
+
+
+def store_time_deltas(data):
+    """Store N random time deltas for station 502 relative to 501
+
+    The time deltas are normally distributed around 3 ns, with 2% of
+    uniformly distributed background.
+
+    """
+    random = np.random.RandomState(1)
+    ts0 = datetime_to_gps(datetime(2016, 1, 1))
+    ts1 = datetime_to_gps(datetime(2017, 1, 1))
+    table = data.create_table('/time_deltas/station_501/station_502',
+                              'time_deltas', storage.TimeDelta.columns,
+                              createparents=True)
+    timestamps = np.sort(random.randint(ts0, ts1, N))
+    deltas = np.zeros(N, dtype=table.dtype)
+    deltas['ext_timestamp'] = timestamps * int(1e9)
+    deltas['timestamp'] = timestamps
+    deltas['delta'] = random.normal(3, 20, N)
+    background = random.uniform(size=N) < .02
+    deltas['delta'][background] = random.uniform(-200, 200, background.sum())
+    table.append(deltas)
+
+
+def main():
+    fd, path = tempfile.mkstemp(suffix='.h5')
+    os.close(fd)
+    try:
+        with tables.open_file(path, 'w') as data:
+            store_time_deltas(data)
+
+        with tables.open_file(path, 'r') as data:
+            off = DetermineStationTimingOffsets(stations=[501, 502],
+                                                data=data, force_stale=True)
+            # Load the station information and time deltas
+            off.determine_station_timing_offsets(502, 501, START, START)
+
+            t0 = time.time()
+            expected = np.array(off.determine_station_timing_offsets(
+                502, 501, START, END))
+            t_direct = time.time() - t0
+            t0 = time.time()
+            rolling = np.array(off.determine_station_timing_offsets_rolling(
+                502, 501, START, END))
+            t_rolling = time.time() - t0
+    finally:
+        os.remove(path)
+
+    deviations = abs(rolling[:, 1] - expected[:, 1]) / expected[:, 2]
+    print 'Direct: %.2f s' % t_direct
+    print 'Rolling: %.2f s, speedup %.2f' % (t_rolling, t_direct / t_rolling)
+    print 'Offset differences: mean %.2f, max %.2f times the error' % (
+        deviations.mean(), deviations.max())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark the batched SphereAlgorithm on simulated showers
+
+This script simulates flat shower fronts on a cluster of stations using
+:class:`~sapphire.simulations.showerfront.FlatFrontSimulation` and
+reconstructs the direction of each shower using three stations.  The
+per event :meth:`SphereAlgorithm.reconstruct_source_ECS` is compared to
+the batched :meth:`SphereAlgorithm.reconstruct_source_ECS_arrays`.
+
+"""
+import time
+
+import numpy as np
+import tables
+
+from sapphire.analysis.direction_reconstruction import SphereAlgorithm
+from sapphire.clusters import SimpleCluster
+from sapphire.simulations.showerfront import FlatFrontSimulation
+from sapphire.transformations.geographic import FromWGS84ToENUTransformation
+
+
+N = 5000
+STATIONS = [0, 2, 3]
+
+
+def simulate(data):
+    """Simulate N flat front showers on a simple cluster"""
+
+    cluster = SimpleCluster(size=250)
+    cluster.lla = (52.35592417, 4.95114402, 56.10234594)
+    sim = FlatFrontSimulation(cluster, data, '/', N, seed=1, progress=False)
+    sim.run()
+    return cluster
+
+
+def get_arrival_times_and_positions(data, cluster):
+    """Get arrival times in the first detector of three stations
+
+    :return: arrival times with shape (N, 3) and ECEF x, y, z positions
+             of the first detectors.
+
+    """
+    transform = FromWGS84ToENUTransformation(cluster.lla)
+    t = []
+    xyz = []
+    for number in STATIONS:
+        station = cluster.get_station(number)
+        events = data.get_node('/cluster_simulations/station_%d' % number,
+                               'events')
+        t.append(events.col('t1'))
+        xyz.append(transform.lla_to_ecef(
+            station.detectors[0].get_lla_coordinates()))
+    x, y, z = np.array(xyz).T
+    return np.array(t).T, x, y, z
+
+
+def main():
+    with tables.open_file('benchmark_sphere.h5', 'w',
+                          driver='H5FD_CORE',
+                          driver_core_backing_store=0) as data:
+        print 'Simulating %d showers' % N
+        cluster = simulate(data)
+        t, x, y, z = get_arrival_times_and_positions(data, cluster)
+
+    with np.errstate(all='ignore'):
+        t0 = time.time()
+        expected = np.array([SphereAlgorithm.reconstruct_source_ECS(
+            ti, x, y, z, 0) for ti in t])
+        t_scalar = time.time() - t0
+
+        t0 = time.time()
+        dec, ra = SphereAlgorithm.reconstruct_source_ECS_arrays(t, x, y, z, 0)
+        t_batched = time.time() - t0
+
+    valid = ~np.isnan(dec)
+    print 'Per event: %.3f s' % t_scalar
+    print 'Batched: %.4f s' % t_batched
+    print '%d of %d events reconstructed' % (valid.sum(), len(t))
+    print 'Max difference: %g rad' % max(
+        abs(dec[valid] - expected[valid, 0]).max(),
+        abs(ra[valid] - expected[valid, 1]).max())
+
+
+if __name__ == '__main__':
+    main()
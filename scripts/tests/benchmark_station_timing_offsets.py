@@ -0,0 +1,86 @@
+"""Benchmark the parallel mode of DetermineStationTimingOffsets
+
+This script stores random time deltas for all pairs of Science Park
+stations in a temporary file and determines the station timing offsets
+for a single date with
+:class:`~sapphire.analysis.calibration.DetermineStationTimingOffsets`,
+first serially and then with an increasing number of worker processes.
+The number of station pairs is scaled by including more stations.  The
+output of each parallel run is checked against the serial output.
+
+"""
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import date, datetime
+
+import numpy as np
+import tables
+
+from sapphire import storage
+from sapphire.analysis.calibration import DetermineStationTimingOffsets
+from sapphire.transformations.clock import datetime_to_gps
+
+
+STATIONS = [501, 502, 503, 504, 505, 506, 507, 508, 509, 510, 511]
+DATE = date(2016, 6, 1)
+N = 20000
+
+
+def store_time_deltas(data, stations):
+    """Store N random time deltas for each pair of stations in 2016"""
+
+    random = np.random.RandomState(1)
+    ts0 = datetime_to_gps(datetime(2016, 1, 1))
+    ts1 = datetime_to_gps(datetime(2017, 1, 1))
+    description = storage.TimeDelta.columns
+    for ref_station in stations:
+        for station in stations:
+            if station == ref_station:
+                continue
+            table = data.create_table(
+                '/time_deltas/station_%d/station_%d' % (ref_station, station),
+                'time_deltas', description, createparents=True)
+            timestamps = np.sort(random.randint(ts0, ts1, N))
+            deltas = np.zeros(N, dtype=table.dtype)
+            deltas['ext_timestamp'] = timestamps * int(1e9)
+            deltas['timestamp'] = timestamps
+            deltas['delta'] = random.normal(station - ref_station, 20, N)
+            table.append(deltas)
+
+
+def main():
+    fd, path = tempfile.mkstemp(suffix='.h5')
+    os.close(fd)
+    try:
+        with tables.open_file(path, 'w') as data:
+            store_time_deltas(data, STATIONS)
+
+        with tables.open_file(path, 'r') as data:
+            for n_stations in [3, 5, 8, 11]:
+                off = DetermineStationTimingOffsets(
+                    stations=STATIONS[:n_stations], data=data,
+                    progress=False, force_stale=True)
+                t0 = time.time()
+                expected = off.determine_station_timing_offsets_for_date(DATE)
+                t_serial = time.time() - t0
+                print '%d pairs, serial: %.2f s' % (len(expected), t_serial)
+
+                for n_workers in [1, 2, 4]:
+                    t0 = time.time()
+                    result = off.determine_station_timing_offsets_for_date(
+                        DATE, n_workers=n_workers)
+                    t_parallel = time.time() - t0
+                    print ('    %d workers: %.2f s, speedup %.2f, '
+                           'identical: %s' % (n_workers, t_parallel,
+                                              t_serial / t_parallel,
+                                              result == expected))
+    finally:
+        os.remove(path)
+
+    print '(%d CPUs available)' % multiprocessing.cpu_count()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark storing coincidence reconstructions in blocks
+
+This script creates a coincidences table with 10 ** 6 rows and random
+reconstruction results, and compares the time needed to store the results
+one row at a time to storing them in blocks using
+:meth:`~sapphire.analysis.reconstructions.ReconstructESDCoincidences.store_reconstructions`.
+
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+import tables
+
+from sapphire import storage
+from sapphire.analysis.reconstructions import ReconstructESDCoincidences
+from sapphire.clusters import BaseCluster
+
+
+N = 10 ** 6
+CHUNKSIZE = 10 ** 5
+STATIONS = [501, 502, 503]
+
+
+def create_coincidences(path):
+    """Create a coincidences group with N coincidences"""
+
+    with tables.open_file(path, 'w') as data:
+        group = data.create_group('/', 'coincidences')
+        description = storage.Coincidence.columns.copy()
+        description.update({'s%d' % number: tables.BoolCol(pos=p)
+                            for p, number in enumerate(STATIONS, 12)})
+        coincidences = data.create_table(group, 'coincidences', description,
+                                         expectedrows=N)
+        for start in xrange(0, N, CHUNKSIZE):
+            rows = np.zeros(CHUNKSIZE, dtype=coincidences.dtype)
+            rows['id'] = np.arange(start, start + CHUNKSIZE)
+            rows['ext_timestamp'] = rows['id'] * int(1e9)
+            rows['N'] = 3
+            coincidences.append(rows)
+        coincidences.flush()
+        data.create_vlarray(group, 'c_index', tables.UInt32Col(shape=2))
+        s_index = data.create_vlarray(group, 's_index', tables.VLStringAtom())
+        for number in STATIONS:
+            data.create_group('/', 'station_%d' % number)
+            s_index.append('/station_%d' % number)
+
+
+def set_results(rec):
+    """Set random reconstruction results for all coincidences"""
+
+    random = np.random.RandomState(1)
+    rec.theta = random.uniform(0, np.pi / 2, N)
+    rec.phi = random.uniform(-np.pi, np.pi, N)
+    rec.core_x = random.uniform(-100, 100, N)
+    rec.core_y = random.uniform(-100, 100, N)
+    rec.station_numbers = [STATIONS] * N
+
+
+def time_store(rec, destination, blocksize):
+    rec.destination = destination
+    rec.prepare_output()
+    t0 = time.time()
+    rec.store_reconstructions(blocksize=blocksize)
+    return time.time() - t0
+
+
+def main():
+    fd, path = tempfile.mkstemp('.h5')
+    os.close(fd)
+    try:
+        print 'Creating %d coincidences' % N
+        create_coincidences(path)
+
+        cluster = BaseCluster()
+        for i, number in enumerate(STATIONS):
+            cluster._add_station((i * 100, 0, 0), number=number)
+
+        with tables.open_file(path, 'a') as data:
+            rec = ReconstructESDCoincidences(data, progress=False,
+                                             cluster=cluster)
+            set_results(rec)
+            t = time_store(rec, 'reconstructions', None)
+            print 'Row by row: %.2f s' % t
+            expected = rec.reconstructions.read()
+            for blocksize in [1000, 10000, 100000]:
+                t = time_store(rec, 'reconstructions_%d' % blocksize,
+                               blocksize)
+                result = rec.reconstructions.read()
+                identical = all(np.array_equal(result[name], expected[name])
+                                for name in expected.dtype.names)
+                print 'Blocks of %d: %.2f s, identical: %s' % (
+                    blocksize, t, identical)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
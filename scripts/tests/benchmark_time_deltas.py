@@ -0,0 +1,155 @@
+"""Benchmark the parallel mode of ProcessTimeDeltas
+
+This script stores random coincidences between a number of stations in
+a temporary file and determines the time deltas between all station
+pairs with :class:`~sapphire.analysis.time_deltas.ProcessTimeDeltas`,
+first serially and then with an increasing number of worker processes.
+The number of station pairs is scaled by including more stations.  The
+time deltas stored by each parallel run are checked against the serial
+output.  The time of the batched determination without workers is shown
+for comparison.
+
+The detector timing offsets are normally retrieved from the API, here
+fixed offsets are used so the benchmark does not require network access.
+
+"""
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+import tables
+
+from sapphire import api
+from sapphire.analysis.time_deltas import ProcessTimeDeltas
+
+
+STATIONS = [501, 502, 503, 504, 505, 506, 507, 508]
+N = 20000
+EVENT_COLUMNS = {'timestamp': tables.Time32Col(pos=0),
+                 'ext_timestamp': tables.UInt64Col(pos=1),
+                 't1': tables.Float32Col(pos=2),
+                 't2': tables.Float32Col(pos=3),
+                 't3': tables.Float32Col(pos=4),
+                 't4': tables.Float32Col(pos=5),
+                 't_trigger': tables.Float32Col(pos=6)}
+
+
+def store_coincidences(data, stations):
+    """Store N random coincidences of two or three of the stations"""
+
+    random = np.random.RandomState(1)
+    ets = 1400000000 * int(1e9) + np.arange(N, dtype='uint64') * int(1e6)
+    members = [random.choice(len(stations), random.randint(2, 4),
+                             replace=False) for _ in range(N)]
+
+    c_index = data.create_vlarray('/coincidences', 'c_index',
+                                  tables.UInt32Col(shape=2),
+                                  createparents=True)
+    s_index = data.create_vlarray('/coincidences', 's_index',
+                                  tables.VLStringAtom())
+    n_events = np.zeros(len(stations), dtype=int)
+    for member in members:
+        member.sort()
+        c_index.append([[s_idx, n_events[s_idx]] for s_idx in member])
+        n_events[member] += 1
+
+    for s_idx, number in enumerate(stations):
+        path = '/station_%d' % number
+        s_index.append(path)
+        events = data.create_table(path, 'events', EVENT_COLUMNS,
+                                   createparents=True)
+        in_coincidence = [i for i, member in enumerate(members)
+                          if s_idx in member]
+        rows = np.zeros(len(in_coincidence), dtype=events.dtype)
+        rows['ext_timestamp'] = (ets[in_coincidence] +
+                                 random.randint(0, 500, len(rows)))
+        rows['timestamp'] = rows['ext_timestamp'] // int(1e9)
+        rows['t_trigger'] = 1000
+        for i in range(1, 5):
+            rows['t%d' % i] = random.uniform(990, 1100, len(rows))
+        events.append(rows)
+
+    columns = {'id': tables.UInt32Col(pos=0),
+               'timestamp': tables.Time32Col(pos=1),
+               'ext_timestamp': tables.UInt64Col(pos=2)}
+    columns.update({'s%d' % number: tables.BoolCol(pos=3 + s_idx)
+                    for s_idx, number in enumerate(stations)})
+    coincidences = data.create_table('/coincidences', 'coincidences', columns)
+    rows = np.zeros(N, dtype=coincidences.dtype)
+    rows['id'] = np.arange(N)
+    rows['ext_timestamp'] = ets
+    rows['timestamp'] = ets // int(1e9)
+    for s_idx, number in enumerate(stations):
+        rows['s%d' % number] = [s_idx in member for member in members]
+    coincidences.append(rows)
+
+
+def set_detector_offsets(td):
+    """Use fixed detector offsets instead of offsets from the API"""
+
+    td.stations = {}
+    td.detector_timing_offsets = {}
+    for number in {station for pair in td.pairs for station in pair}:
+        offsets = np.zeros(1, dtype=[('timestamp', int), ('offset1', float),
+                                     ('offset2', float), ('offset3', float),
+                                     ('offset4', float)])
+        for i in range(1, 5):
+            offsets['offset%d' % i] = i * number % 7
+        station = api.Station(number, force_stale=True)
+        station.__dict__['detector_timing_offsets'] = offsets
+        td.stations[number] = station
+        td.detector_timing_offsets[number] = station.detector_timing_offset
+
+
+def read_time_deltas(data, pairs):
+    return {pair: data.get_node('/time_deltas/station_%d/station_%d' % pair,
+                                'time_deltas').read()
+            for pair in pairs}
+
+
+def main():
+    for n_stations in [3, 5, 8]:
+        fd, path = tempfile.mkstemp(suffix='.h5')
+        os.close(fd)
+        try:
+            with tables.open_file(path, 'a') as data:
+                store_coincidences(data, STATIONS[:n_stations])
+                td = ProcessTimeDeltas(data, progress=False)
+                td.find_station_pairs()
+                set_detector_offsets(td)
+
+                t0 = time.time()
+                td.determine_and_store_time_deltas_for_pairs()
+                t_serial = time.time() - t0
+                expected = read_time_deltas(data, td.pairs)
+                print '%d pairs, serial: %.2f s' % (len(td.pairs), t_serial)
+
+                t0 = time.time()
+                for pair in td.pairs:
+                    td.determine_time_deltas_for_pair_arrays(*pair)
+                print '    batched, without storing: %.2f s' % (
+                    time.time() - t0)
+
+                for n_workers in [1, 2, 4]:
+                    t0 = time.time()
+                    td.determine_and_store_time_deltas_for_pairs(
+                        n_workers=n_workers)
+                    t_parallel = time.time() - t0
+                    result = read_time_deltas(data, td.pairs)
+                    identical = all(np.array_equal(result[pair],
+                                                   expected[pair])
+                                    for pair in td.pairs)
+                    print ('    %d workers: %.2f s, speedup %.2f, '
+                           'identical: %s' % (n_workers, t_parallel,
+                                              t_serial / t_parallel,
+                                              identical))
+        finally:
+            os.remove(path)
+
+    print '(%d CPUs available)' % multiprocessing.cpu_count()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Benchmark timerange queries on a large coincidences table
+
+This script creates a coincidences table with 10 ** 7 rows, sorted by
+timestamp and marked as such like those stored by CoincidencesESD, and
+compares the time needed to get all coincidences from a single day using
+the binary search in
+:meth:`~sapphire.analysis.coincidence_queries.CoincidenceQuery.timerange`
+to a query which checks the condition for each row.  Both are timed on a
+freshly opened file, as for a one-off query.
+
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+import tables
+
+from sapphire import storage
+from sapphire.analysis.coincidence_queries import CoincidenceQuery
+
+
+N = 10 ** 7
+CHUNKSIZE = 10 ** 6
+START = 1262304000  # 2010-01-01
+DAY = 86400
+
+
+def create_coincidences(path):
+    """Create a coincidences group with N sorted coincidences"""
+
+    with tables.open_file(path, 'w') as data:
+        group = data.create_group('/', 'coincidences')
+        description = storage.Coincidence.columns.copy()
+        description.update({'s501': tables.BoolCol(pos=12),
+                            's502': tables.BoolCol(pos=13)})
+        coincidences = data.create_table(group, 'coincidences', description,
+                                         expectedrows=N)
+        for start in xrange(0, N, CHUNKSIZE):
+            rows = np.zeros(CHUNKSIZE, dtype=coincidences.dtype)
+            rows['id'] = np.arange(start, start + CHUNKSIZE)
+            # about one coincidence every 30 seconds
+            timestamps = (START + 30 * rows['id'] +
+                          np.random.randint(30, size=CHUNKSIZE))
+            rows['timestamp'] = timestamps
+            rows['ext_timestamp'] = timestamps.astype(np.uint64) * int(1e9)
+            rows['N'] = 2
+            rows['s501'] = True
+            rows['s502'] = True
+            coincidences.append(rows)
+        coincidences.flush()
+        coincidences._v_attrs.sorted_by_timestamp = True
+        data.create_vlarray(group, 'c_index', tables.UInt32Col(shape=2))
+        s_index = data.create_vlarray(group, 's_index', tables.VLStringAtom())
+        for station in ['station_501', 'station_502']:
+            data.create_group('/', station)
+            s_index.append('/' + station)
+
+
+def time_it(func, *args, **kwargs):
+    t0 = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - t0, result
+
+
+def main():
+    fd, path = tempfile.mkstemp('.h5')
+    os.close(fd)
+    try:
+        print 'Creating %d coincidences' % N
+        create_coincidences(path)
+
+        start = START + 1000 * DAY
+        stop = start + DAY
+
+        cq = CoincidenceQuery(path)
+        query = '(%d <= timestamp) & (timestamp < %d)' % (start, stop)
+        t_query, expected = time_it(cq.perform_query, query)
+        print 'Condition query: %.3f s, %d coincidences' % (
+            t_query, len(expected))
+        cq.finish()
+
+        cq = CoincidenceQuery(path)
+        t_bisect, result = time_it(cq.timerange, start, stop)
+        print 'Binary search: %.3f s, %d coincidences' % (
+            t_bisect, len(result))
+        assert (result == expected).all()
+
+        t_iter, n = time_it(lambda: sum(1 for _ in cq.timerange(
+            start, stop, iterator=True)))
+        print 'Binary search, iterator: %.3f s, %d coincidences' % (t_iter, n)
+        cq.finish()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()